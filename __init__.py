@@ -9,13 +9,34 @@ and then call the play method on that instance. eg.
   game_world = rpg.World()
   game_world.play()
 
+Importing the package loads nothing else: each of the names below is
+imported from its module when first used (see PEP 562), so that starting
+a worker process or the command line stays quick, and the optional
+engines (rules, hints, persistence, sessions, shards, analytics ...)
+are only loaded by the games that use them.
+
 Written for the Object-oriented Programming in Python (OOPP) MOOC
 Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
 """
 
-from .character import Character, Enemy, Friend, Player
-from .game_config import default_config
-from .item import Item, Inventory
-from .room import Room
-from .world import World
+import importlib
+
+_EXPORTS = {
+    'Character': 'character', 'Enemy': 'character', 'Friend': 'character',
+    'Player': 'character', 'default_config': 'game_config',
+    'Item': 'item', 'Inventory': 'item', 'Room': 'room', 'World': 'world',
+}
+"""Name exported by the package: the module it is imported from on first use."""
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    """Import exported name from its module on first use, keeping it here after"""
+    if name not in _EXPORTS:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
 
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,73 @@
+""" Command line entry point for the adventure game package.
+
+  python -m rpg                     play the default game interactively
+  python -m rpg play [config]       play game using json config file
+  python -m rpg run ...             play command scripts in batch (see runner.py)
+  python -m rpg validate [config]   check config for problems (see validate.py)
+  python -m rpg stats records...    report on session records (see analytics.py)
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+import argparse
+import sys
+
+def parse_args(argv):
+    """Parse command line argv returning the args namespace"""
+    parser = argparse.ArgumentParser(prog="rpg",
+        description="Lawrie's Simple Text Adventure Game")
+    commands = parser.add_subparsers(dest="command")
+
+    play = commands.add_parser("play", help="play game interactively")
+    play.add_argument("config", nargs="?", default=None,
+                      help="json game config, or .jsonl config stream (default: built in game)")
+
+    run = commands.add_parser("run", help="play command scripts in batch")
+    run.add_argument("scripts", nargs="+", help="command script files")
+    run.add_argument("-c", "--config", default=None,
+                     help="json game config, or .jsonl config stream (default: built in game)")
+    run.add_argument("-o", "--out", default="transcripts",
+                     help="directory for transcripts and summary")
+    run.add_argument("-w", "--workers", type=int, default=None,
+                     help="number of worker processes (default: cpu count)")
+    run.add_argument("-s", "--summary", default=None,
+                     help="json lines summary file (default: OUT/summary.jsonl)")
+    run.add_argument("-a", "--analytics", default=None,
+                     help="append session records to this file (see stats)")
+    run.add_argument("--no-share", action="store_true",
+                     help="load config in each worker, rather than sharing it")
+
+    validate = commands.add_parser("validate", help="check game config for problems")
+    validate.add_argument("config", nargs="?", default=None,
+                          help="json game config, or .jsonl config stream "
+                               "(default: built in game)")
+
+    stats = commands.add_parser("stats", help="report on session records files")
+    stats.add_argument("files", nargs="+", help="session records files")
+    stats.add_argument("-t", "--top", type=int, default=10,
+                       help="number of sessions in leaderboard")
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    """Run the command given in argv (default sys.argv), returning exit status"""
+    args = parse_args(sys.argv[1:] if argv == None else argv)
+    if args.command == "run":
+        from .runner import main as run_main
+        return 0 if run_main(args) else 1
+    if args.command == "validate":
+        from .validate import main as validate_main
+        return 0 if validate_main(args) else 1
+    if args.command == "stats":
+        from .analytics import main as stats_main
+        return 0 if stats_main(args) else 1
+    from .game_config import load_config
+    from .world import World
+    config = load_config(getattr(args, 'config', None))
+    world = World(config)
+    world.allow_hints(config)
+    world.play()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+""" Compact gameplay records for each session, and streaming analytics over them.
+
+When a game ends, its results (as in the batch runner's summary) are
+packed into one fixed size binary record appended to a records file, with
+the names of rooms & enemies (where players died) kept once each in a
+names file alongside it. A record holds:
+
+  session number, turns, seconds taken, enemies vanquished, desires met,
+  rooms visited, items carried, outcome (exited, escaped, died),
+  and the room & enemy where the player died (or -1)
+
+An Aggregator reads records files in chunks, and keeps just running totals,
+so millions of sessions are summarised in constant memory:
+
+  - leaderboard of the top sessions (a heap of the best so far)
+  - funnel of how far players got, and counts of where & to whom they died
+  - percentiles of turns & seconds taken to escape (log scale histograms,
+    accurate to a few percent)
+
+Usually used via the package command line, eg.
+
+  python -m rpg run --analytics results/sessions.bin *.txt
+  python -m rpg stats results/sessions.bin
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+import heapq
+import math
+import os
+import struct
+
+RECORD = struct.Struct("<QIfHHIIBii")
+"""Packed session record: session, turns, seconds, vanquished, desires_met,
+rooms_visited, items, outcome, died_in, died_to."""
+
+OUTCOMES = ("exited", "escaped", "died")
+
+class RecordWriter():
+    """ Appends session records to a records file & its names file. """
+
+    def __init__(self, filename):
+        """Open records filename (and filename.names) to append records"""
+        self.names = {}
+        if os.path.exists(filename + ".names"):
+            with open(filename + ".names") as names_file:
+                for line in names_file:
+                    self.names[line.rstrip("\n")] = len(self.names)
+        self.records_file = open(filename, "ab")
+        self.names_file = open(filename + ".names", "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def name_id(self, name):
+        """Return number of name in names file (or -1 for None), adding if new"""
+        if name == None:
+            return -1
+        number = self.names.get(name)
+        if number == None:
+            number = self.names[name] = len(self.names)
+            self.names_file.write(name + "\n")
+        return number
+
+    def write(self, session, summary):
+        """Append record for session number from summary dict (as returned by
+        runner.play_script, with escaped, counters, items & where died)"""
+        if summary.get('escaped'):
+            outcome = 1
+        elif summary.get('died_to') != None:
+            outcome = 2
+        else:
+            outcome = 0
+        self.records_file.write(RECORD.pack(
+            session, summary.get('turns', 0), summary.get('seconds', 0.0),
+            summary.get('vanquished', 0), summary.get('desires_met', 0),
+            summary.get('rooms_visited', 0), summary.get('items', 0), outcome,
+            self.name_id(summary.get('died_in')), self.name_id(summary.get('died_to'))))
+
+    def close(self):
+        """Close records & names files"""
+        self.records_file.close()
+        self.names_file.close()
+
+def read_records(filename, chunk_records = 8192):
+    """Yield each record tuple in records filename, reading in chunks"""
+    with open(filename, "rb") as records_file:
+        while True:
+            data = records_file.read(RECORD.size * chunk_records)
+            if not data:
+                break
+            yield from RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size])
+
+def read_names(filename):
+    """Return list of names for records filename"""
+    if not os.path.exists(filename + ".names"):
+        return []
+    with open(filename + ".names") as names_file:
+        return [line.rstrip("\n") for line in names_file]
+
+
+class LogHistogram():
+    """ Counts of values in buckets on a log scale, for approximate percentiles. """
+
+    def __init__(self, steps = 32):
+        """Create empty histogram with steps buckets per doubling of value"""
+        self.steps = steps
+        self.counts = {}
+        self.count = 0
+
+    def add(self, value):
+        """Count value (values <= 0 are counted in one lowest bucket)"""
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            bucket = exponent * self.steps + int((mantissa - 0.5) * 2 * self.steps)
+        else:
+            bucket = None
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+
+    def value(self, bucket):
+        """Return middle value of bucket"""
+        if bucket == None:
+            return 0
+        exponent, step = divmod(bucket, self.steps)
+        return math.ldexp(0.5 + (step + 0.5) / (2 * self.steps), exponent)
+
+    def percentile(self, percent):
+        """Return approximate value below which percent of values fall"""
+        if self.count == 0:
+            return None
+        wanted = percent / 100 * self.count
+        seen = 0
+        buckets = sorted(self.counts, key=lambda bucket: -math.inf if bucket == None else bucket)
+        for bucket in buckets:
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return self.value(bucket)
+        return self.value(buckets[-1])
+
+
+class Aggregator():
+    """ Running leaderboard, funnel & percentiles over session records. """
+
+    def __init__(self, top = 10):
+        """Create empty aggregates, keeping the top sessions for the leaderboard"""
+        self.top = top
+        self.best = []              # heap of (score, session) of top sessions, where
+                                    # score is (escaped, enemies & friends dealt with,
+                                    # rooms visited, -turns)
+        self.sessions = 0
+        self.funnel = {'started': 0, 'explored': 0, 'vanquished': 0,
+                       'desire_met': 0, 'escaped': 0}
+        self.outcomes = [0] * len(OUTCOMES)
+        self.died_in = {}           # room name: deaths
+        self.died_to = {}           # enemy name: deaths
+        self.turns = LogHistogram()     # for escaped sessions
+        self.seconds = LogHistogram()
+
+    def add_file(self, filename):
+        """Add all records in records filename to the aggregates"""
+        names = read_names(filename)
+        explored = vanquishers = desires = 0
+        outcomes = self.outcomes
+        best = self.best
+        for record in read_records(filename):
+            (session, turns, seconds, vanquished, desires_met, rooms_visited,
+             items, outcome, died_in, died_to) = record
+            outcomes[outcome] += 1
+            if rooms_visited > 1:
+                explored += 1
+            if vanquished > 0:
+                vanquishers += 1
+            if desires_met > 0:
+                desires += 1
+            if outcome == 1:
+                self.turns.add(turns)
+                self.seconds.add(seconds)
+            elif outcome == 2:
+                room = names[died_in] if died_in >= 0 else None
+                enemy = names[died_to] if died_to >= 0 else None
+                self.died_in[room] = self.died_in.get(room, 0) + 1
+                self.died_to[enemy] = self.died_to.get(enemy, 0) + 1
+            entry = ((outcome == 1, vanquished + desires_met, rooms_visited, -turns), session)
+            if len(best) < self.top:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+        self.sessions = sum(outcomes)
+        funnel = self.funnel
+        funnel['started'] = self.sessions
+        funnel['explored'] += explored
+        funnel['vanquished'] += vanquishers
+        funnel['desire_met'] += desires
+        funnel['escaped'] = outcomes[1]
+
+    def leaderboard(self):
+        """Return list of (session, score) for the top sessions, best first"""
+        return [(session, score) for score, session in sorted(self.best, reverse=True)]
+
+    def report(self):
+        """Print summary of the aggregates"""
+        print("Sessions: " + str(self.sessions) + ", " +
+              ", ".join(outcome + " " + str(count)
+                        for outcome, count in zip(OUTCOMES, self.outcomes)))
+        print("Funnel: " + ", ".join(stage + " " + str(count)
+                                     for stage, count in self.funnel.items()))
+        for title, counts in (("Died in", self.died_in), ("Died to", self.died_to)):
+            if counts:
+                worst = sorted(counts.items(), key=lambda pair: -pair[1])[:5]
+                print(title + ": " + ", ".join(str(name) + " " + str(count)
+                                               for name, count in worst))
+        for title, histogram, form in (("Turns", self.turns, "%.0f"),
+                                       ("Seconds", self.seconds, "%.4f")):
+            if histogram.count:
+                print(title + " to escape: " + ", ".join(
+                    "p" + str(p) + " " + form % histogram.percentile(p)
+                    for p in (50, 90, 99)))
+        print("Leaderboard (session: escaped, dealt with, rooms, -turns):")
+        for session, score in self.leaderboard():
+            print("  " + str(session) + ": " + str(score))
+
+def main(args):
+    """Aggregate & report on records files given parsed command line args
+    (with files, top)"""
+    aggregator = Aggregator(args.top)
+    for filename in args.files:
+        aggregator.add_file(filename)
+    aggregator.report()
+    return True
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+    import resource
+    print("Test session records & streaming aggregation\n")
+
+    rooms = ["Entry Hall", "Kitchen", "Master Bedroom", "Cellar"]
+    enemies = ["Dave", "Rusty"]
+    num_sessions = 1000000
+    rand = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "sessions.bin")
+        start = time.perf_counter()
+        with RecordWriter(filename) as writer:
+            for session in range(num_sessions):
+                summary = {'turns': rand.randint(3, 80), 'seconds': rand.random() / 100,
+                           'vanquished': rand.randint(0, 2), 'desires_met': rand.randint(0, 1),
+                           'rooms_visited': rand.randint(1, 12), 'items': rand.randint(1, 5)}
+                fate = rand.random()
+                if fate < 0.3:
+                    summary['escaped'] = True
+                elif fate < 0.6:
+                    summary['died_in'] = rand.choice(rooms)
+                    summary['died_to'] = rand.choice(enemies)
+                writer.write(session, summary)
+        written = time.perf_counter() - start
+        print("Wrote %d records of %d bytes (%.1f MB) in %.2f sec" %
+              (num_sessions, RECORD.size, os.path.getsize(filename) / 1e6, written))
+
+        start = time.perf_counter()
+        aggregator = Aggregator(5)
+        aggregator.add_file(filename)
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("Aggregated in %.2f sec, peak process memory %.1f MB\n" % (elapsed, peak / 1e3))
+        aggregator.report()
+
+        filename = os.path.join(directory, "grid.bin")
+        with RecordWriter(filename) as writer:
+            for session in range(40000):
+                writer.write(session, {'turns': 5, 'rooms_visited': 70000, 'items': 70000,
+                                       'died_in': "Room " + str(session), 'died_to': "Grue"})
+        last = list(read_records(filename))[-1]
+        print("\nAfter 40000 names, last died in %s, having visited %d rooms" %
+              (read_names(filename)[last[8]], last[5]))
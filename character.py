@@ -5,8 +5,16 @@ initial code from: https://github.com/raspberrypilearning/oop-course/blob/master
 Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
 """
 
-from item import Item, Inventory
-from room import Room
+try:
+    from .item import Item, Inventory
+    from .room import Room
+    from .string_table import text
+    from .combat import DEFAULT_HP, DEFAULT_ENEMY_ATTACK, resolve_fight
+except ImportError:        # run as a script rather than as a package
+    from item import Item, Inventory
+    from room import Room
+    from string_table import text
+    from combat import DEFAULT_HP, DEFAULT_ENEMY_ATTACK, resolve_fight
 import random
 
 class Character():
@@ -14,15 +22,21 @@ class Character():
 
     def __init__(self, char_name, char_description = None):
         """ Create a character with given name & (optional) description.
-        Also has attributes for conversation, current location,
+        Also has attributes for conversation, or a Dialogue and the node reached
+        in it (see dialogue.py), current location, health points (hp) for fights,
         and an inventory of what things they have.
+        Changes are announced to events, if set (see events.py).
         """
         self.name = char_name
         self.description = char_description
         self.conversation = None
+        self.dialogue = None
+        self.node = 0
         self.location = None
         self.prob_move = 0.5
-        self.items = Inventory()
+        self.hp = DEFAULT_HP
+        self.items = Inventory(self)
+        self.events = None
 
     def __str__(self):
         """return name as string representation of self"""
@@ -38,40 +52,65 @@ class Character():
 
     def get_description(self):
         """Returns the character's description"""
-        return self.description
+        return text(self.description)
 
     def set_conversation(self, conversation):
         """ Set what this character will say when talked to """
         self.conversation = conversation
 
+    def set_dialogue(self, dialogue):
+        """ Set branching Dialogue this character speaks when talked to,
+        from its start (unless already speaking it) """
+        if dialogue is not self.dialogue:
+            self.dialogue = dialogue
+            self.node = 0
+
     def get_location(self):
         """Returns the character's location"""
         return self.location
 
+    def get_hp(self):
+        """Returns the character's health points"""
+        return self.hp
+
+    def set_hp(self, hp):
+        """Sets the character's health points"""
+        self.hp = hp
+
     def set_prob_move(self, prob):
         """ Set probability (0.0 - 1.0) this character will randomly move after some interaction """
         self.prob_move = prob
 
     def describe(self):
         """ Describe this character """
-        print( self.name + " is here! " + self.description )
+        print( self.name + " is here! " + text(self.description) )
         if not self.items.is_empty():
             print("  and has " + str(self.items))
 
-    def talk(self):
-        """ Talk to this character, displaying conversation if set """
+    def talk(self, player = None):
+        """ Talk to this character, displaying their dialogue (with player's choices)
+        or conversation if set """
+        if self.dialogue is not None:
+            self.dialogue.talk(self, player)
+            return
         if self.conversation is not None:
-            print("[" + self.name + " says]: " + self.conversation)
+            print("[" + self.name + " says]: " + text(self.conversation))
         else:
             print(self.name + " doesn't want to talk to you")
         self.random_move()       
 
-    def add(self, some_item):
-        """add some_item to character's inventory (used in setup)"""
-        self.items.add(some_item)
+    def say(self, number, player = None):
+        """ Answer this character's dialogue with player's choice number """
+        if self.dialogue is None or not self.dialogue.say(self, player, number):
+            print(self.name + " isn't waiting for that answer")
 
-    def give(self, some_item):
-        """offer to give some_item to character (declined by default).
+    def add(self, some_item, quantity = 1):
+        """add some_item (quantity units if stackable) to character's inventory"""
+        self.items.add(some_item, quantity)
+
+    def give(self, some_item, quantity = 1):
+        """offer to give some_item (quantity units if stackable) to character
+        (declined by default).
         Returns True if accepted, False otherwise."""
         print(self.name + " declines your offer of " + str(some_item))
         return False
@@ -84,8 +123,8 @@ class Character():
         """Return true if character has item_name in inventory, else false"""
         return self.items.has(item_name)
 
-    def take(self, item_name):
-        """Try to take item from charcter (rejected by default)"""
+    def take(self, item_name, quantity = None):
+        """Try to take item (or quantity units of it) from charcter (rejected by default)"""
         the_item = self.items.find(item_name)
         if the_item != None:
             print(self.name + " rejects your attempt to take "+ item_name)
@@ -93,7 +132,7 @@ class Character():
             print(self.name + " doesn't have "+ item_name)       
         return None
 
-    def fight(self, combat_item):
+    def fight(self, combat_item, attacker = None):
         """ Fight with this character, by default wont.
         Returns True if attacker survives, False if not.
         """
@@ -107,10 +146,13 @@ class Character():
         If the room is already occupied, a ValueError is thrown."""
         if isinstance(new_room, Room):
             # swap location from current to new room
+            old_room = self.location
             if self.location != None:
                 self.location.set_occupant(None)
             self.location = new_room
             new_room.set_occupant(self)
+            if self.events != None:
+                self.events.emit("move", self, old_room, new_room)
             return True
         return False
 
@@ -124,10 +166,13 @@ class Character():
             new_room = self.location.move(direction)
             if new_room != self.location and new_room.get_occupant() == None:
                 print(self.name + " leaves the room.")
+                old_room = self.location
                 if self.location != None:
                     self.location.set_occupant(None)
                 self.location = new_room
                 new_room.set_occupant(self)
+                if self.events != None:
+                    self.events.emit("move", self, old_room, new_room)
                 return True
         return False
 
@@ -139,9 +184,11 @@ class Enemy(Character):
 
     def __init__(self, char_name, char_description = None):
         """ Create an enemy character with given name & optional description.
-        Also has attributes for weakness, the message displayed when wins a fight,
-        and a flag indicating whether has lost a fight (which allows items to be taken)."""       
+        Also has attributes for weakness, attack damage done each round of a fight,
+        the message displayed when wins a fight, and a flag indicating whether
+        has lost a fight (which allows items to be taken)."""       
         super().__init__(char_name, char_description)
+        self.attack = DEFAULT_ENEMY_ATTACK
         self.weakness = None
         self.vanquishes = "overpowers you, puny adventurer"
         self.vanquished = False
@@ -156,34 +203,75 @@ class Enemy(Character):
         """Returns whether character has been vanquished in a fight"""
         return self.vanquished
 
+    def revive(self, hp = DEFAULT_HP):
+        """ Bring enemy back to life with hp, if vanquished, announcing the
+        vanquished flag being set back (as a flag event).
+        Returns True if revived, False if not vanquished."""
+        if not self.vanquished:
+            return False
+        self.vanquished = False
+        self.set_hp(hp)
+        if self.events != None:
+            self.events.emit("flag", self, "vanquished", True, False)
+        return True
+
     def get_weakness(self):
         """ Get enemy's weakness in a fight """
         return self.weakness
 
-    def fight(self, combat_item):
-        """ Fight with this enemy, succeeds if combat_item is its weakness.
+    def set_attack(self, attack):
+        """ Set damage enemy does each round of a fight """
+        self.attack = attack
+
+    def damage_from(self, combat_item):
+        """ Return damage combat_item does to this enemy each round:
+        its attack, or at least all the enemy's hp if it is the weakness."""
+        damage = getattr(combat_item, "attack", 0)
+        if combat_item == self.weakness:
+            damage = max(damage, self.hp)
+        return damage
+
+    def fight(self, combat_item, attacker = None):
+        """ Fight with this enemy, resolved in rounds by the damage combat_item
+        does and by each side's hp (see combat.py), where the enemy's weakness
+        always wins straight away. Attacker (if given) loses hp for damage taken.
         Updates Enemy.num_vanquished if enemy defeated. 
         Returns True if attacker survives, False if not.
         """
-        if combat_item == self.weakness:
+        hp = attacker.hp if attacker != None else DEFAULT_HP
+        outcome, rounds, hp_left = resolve_fight(hp, self.damage_from(combat_item),
+                                                 self.hp, self.attack)
+        if attacker != None:
+            attacker.hp = hp_left
+        if outcome > 0:
             print("You fend " + self.name + " off with the " + str(combat_item) )
+            if rounds > 1:
+                print("after " + str(rounds) + " rounds, leaving you with " +
+                      str(hp_left) + " health")
             if not self.vanquished:
                 Enemy.num_vanquished += 1
                 self.vanquished = True
+                if self.events != None:
+                    self.events.emit("vanquished", self)
+            return True
+        elif outcome == 0:
+            print("Neither you nor " + self.name + " can hurt the other, so you back away")
             return True
         else:
-            print(self.name + " " + self.vanquishes)
+            print(self.name + " " + text(self.vanquishes))
+            if attacker != None and self.events != None:
+                self.events.emit("defeated", attacker, self)
             return False
 
-    def take(self, item_name):
-        """Try to take item from enemy.
+    def take(self, item_name, quantity = None):
+        """Try to take item (or quantity units of it) from enemy.
         Only succeeds if enemy has item and been vanquished, returing item.
         Otherwise print result & return None."""
         the_item = self.items.find(item_name)
         if the_item != None:
             if self.vanquished:
                 print(self.name + " dejectedly hands over "+ item_name)
-                self.items.remove(the_item)
+                self.items.remove(the_item, quantity)
                 return the_item
             else:
                 print(self.name + " says you must win a fight to get "+ item_name)
@@ -192,6 +280,21 @@ class Enemy(Character):
             print(self.name + " doesn't have "+ item_name)       
         return None
 
+class Hunter(Enemy):
+    """Define Hunter sub-class for enemies who pursue the player."""
+
+    def pursue(self, field):
+        """ Move one step towards the player, along a DistanceField kept by
+        the world (see pursuit.py), unless vanquished, already with the
+        player, out of range of the field, or the way is occupied.
+        Returns True if moved, False if not."""
+        if self.vanquished or self.location == None:
+            return False
+        new_room = field.step(self.location)
+        if new_room == None or new_room.get_occupant() != None:
+            return False
+        return self.move_to(new_room)
+
 class Friend(Character):
     """Define Friend sub-class with details for friend NPCs."""
 
@@ -221,8 +324,8 @@ class Friend(Character):
         """Returns whether character's desired item has been gifted"""
         return self.desire_met
 
-    def give(self, some_item):
-        """offer to give some_item to friend, who always accepts.
+    def give(self, some_item, quantity = 1):
+        """offer to give some_item (quantity units if stackable) to friend, who always accepts.
         If the gift is the friend's desired item, display thank_msg
         and update self.desire_met and Friend.num_desires_met.
         Returns True if accepted, False otherwise."""
@@ -230,17 +333,19 @@ class Friend(Character):
             print(self.name + " declines your offer of " + str(some_item))
             return False
         print(self.name + " gladly accepts your offer of "+ str(some_item))
-        self.items.add(some_item)
+        self.items.add(some_item, quantity)
         if self.desires == some_item:
             if not self.desire_met:
                 Friend.num_desires_met += 1
                 self.desire_met = True
+                if self.events != None:
+                    self.events.emit("desire_met", self)
             if self.thank_msg != None:
                 print(self.thank_msg)
         return True
 
-    def take(self, item_name):
-        """Try to take item from friend.
+    def take(self, item_name, quantity = None):
+        """Try to take item (or quantity units of it) from friend.
         Only succeeds if friend has desired item, and you're not trying to take it.
         Returns item if ok, otherwise print result & return None."""
         the_item = self.items.find(item_name)
@@ -248,7 +353,7 @@ class Friend(Character):
             if self.desire_met:
                 if the_item != self.desires:
                     print(self.name + " hands over "+ item_name)
-                    self.items.remove(the_item)
+                    self.items.remove(the_item, quantity)
                     return the_item
                 else:
                     print(self.name + " says you can't have my precious " + item_name)                    
@@ -265,12 +370,14 @@ class Player(Character):
 
     def __init__(self, char_name, char_description = None):
         """ Create the player character with given name & optional description.
-        Used to represent the game player, for consistent character use."""       
+        Used to represent the game player, for consistent character use.
+        Also has a flag indicating whether they escaped using the magic word."""       
         super().__init__(char_name, char_description)
+        self.escaped = False
 
-    def remove(self, some_item):
-        """remove some_item from character's inventory"""
-        self.items.remove(some_item)
+    def remove(self, some_item, quantity = None):
+        """remove some_item (or just quantity units of it) from character's inventory"""
+        self.items.remove(some_item, quantity)
 
     def carries(self):
         """ List items player currently has """
@@ -291,7 +398,10 @@ class Player(Character):
         """ Change player location to specified room.
         Override Character method since not changing room occupant details."""
         if isinstance(new_room, Room):
+            old_room = self.location
             self.location = new_room
+            if self.events != None and new_room != old_room:
+                self.events.emit("move", self, old_room, new_room)
             return True
         return False
 
@@ -353,6 +463,16 @@ if __name__ == "__main__":
     dave.fight("sword")
     dave.fight("garlic")
     print("Show if Dave has been vanquished: " + str(dave.was_vanquished()))
+    print("Fight Rusty with hp 12 & attack 3, using a sword (attack 5) then a stick")
+    rusty = Enemy("Rusty", "A rusty armoured knight")
+    rusty.set_hp(12)
+    rusty.set_attack(3)
+    sword = Item("sword", "A sharp sword")
+    sword.set_attack(5)
+    fighter = Player("Fighter")
+    print("Fighter survives with sword: " + str(rusty.fight(sword, fighter)) +
+          ", hp now " + str(fighter.get_hp()))
+    print("Fighter survives with stick: " + str(rusty.fight("stick", fighter)))
     dave.take("bones")
     dave.describe()
     print("Enemy.num_vanquished is " + str(Enemy.num_vanquished) )
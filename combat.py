@@ -0,0 +1,121 @@
+""" Stat based combat used for fights in the adventure game.
+
+Each fight is between an attacker (usually the player) with health points
+(hp) and the damage of the item they fight with, and a defender (an enemy)
+with hp and an attack. They strike in turn, attacker first, each strike
+taking its damage from the other's hp, until one of them has no hp left,
+or max_rounds have passed without either being hurt enough (a stand off,
+which the attacker survives).
+
+Since strikes always do the same damage, the round in which each side
+would fall is found directly (the rounds needed to take all their hp),
+so a CombatBatch resolves any number of fights at once from arrays of
+combatant stats, without a Python call per round or per strike. Simulators
+can use a CombatBatch, while Enemy.fight resolves a single fight the same way.
+
+The old weakness rules map onto this: an enemy's weakness always does at
+least the enemy's hp in damage (so wins in the first round), other items do
+their attack damage (0 unless configured), and the default enemy attack
+equals the default player hp (so an enemy not beaten in the first round wins).
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+from array import array
+
+DEFAULT_HP = 10
+"""Default health points for characters."""
+
+DEFAULT_ENEMY_ATTACK = 10
+"""Default damage done by an enemy each round (takes all default hp)."""
+
+MAX_ROUNDS = 100
+"""Rounds after which a fight is a stand off."""
+
+def rounds_to_fall(hp, damage):
+    """Return round in which a combatant with hp falls to damage per round
+    (MAX_ROUNDS + 1 if never, or not within MAX_ROUNDS)."""
+    if damage <= 0:
+        return MAX_ROUNDS + 1
+    return min(-(-hp // damage), MAX_ROUNDS + 1)
+
+def resolve_fight(attacker_hp, damage, defender_hp, defender_attack):
+    """Resolve one fight, returning (outcome, rounds, attacker_hp_left), where
+    outcome is 1 if attacker wins, -1 if defender wins, 0 for a stand off."""
+    attacker_wins = rounds_to_fall(defender_hp, damage)
+    defender_wins = rounds_to_fall(attacker_hp, defender_attack)
+    if attacker_wins <= defender_wins and attacker_wins <= MAX_ROUNDS:
+        # defender strikes back in all the earlier rounds
+        return 1, attacker_wins, attacker_hp - (attacker_wins - 1) * defender_attack
+    if defender_wins <= MAX_ROUNDS:
+        return -1, defender_wins, 0
+    return 0, MAX_ROUNDS, attacker_hp - MAX_ROUNDS * max(defender_attack, 0)
+
+
+class CombatBatch():
+    """ Many fights, held as arrays of combatant stats, resolved together. """
+
+    def __init__(self):
+        """Create empty batch of fights"""
+        self.attacker_hp = array('l')
+        self.damage = array('l')
+        self.defender_hp = array('l')
+        self.defender_attack = array('l')
+
+    def __len__(self):
+        """return number of fights in batch"""
+        return len(self.attacker_hp)
+
+    def add(self, attacker_hp, damage, defender_hp, defender_attack):
+        """Add a fight to the batch, returning its number"""
+        self.attacker_hp.append(attacker_hp)
+        self.damage.append(damage)
+        self.defender_hp.append(defender_hp)
+        self.defender_attack.append(defender_attack)
+        return len(self.attacker_hp) - 1
+
+    def resolve(self):
+        """Resolve every fight in the batch, returning arrays
+        (outcomes, rounds, attacker_hp_left), as for resolve_fight."""
+        limit = MAX_ROUNDS + 1
+        attacker_falls = array('l', map(rounds_to_fall, self.attacker_hp, self.defender_attack))
+        defender_falls = array('l', map(rounds_to_fall, self.defender_hp, self.damage))
+        outcomes = array('b', [1 if d <= a and d < limit else (-1 if a < limit else 0)
+                               for a, d in zip(attacker_falls, defender_falls)])
+        rounds = array('l', [min(a, d, MAX_ROUNDS)
+                             for a, d in zip(attacker_falls, defender_falls)])
+        hp_left = array('l', [0 if outcome < 0 else hp - (r - (outcome > 0)) * max(attack, 0)
+                              for outcome, r, hp, attack
+                              in zip(outcomes, rounds, self.attacker_hp, self.defender_attack)])
+        return outcomes, rounds, hp_left
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import random
+    import time
+    print("Test combat resolution\n")
+
+    for fight in [(10, 10, 10, 10), (10, 0, 10, 10), (10, 4, 10, 3),
+                  (10, 3, 10, 4), (10, 0, 10, 0), (20, 5, 12, 6)]:
+        print("attacker hp %d damage %d vs defender hp %d attack %d gives %s"
+              % (fight + (resolve_fight(*fight),)))
+
+    batch = CombatBatch()
+    rand = random.Random(1)
+    fights = [(rand.randint(1, 50), rand.randint(0, 10),
+               rand.randint(1, 50), rand.randint(0, 10)) for i in range(200000)]
+    for fight in fights:
+        batch.add(*fight)
+    start = time.perf_counter()
+    outcomes, rounds, hp_left = batch.resolve()
+    elapsed = time.perf_counter() - start
+    same = all((outcomes[i], rounds[i], hp_left[i]) == resolve_fight(*fights[i])
+               for i in range(len(fights)))
+    print("\nResolved %d fights in %.3f sec (%.2f usec each), same as one at a time: %s"
+          % (len(batch), elapsed, elapsed * 1e6 / len(batch), same))
+    print("Attacker wins %d, defender wins %d, stand offs %d" %
+          (outcomes.tolist().count(1), outcomes.tolist().count(-1),
+           outcomes.tolist().count(0)))
@@ -0,0 +1,256 @@
+""" Branching dialogue for characters, compiled to shared state machines.
+
+A dialogue is given in the optional 'dialogues' config section as a list
+of nodes, the first being where conversations start:
+
+  'dialogues': { name: [ (node_id, text, [ (choice, next_node, condition, effect)* ])* ] }
+
+Talking to a character shows the text of their current node, and the
+choices whose condition holds, numbered, which the player picks with
+'say number'. A choice moves the character to its next node (or back to
+the start if None), after making its effect (if any). A node without
+choices ends the conversation, and is said again when next talked to.
+Conditions and effects are None, or a tuple of a kind and an argument:
+
+  conditions: ("has", item), ("lacks", item)         whether the player carries item
+              ("flag", flag), ("not_flag", flag)     whether the character's flag
+                                                     (eg. desire_met) is set
+  effects:    ("give", item)    character gives player item (all units, if it has it)
+              ("take", item)    player offers item (all units) to character, as for
+                                the give command
+              ("hp", amount)    player's hp changes by amount
+
+A character whose conversation in the config names a dialogue speaks it.
+
+Each dialogue is compiled once per world into flat tables (lists indexed by
+node and choice number), shared by every character speaking it, and each
+character keeps just the number of its current node. So thousands of
+generated characters reusing a dialogue cost one int each, and each step
+of a conversation is a lookup in the tables.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .string_table import text
+except ImportError:        # run as a script rather than as a package
+    from string_table import text
+
+def _has(character, player, item_name):
+    return player != None and player.has(item_name)
+
+def _lacks(character, player, item_name):
+    return player == None or not player.has(item_name)
+
+def _flag(character, player, flag):
+    return bool(getattr(character, flag, False))
+
+def _not_flag(character, player, flag):
+    return not getattr(character, flag, False)
+
+def _give(character, player, item_name):
+    item = character.find(item_name)
+    if item != None and player != None:
+        units = character.items.count(item_name)
+        character.items.remove(item, units)
+        player.add(item, units)
+        print(character.get_name() + " gives you the " + item_name)
+
+def _take(character, player, item_name):
+    item = None if player == None else player.find(item_name)
+    if item != None:
+        units = player.items.count(item_name)
+        if character.give(item, units):
+            player.remove(item, units)
+
+def _hp(character, player, amount):
+    if player != None:
+        player.set_hp(player.get_hp() + amount)
+        print("You feel " + ("better" if amount > 0 else "worse"))
+
+CONDITIONS = {'has': _has, 'lacks': _lacks, 'flag': _flag, 'not_flag': _not_flag}
+"""Condition kind: function(character, player, argument) returning whether it holds."""
+
+EFFECTS = {'give': _give, 'take': _take, 'hp': _hp}
+"""Effect kind: function(character, player, argument) making the effect."""
+
+
+class Dialogue():
+    """ A dialogue compiled to tables of nodes & choices, shared by the characters speaking it. """
+
+    def __init__(self, name, nodes, strings = None):
+        """Compile dialogue called name from its config list of nodes, keeping
+        texts in strings StringTable (if given). Raises ValueError naming
+        any unknown node, condition or effect."""
+        intern = strings.intern if strings != None else (lambda value: value)
+        self.name = name
+        self.node_ids = [node[0] for node in nodes]
+        number = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.texts = []             # node: text said
+        self.choices = []           # node: tuple of its choice numbers
+        self.choice_texts = []      # choice: text of choice
+        self.next_node = []         # choice: node moved to
+        self.tests = []             # choice: (condition function, argument) or None
+        self.effects = []           # choice: (effect function, argument) or None
+        for node_id, said, choices in nodes:
+            self.texts.append(intern(said))
+            first = len(self.choice_texts)
+            for choice in choices:
+                choice_text, next_id, condition, effect = choice
+                if next_id != None and next_id not in number:
+                    raise ValueError("dialogue " + name + " node " + str(node_id) +
+                                     " goes to unknown node " + str(next_id))
+                self.choice_texts.append(intern(choice_text))
+                self.next_node.append(0 if next_id == None else number[next_id])
+                self.tests.append(_compile(condition, CONDITIONS, name))
+                self.effects.append(_compile(effect, EFFECTS, name))
+            self.choices.append(tuple(range(first, len(self.choice_texts))))
+
+    def __str__(self):
+        """return summary of dialogue as string representation"""
+        return ("Dialogue " + self.name + " of " + str(len(self.texts)) + " nodes and " +
+                str(len(self.choice_texts)) + " choices")
+
+    def available(self, character, player):
+        """Return list of choice numbers open to player at character's current node"""
+        return [choice for choice in self.choices[character.node]
+                if self.tests[choice] == None or
+                self.tests[choice][0](character, player, self.tests[choice][1])]
+
+    def talk(self, character, player):
+        """Print what character says at its current node, and player's numbered choices"""
+        print("[" + character.get_name() + " says]: " + text(self.texts[character.node]))
+        for i, choice in enumerate(self.available(character, player)):
+            print("  " + str(i + 1) + ": " + text(self.choice_texts[choice]))
+
+    def say(self, character, player, number):
+        """Pick player's choice number (from 1, as listed by talk), making its
+        effect and moving character to the next node, then talk from there.
+        Returns False if there is no such choice."""
+        available = self.available(character, player)
+        if not 1 <= number <= len(available):
+            return False
+        choice = available[number - 1]
+        if self.effects[choice] != None:
+            self.effects[choice][0](character, player, self.effects[choice][1])
+        old_node, character.node = character.node, self.next_node[choice]
+        if character.events != None and old_node != character.node:
+            character.events.emit("dialogue", character, old_node, character.node)
+        self.talk(character, player)
+        return True
+
+def _compile(spec, kinds, name):
+    """Return (function, argument) for condition or effect spec (kind, argument)
+    looked up in kinds, or None if spec is None"""
+    if spec == None:
+        return None
+    if spec[0] not in kinds:
+        raise ValueError("dialogue " + name + " has unknown condition or effect " + str(spec[0]))
+    return (kinds[spec[0]], spec[1])
+
+def compile_dialogues(config, strings = None):
+    """Return dict of name: Dialogue for the optional dialogues section of config"""
+    return {name: Dialogue(name, nodes, strings)
+            for name, nodes in config.get('dialogues', {}).items()}
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import copy
+    import io
+    import time
+    import tracemalloc
+    from character import Character, Friend, Player
+    from item import Item
+    print("Test Dialogue\n")
+
+    nodes = [
+        ("start", "Halt! Who goes there?",
+         [("A friend, with a gift of wine", "thanks", ("has", "wine"), ("take", "wine")),
+          ("Just passing through", "start", None, None),
+          ("Can you let me in?", "refuse", ("not_flag", "desire_met"), None),
+          ("You promised me the key", "key", ("flag", "desire_met"), None)]),
+        ("thanks", "How kind! Ask me for anything.",
+         [("The key to the gate, please", "key", None, ("give", "key")),
+          ("Nothing, thanks", None, None, None)]),
+        ("key", "Off with you then, and mind the dog.", []),
+        ("refuse", "Not without a gift, you don't.",
+         [("Fine", None, None, ("hp", -1))]),
+    ]
+    guard = Dialogue("guard", nodes)
+    print(str(guard))
+    gate_keeper = Friend("Gus", "A bored gate keeper")
+    gate_keeper.add(Item("key", "A big iron key"))
+    gate_keeper.set_desires(Item("wine"))
+    gate_keeper.set_dialogue(guard)
+    me = Player("Me")
+    gate_keeper.talk(me)
+    print("> say 3")
+    gate_keeper.say(3, me)
+    print("> say 1")
+    gate_keeper.say(1, me)
+    me.add(Item("wine", "A bottle of wine"))
+    print("Got some wine, player hp " + str(me.get_hp()))
+    gate_keeper.talk(me)
+    print("> say 1")
+    gate_keeper.say(1, me)
+    print("> say 1")
+    gate_keeper.say(1, me)
+    print("Player now has " + str(me.items) + ", Gus has " + str(gate_keeper.items))
+    print("> say 1")
+    gate_keeper.say(1, me)
+
+    print("\nTrading a stack of 10 coins back and forth")
+    trade = Dialogue("trade", [
+        ("start", "Got any money?",
+         [("Here, have my coins", "start", ("has", "coins"), ("take", "coins")),
+          ("Give them back!", "start", ("lacks", "coins"), ("give", "coins"))])])
+    coins = Item("coins", "Shiny gold coins")
+    coins.set_stackable()
+    carlotta = Friend("Carlotta", "A greedy ghost")
+    carlotta.set_desires(coins)
+    carlotta.set_dialogue(trade)
+    me.add(coins, 10)
+    with contextlib.redirect_stdout(io.StringIO()):
+        carlotta.say(1, me)
+    print("After handing over: Carlotta has " + str(carlotta.items.count("coins")) +
+          " coins, player has " + str(me.items.count("coins")))
+    with contextlib.redirect_stdout(io.StringIO()):
+        carlotta.say(1, me)
+    print("After getting back: Carlotta has " + str(carlotta.items.count("coins")) +
+          " coins, player has " + str(me.items.count("coins")))
+
+    try:
+        Dialogue("broken", [("start", "Hi", [("Bye", "end", None, None)])])
+    except ValueError as msg:
+        print("Broken dialogue: " + str(msg))
+
+    print("\nMemory of 10000 characters sharing a compiled dialogue, vs each with a copy")
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    shared = []
+    for i in range(10000):
+        npc = Character("npc" + str(i))
+        npc.set_dialogue(guard)
+        shared.append(npc)
+    shared_bytes = tracemalloc.get_traced_memory()[0] - start
+    start = tracemalloc.get_traced_memory()[0]
+    copied = []
+    for i in range(10000):
+        npc = Character("npc" + str(i))
+        npc.set_conversation(copy.deepcopy(nodes))
+        copied.append(npc)
+    copied_bytes = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print("shared: %d bytes per character, copied: %d bytes per character"
+          % (shared_bytes // 10000, copied_bytes // 10000))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for npc in shared:
+            npc.say(2, me)
+        elapsed = time.perf_counter() - start
+    print("10000 say steps in %.3f sec (%.1f usec each)" % (elapsed, elapsed * 1e6 / 10000))
@@ -0,0 +1,66 @@
+""" Define Events class used to tell other parts of a game about changes.
+
+Each World has an Events object, which its rooms and characters (and
+through them, their inventories) use to announce changes to the game state.
+Other parts of the game (eg. indexes) subscribe a handler for the kinds of
+event they need to know about. The events emitted, with their arguments, are:
+
+  add (holder, item, units)     item added to holder's (room or character) inventory
+  remove (holder, item, units)  item removed from holder's inventory
+                                (units is how many, for stackable items, else 1)
+  move (character, from, to)    character moved from room to room (from may be None)
+  vanquished (enemy)            enemy vanquished for the first time
+  defeated (character, enemy)   character (eg. player) lost a fight with enemy
+  desire_met (friend)           friend given their desire for the first time
+  visited (room)                room described to the player for the first time
+  used (room, item)             room's key item used in it
+  dialogue (character, from, to)  character's dialogue moved from node to node
+  rule (number)                 rule number fired (see rules.py)
+  link (room, direction, from, to)  room's link in direction changed from room to room
+                                (either may be None, for no link)
+  flag (thing, flag, old, new)  room's or character's flag (eg. vanquished, visited)
+                                set directly from old to new value, rather than by play
+                                (eg. by undo & redo, or an enemy coming back to life)
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+class Events():
+    """ The handlers subscribed to each kind of event in a game world. """
+
+    def __init__(self):
+        """Create with no handlers subscribed"""
+        self.handlers = {}
+
+    def subscribe(self, kind, handler):
+        """Call handler with the event arguments whenever kind of event is emitted"""
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def unsubscribe(self, kind, handler):
+        """Stop calling handler for kind of event"""
+        if handler in self.handlers.get(kind, []):
+            self.handlers[kind].remove(handler)
+
+    def emit(self, kind, *args):
+        """Call each handler subscribed to kind of event with args"""
+        handlers = self.handlers.get(kind)
+        if handlers:
+            for handler in handlers:
+                handler(*args)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    print("Test Events class\n")
+
+    events = Events()
+    events.emit("add", "Kitchen", "knife", 1)      # nobody listening
+    def show(holder, item, units):
+        print("Added " + str(units) + " " + str(item) + " to " + str(holder))
+    events.subscribe("add", show)
+    events.emit("add", "Kitchen", "knife", 1)
+    events.unsubscribe("add", show)
+    events.emit("add", "Kitchen", "fork", 1)
+    print("Handlers now: " + str(events.handlers))
@@ -6,13 +6,36 @@ config = {
     'title': "title for game world",
     'rooms': [ (name, description, key_item, used_msg)* ],
     'links': [ (room1, direction1, room2, direction2)* ],
-    'items': [ (name, description, location)* ],
-    'enemies': [ (name, description, conversation, location, weakness, defeat_msg)* ],
+    'items': [ (name, description, location, [attack, quantity])* ],   # location may be None
+    'enemies': [ (name, description, conversation, location, weakness, defeat_msg, [hp, attack])* ],
+    'hunters': [ (as for enemies)* ],           # optional, enemies who pursue the player
+    'containers': [ (item name, key_item)* ],   # optional, items holding other items
+    'dialogues': { name: [ (node_id, text, [ (choice, next_node, condition, effect)* ])* ] },
+                                                # optional, see dialogue.py
+    'rules': [ (when, what, where, conditions, actions, message)* ],   # optional, see rules.py
+    'timers': [ (kind, name, seconds, ...)* ],  # optional, timed events, see timers.py
     'friends': [ (name, description, conversation, location, desire, thank_msg)* ],
-    'players': [ (name, description, location)* ],
+    'players': [ (name, description, location, [hp])* ],
     'messages': { name: text },
     'success': (magic_word, item_needed, item_not_have, num_enemies, num_friends, num_rooms)
 }
+
+Fields in [] are optional stats for fights (see combat.py): the damage an
+item does, an enemy's hp and attack damage, and the player's hp. Without them
+fights go by the enemy's weakness alone, as beating the enemy straight away.
+An item given a quantity is stackable, starting with that many units, so
+that commands such as 'take 5 coins' or 'give 3 arrows' move some of them.
+Items listed as containers (such as bags or chests) hold other items, which
+are placed in them by giving the container (listed before them) as their
+location. A container with a key item can only be put into or taken out of
+while carrying the key.
+An enemy or friend whose conversation names one of the dialogues speaks
+that branching dialogue, with the player answering by number.
+Rules make things happen when the player uses or takes items, enters rooms,
+vanquishes enemies or meets friends' desires, such as opening new links or
+placing items (which may start nowhere, with location None).
+Timers make things happen as time passes, such as characters wandering,
+doors closing or enemies coming back to life.
 """
 
 import sys
@@ -141,16 +164,21 @@ default_config = {
 'help': """Enter one of the following commands:
 exit\t\t- abandon all hope and leave the game
 fight with_item\t- fight room inhabitant with item
-give some_item\t- offer item to room inhabitant
+give some_item\t- offer item to room inhabitant (or give 3 arrows etc)
 go direction\t- move in named direction (eg. north, south etc) if possible
 help\t\t- display this help list
+hint\t\t- suggest what to do next
 leave item\t- leave (or drop) item in current room
 list\t\t- list (or have) items you are carrying
 look\t\t- describe current room and what you carry
 look direction\t- look at room in given direction
 look item\t- look at some item you have, or in current room, or on occupant
 look occupant\t- look at room occupant
-take item\t- take an item from the current room
+map\t\t- draw a map of the rooms you have visited around you
+put item in bag\t- put an item into a container you have or in current room
+say number\t- answer inhabitant of room with your numbered choice
+take item\t- take an item from the current room, or a container (or take 5 coins etc)
+undo\t\t- undo your last command (redo to do it again)
 talk\t\t- talk to inhabitant of room (if present)
 use item\t- use an item you have or here in current room
 """,
@@ -169,11 +197,78 @@ Enter a command at the '>' prompt. 'help' lists (most) available commands.
   'success': ("shazam", "key", "sword", 2, 1, 3)
 }
 
-import json
+def load_config(filename = None):
+    """Return the game configuration read from json file filename,
+    or the default_config if no filename is given.
+    A config stream file (ending .jsonl) is read as a StreamConfig,
+    its rows read as the world is built (see loader.py)."""
+    if filename == None:
+        return default_config
+    if filename.endswith(".jsonl"):
+        try:
+            from .loader import StreamConfig
+        except ImportError:        # run as a script rather than as a package
+            from loader import StreamConfig
+        return StreamConfig(filename)
+    import json                 # only when loading, as slow to import
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def grid_config(rows, cols, seed = 0):
+    """Return a generated game configuration for a large world of
+    rows x cols rooms laid out in a grid, named "r-c" and linked to the
+    rooms north, south, east & west of them.
+    About 1 in 4 rooms has an item, and 1 in 16 rooms an enemy or friend,
+    with descriptions drawn from small sets (as generated worlds repeat them).
+    The player "Me" starts in room "0-0" carrying a torch.
+    """
+    import random
+    rand = random.Random(seed)
+    room_descriptions = [
+        "A bare stone room with a low ceiling.",
+        "A draughty corridor lit by guttering candles.",
+        "A dusty storeroom piled high with broken furniture.",
+        "A damp cave with water dripping from the walls.",
+        "A cosy study lined with shelves of mouldering books."]
+    item_descriptions = [
+        "A small tarnished coin.", "A length of frayed rope.",
+        "A stubby candle.", "A chipped clay pot.", "A rusty iron nail."]
+    config = {
+        'title': "Generated " + str(rows) + "x" + str(cols) + " Grid World",
+        'rooms': [], 'links': [], 'items': [],
+        'enemies': [], 'friends': [],
+        'players': [("Me", "That would be you!", "0-0")],
+        'messages': default_config['messages'],
+        'success': ("shazam", "torch", "sword", 0, 0, 2)
+    }
+    config['items'].append(("torch", "A compact but powerful torch", "Me"))
+    for r in range(rows):
+        for c in range(cols):
+            name = str(r) + "-" + str(c)
+            config['rooms'].append((name, rand.choice(room_descriptions),
+                                    None, None))
+            if c + 1 < cols:
+                config['links'].append((name, "east", str(r) + "-" + str(c+1), "west"))
+            if r + 1 < rows:
+                config['links'].append((name, "south", str(r+1) + "-" + str(c), "north"))
+            number = r * cols + c
+            if rand.random() < 0.25:
+                config['items'].append(("thing" + str(number),
+                                        rand.choice(item_descriptions), name))
+            if number > 0 and rand.random() < 0.0625:
+                if rand.random() < 0.5:
+                    config['enemies'].append(("Zombie" + str(number),
+                        "A shambling zombie", "Brains...", name,
+                        None, None))
+                else:
+                    config['friends'].append(("Ghost" + str(number),
+                        "A friendly ghost", "Wooooo", name, None, None))
+    return config
 
 # Diagnostic main to test class
 # "run this diagnostic test script if run file rather than importing it."
 if __name__ == "__main__":
+    import json
 
     print ("Default game configuration is:")
     print (default_config)
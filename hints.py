@@ -0,0 +1,346 @@
+""" Hints for players stuck in a game, found by searching ahead.
+
+The 'hint' command suggests the next command toward escaping: a Hinter
+searches from the player's current state, trying each
+command that could help (going through exits, taking items that matter,
+using room's key items, giving friends their desires, fighting with
+things carried, leaving the item the player must not have, and saying
+the magic word once carrying the item needed) in a scratch world
+restored to each state reached, until a state where the player escapes.
+States nearest to meeting the success criteria (counting the commands
+taken to reach them at half a goal each) are searched first, so a way to
+escape is found after searching few of the states (though not always the
+shortest way), and its first command is the hint. Items matter if
+they are needed to escape, or are some enemy's weakness, friend's desire,
+room's key item or container's key, or do damage in fights, or are
+containers; unless the world has rules or dialogues, when any might.
+
+States are keyed by a compact hash of the world's state (see World.state),
+leaving out the turn count, and which rooms have been visited, counting
+them only up to the number needed to escape (so ways round the rooms
+which differ only in the order they are first visited are one state).
+The hints found are kept in a least recently used cache, along with the
+hints for every state on the way to escaping. So the many players passing through the same states get their
+hints from the cache, without searching again. One Hinter is shared by all
+the worlds built from the same config (see hinter), which World.allow_hints
+gives a world, for the few configs most recently used.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Enemy, Friend, Player
+    from .item import Container
+    from .output import captured
+except ImportError:        # run as a script rather than as a package
+    from character import Enemy, Friend, Player
+    from item import Container
+    from output import captured
+from collections import OrderedDict
+import hashlib
+import heapq
+import io
+import threading
+
+class Hinter():
+    """ Finds the next command toward escaping, for worlds built from one config. """
+
+    def __init__(self, config = None, cache_size = 4096, max_states = 20000):
+        """Create hinter for worlds built from config (default_config if None),
+        caching hints for cache_size states, searching at most max_states
+        states for each."""
+        self.config = config
+        self.cache_size = cache_size
+        self.max_states = max_states
+        self.cache = OrderedDict()  # state key: hint command, or None if no escape
+        self.lock = threading.Lock()        # held while using the cache
+        self.searching = threading.Lock()   # held while searching in the scratch world
+        self.scratch = None         # world searched in, built on first search
+        self.relevant = None        # names of items which matter, None if all
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        """return hinter statistics as string representation"""
+        return ("Hinter caching " + str(len(self.cache)) + " states, " +
+                str(self.hits) + " hits and " + str(self.misses) + " searches")
+
+    def hint(self, world, player):
+        """Return the next command toward player escaping world,
+        or None if there is no way to escape (within max_states).
+        May be called from many threads at once, who share the cache
+        but search one at a time, with the output of searching hidden."""
+        state = world.state()
+        if player.name not in state['characters']:     # eg. joined a SharedWorld
+            state['characters'][player.name] = world.character_state(player)
+        visits = world.success[5]
+        key = state_key(state, player.name, visits)
+        found, command = self.__cached(key)
+        if found:
+            return command
+        with self.searching:
+            found, command = self.__cached(key)     # found while waiting to search
+            if found:
+                return command
+            with self.lock:
+                self.misses += 1
+            if self.scratch == None:
+                self.scratch = type(world)(self.config, world.strings)
+                self.relevant = relevant_items(self.scratch)
+            with captured(io.StringIO()):
+                path = self.__search(state, key, player.name, visits)
+        with self.lock:
+            if path == None:
+                self.__remember(key, None)
+                return None
+            for step_key, command in path:
+                self.__remember(step_key, command)
+        return path[0][1]
+
+    def __cached(self, key):
+        """Return (True, hint) if the hint for state key is cached, else (False, None)"""
+        with self.lock:
+            if key not in self.cache:
+                return False, None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return True, self.cache[key]
+
+    def __remember(self, key, command):
+        """Cache command as the hint for state key, evicting the least recently used
+        (holding the lock)"""
+        self.cache[key] = command
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __search(self, state, key, name, visits):
+        """Return list of (state key, command) from state to player name
+        escaping, searching best first, or None if not found. A player not
+        in the scratch world (eg. one who joined a SharedWorld) is added
+        to it for the search."""
+        world = self.scratch
+        player = world.characters.get(name)
+        if player != None:
+            return self.__search_for(world, player, state, key, visits)
+        player = world.characters[name] = Player(name)
+        player.events = world.events
+        try:
+            return self.__search_for(world, player, state, key, visits)
+        finally:
+            del world.characters[name]
+            player.items.clear()
+
+    def __search_for(self, world, player, state, key, visits):
+        """Return list of (state key, command) from state to player escaping
+        world, searching best first, or None if not found"""
+        name = player.name
+        parents = {key: None}       # state key: (key before it, command done)
+        queue = [(0, 0, 0, state, key)]     # (estimate, depth, order, state, key)
+        while queue and len(parents) < self.max_states:
+            left, depth, order, state, before = heapq.heappop(queue)
+            world.restore(state)
+            for command in moves(world, player, self.relevant):
+                world.restore(state)
+                room = player.get_location()
+                keep_playing = world.execute(command, player)
+                if player.escaped:
+                    path = [(before, command)]
+                    while parents[path[-1][0]] != None:
+                        path.append(parents[path[-1][0]])
+                    path.reverse()
+                    return path
+                if not keep_playing:
+                    continue
+                if player.get_location() != room:
+                    player.get_location().describe()    # as play does on entering
+                after = world.state()
+                after_key = state_key(after, name, visits)
+                if after_key not in parents:
+                    parents[after_key] = (before, command)
+                    left = remaining(world, player, self.relevant) + (depth + 1) / 2
+                    heapq.heappush(queue, (left, depth + 1, len(parents), after, after_key))
+        return None
+
+def relevant_items(world):
+    """Return set of names of the items of world which matter to escaping,
+    or None if any might (as the world has rules or dialogues)"""
+    if world.rules != None or world.dialogues:
+        return None
+    relevant = {world.success[1]}
+    for character in world.characters.values():
+        if isinstance(character, Enemy) and character.weakness != None:
+            relevant.add(character.weakness.name)
+        elif isinstance(character, Friend) and character.desires != None:
+            relevant.add(str(character.desires))
+    for room in world.rooms.values():
+        if room.get_key_item() != None:
+            relevant.add(room.get_key_item().name)
+    for name, item in world.items.items():
+        if isinstance(item, Container):
+            relevant.add(name)
+            if item.get_key() != None:
+                relevant.add(item.get_key().name)
+        elif item.attack > 0:
+            relevant.add(name)
+    return relevant
+
+def remaining(world, player, relevant = None):
+    """Return estimate of how far player is from escaping world: the goals
+    of its success criteria not yet met, and rooms' key items not yet used,
+    less a little for each of the items named in relevant carried"""
+    magic_word, item_needed, item_not_have, enemies, friends, rooms = world.success
+    counts = world.counters()
+    left = 2 * (max(0, enemies - counts['vanquished']) + max(0, friends - counts['desires_met']) +
+                max(0, rooms - counts['rooms_visited']) + (not player.has(item_needed)))
+    left += sum(1 for room in world.rooms.values()
+                if room.get_key_item() != None and not room.get_item_used())
+    if relevant != None:
+        left -= 0.5 * sum(1 for name in player.items.contents
+                          if name in relevant and name != item_not_have)
+    return left
+
+def moves(world, player, relevant = None):
+    """Return list of commands which could help player escape world, taking
+    only the items named in relevant (any if None)"""
+    room = player.get_location()
+    carried = list(player.items.contents)
+    commands = ["go " + direction for direction in room.linked_rooms]
+    takes = list(room.contents.contents)
+    occupant = room.get_occupant()
+    if occupant != None and occupant != player:
+        takes += occupant.items.contents
+        if isinstance(occupant, Friend) and not occupant.get_desire_met():
+            commands += ["give " + name for name in carried
+                         if relevant == None or name == str(occupant.desires)]
+        elif isinstance(occupant, Enemy) and not occupant.was_vanquished():
+            commands += ["fight " + name for name in carried]
+    commands += ["take " + name for name in takes if relevant == None or name in relevant]
+    if world.rules != None:
+        commands += ["use " + name for name in carried]
+    elif room.get_key_item() != None and not room.get_item_used():
+        commands += ["use " + name for name in carried if name == room.get_key_item().name]
+    magic_word, item_needed, item_not_have = world.success[:3]
+    if item_not_have in player.items.contents:
+        commands.append("leave " + item_not_have)
+    if item_needed in player.items.contents:
+        commands.append(magic_word)
+    return commands
+
+def state_key(state, name, visits):
+    """Return compact hash of world state for player name, without the turn
+    count, and counting rooms visited up to visits rather than naming them"""
+    visited = min(visits, sum(1 for room in state['rooms'].values() if room[0]))
+    rooms = sorted((room, used, tuple(sorted(items)), tuple(sorted(counts.items())))
+                   for room, (visited, used, items, counts) in state['rooms'].items()
+                   if used or items)
+    characters = sorted((character, location, tuple(sorted(items)), hp,
+                         tuple(sorted(flags.items())), tuple(sorted(counts.items())))
+                        for character, (location, items, hp, flags, counts)
+                        in state['characters'].items())
+    containers = sorted((container, tuple(sorted(items)), tuple(sorted(counts.items())))
+                        for container, (items, counts) in state.get('containers', {}).items())
+    links = sorted(tuple(link) for link in state.get('links', []))
+    data = repr((name, visited, rooms, characters, containers, sorted(state.get('fired', [])),
+                 links))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+MAX_HINTERS = 8
+"""Number of configs whose Hinters are kept, least recently used dropped."""
+
+_hinters = OrderedDict()    # id of config: its Hinter (keeping the config alive,
+                            # so its id is not reused while in here)
+
+def hinter(config):
+    """Return the Hinter shared by worlds built from config, keeping those of
+    the MAX_HINTERS configs most recently asked for"""
+    shared = _hinters.get(id(config))
+    if shared == None or shared.config is not config:
+        shared = _hinters[id(config)] = Hinter(config)
+        if len(_hinters) > MAX_HINTERS:
+            _hinters.popitem(last=False)
+    _hinters.move_to_end(id(config))
+    return shared
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import sys
+    import time
+    from game_config import default_config
+    from shared_world import SharedWorld
+    from world import World
+    print("Test Hinter\n")
+
+    world = World()
+    helper = Hinter()
+    followed = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.player.get_location().describe()
+        for i in range(40):
+            command = helper.hint(world, world.player)
+            if command == None:
+                break
+            followed.append(command)
+            room = world.player.get_location()
+            world.execute(command)
+            if world.player.get_location() != room:
+                world.player.get_location().describe()
+            if world.player.escaped:
+                break
+    print("Following hints: " + ", ".join(followed))
+    print("Escaped: " + str(world.player.escaped) + " in " + str(len(followed)) +
+          " commands, " + str(helper))
+
+    world = World()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for command in ["go east", "go north", "go down"]:
+            world.execute(command)
+            world.player.get_location().describe()
+    print("Come down to the Cellar, hint: " + str(helper.hint(world, world.player)))
+
+    lost = World()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lost.execute("go east")
+        lost.execute("take knife")
+        lost.execute("leave torch")
+        lost.execute("go west")
+    print("Having left the torch behind, hint: " + str(helper.hint(lost, lost.player)))
+
+    print("\nTiming hints for 1000 players in the same state")
+    helper = Hinter()
+    players = [World() for i in range(1000)]
+    start = time.perf_counter()
+    helper.hint(players[0], players[0].player)
+    searched = time.perf_counter() - start
+    start = time.perf_counter()
+    for each in players[1:]:
+        helper.hint(each, each.player)
+    cached = (time.perf_counter() - start) / (len(players) - 1)
+    print("search %.3f sec, then from cache %.1f usec each, %s"
+          % (searched, cached * 1e6, str(helper)))
+
+    configs = [dict(default_config) for i in range(MAX_HINTERS + 4)]
+    for config in configs:
+        hinter(config)
+    print("After hinting %d configs, hinters kept: %d, latest shared: %s"
+          % (len(configs), len(_hinters), hinter(configs[-1]) is hinter(configs[-1])))
+
+    print("\nHints for players who joined a SharedWorld, from 4 threads at once")
+    shared = SharedWorld()
+    stdout = sys.stdout
+    answers = {}
+    def ask(name):
+        shared.join(name)
+        shared.command(name, "go east")
+        answers[name] = shared.command(name, "hint").strip()
+    threads = [threading.Thread(target=ask, args=("Player" + str(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("Hints: " + str(sorted(set(answers.values()))) + ", stdout put back: " +
+          str(sys.stdout is stdout))
@@ -0,0 +1,325 @@
+""" History of changes to a game world, for undo, redo and forking.
+
+A History follows its world's events (see events.py) to journal every
+change made by each command: items moving between holders, characters
+moving between rooms, and flags (vanquished, desire met, visited, key
+item used, dialogue node, player hp, turns) changing, and rules firing &
+the links between rooms they change (see rules.py). Changes name the rooms, characters
+and items involved, rather than referring to the objects, so they apply
+equally to any world built from the same config.
+
+The journal is a persistent linked list: each command's changes are a
+node pointing to the node before it, and nodes are never altered. So
+undo (applying the inverse of the current node's changes, and stepping
+back to its parent) and redo both cost just the changes of that command,
+any node can be kept as a saved point for free, and a forked world can
+share all the history before it. Memory used grows with the number of
+changes made, not the size of the world.
+
+Undo & redo make their changes through the usual methods, so their item
+& movement events are still announced (and items put back are listed last
+in their holder), while flags are set back directly, announced as flag
+events. Commands which change nothing but the turn count (eg. look, hint)
+are not journaled, so undo & redo step over real changes only.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .item import Container
+    from .room import Room
+except ImportError:        # run as a script rather than as a package
+    from item import Container
+    from room import Room
+
+class HistoryNode():
+    """ The changes made by one command, following the node before it. """
+
+    __slots__ = ('command', 'changes', 'parent', 'depth')
+
+    def __init__(self, command, changes, parent):
+        """Create node for command's tuple of changes, after parent node (or None)"""
+        self.command = command
+        self.changes = changes
+        self.parent = parent
+        self.depth = 1 if parent == None else parent.depth + 1
+
+    def path(self):
+        """Return list of nodes from first to this one"""
+        nodes = []
+        node = self
+        while node != None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+
+class History():
+    """ Journal of the changes made to a world by each command, for undo & redo. """
+
+    def __init__(self, world):
+        """Start journaling changes to world, which keeps this as world.history"""
+        self.world = world
+        self.node = None            # latest command done (and not undone)
+        self.undone = []            # nodes undone, most recent last, for redo
+        self.changes = None         # changes of command being journaled
+        self.replaying = False      # whether making changes from the journal
+        self.used_rooms = set(name for name, room in world.rooms.items() if room.item_used)
+        world.history = self
+        events = world.events
+        events.subscribe("add", self.on_add)
+        events.subscribe("remove", self.on_remove)
+        events.subscribe("move", self.on_move)
+        events.subscribe("vanquished", self.on_vanquished)
+        events.subscribe("desire_met", self.on_desire_met)
+        events.subscribe("visited", self.on_visited)
+        events.subscribe("used", self.on_used)
+        events.subscribe("dialogue", self.on_dialogue)
+        events.subscribe("rule", self.on_rule)
+        events.subscribe("link", self.on_link)
+        events.subscribe("flag", self.on_flag)
+
+    def __str__(self):
+        """return summary of history as string representation"""
+        return ("History of " + str(0 if self.node == None else self.node.depth) +
+                " commands, with " + str(len(self.undone)) + " undone")
+
+    # Journaling the changes made by a command
+    def begin(self, command, player):
+        """Start journaling changes made by command for player"""
+        self.changes = []
+        self.command_text = command
+        self.start = (player.name, player.hp, self.world.turns)
+
+    def commit(self):
+        """Finish journaling the command begun, adding it to the history
+        (which clears any undone commands, as they can no longer be redone)"""
+        name, hp, turns = self.start
+        player = self.world.characters[name]
+        if player.hp != hp:
+            self.changes.append(("flag", "character", name, "hp", hp, player.hp))
+        if self.changes:                # not just turns taken
+            if self.world.turns != turns:
+                self.changes.append(("turns", turns, self.world.turns))
+            self.node = HistoryNode(self.command_text, tuple(self.changes), self.node)
+            self.undone = []
+        self.changes = None
+
+    def __journal(self, change):
+        """Add change to those of the command being journaled"""
+        if self.changes != None and not self.replaying:
+            self.changes.append(change)
+
+    def on_add(self, holder, item, units):
+        self.__journal(("item", str(item), None, _holder_key(holder), units))
+
+    def on_remove(self, holder, item, units):
+        self.__journal(("item", str(item), _holder_key(holder), None, units))
+
+    def on_move(self, character, from_room, to_room):
+        self.__journal(("move", character.name, None if from_room == None else from_room.name,
+                        None if to_room == None else to_room.name))
+
+    def on_vanquished(self, enemy):
+        self.__journal(("flag", "character", enemy.name, "vanquished", False, True))
+
+    def on_desire_met(self, friend):
+        self.__journal(("flag", "character", friend.name, "desire_met", False, True))
+
+    def on_visited(self, room):
+        self.__journal(("flag", "room", room.name, "visited", False, True))
+
+    def on_used(self, room, item):
+        if room.name not in self.used_rooms and not self.replaying:
+            self.used_rooms.add(room.name)
+            self.__journal(("flag", "room", room.name, "item_used", False, True))
+
+    def on_dialogue(self, character, old_node, new_node):
+        self.__journal(("flag", "character", character.name, "node", old_node, new_node))
+
+    def on_rule(self, number):
+        self.__journal(("rule", number, False, True))
+
+    def on_link(self, room, direction, old_room, new_room):
+        self.__journal(("link", room.name, direction,
+                        None if old_room == None else old_room.name,
+                        None if new_room == None else new_room.name))
+
+    def on_flag(self, thing, flag, old, new):
+        self.__journal(("flag", "room" if isinstance(thing, Room) else "character",
+                        thing.name, flag, old, new))
+
+    # Moving through the history
+    def undo(self):
+        """Undo the latest command, returning its text (or None if nothing to undo)"""
+        if self.node == None:
+            return None
+        node = self.node
+        self.__apply([_inverse(change) for change in reversed(node.changes)])
+        self.node = node.parent
+        self.undone.append(node)
+        return node.command
+
+    def redo(self):
+        """Redo the latest command undone, returning its text (or None if none)"""
+        if not self.undone:
+            return None
+        node = self.undone.pop()
+        self.__apply(node.changes)
+        self.node = node
+        return node.command
+
+    def replay(self, node):
+        """Make the changes of every command up to node (in a world as built,
+        from the same config as the world node was journaled in)"""
+        if node != None:
+            for step in node.path():
+                self.__apply(step.changes)
+        self.node = node
+        self.undone = []
+
+    def __apply(self, changes):
+        """Make changes to the world, without journaling them"""
+        world = self.world
+        self.replaying = True
+        try:
+            for change in changes:
+                if change[0] == "item":
+                    item = world.items[change[1]]
+                    if change[2] != None:
+                        _inventory(world, change[2]).remove(item, change[4])
+                    if change[3] != None:
+                        _inventory(world, change[3]).add(item, change[4])
+                elif change[0] == "move":
+                    character = world.characters[change[1]]
+                    if change[3] != None:
+                        character.move_to(world.rooms[change[3]])
+                    else:
+                        if character.location != None and character.location.occupant == character:
+                            character.location.set_occupant(None)
+                        character.location = None
+                elif change[0] == "flag":
+                    kind, name, flag, old, new = change[1:]
+                    thing = world.rooms[name] if kind == "room" else world.characters[name]
+                    setattr(thing, flag, new)
+                    if flag == "item_used":
+                        (self.used_rooms.add if new else self.used_rooms.discard)(name)
+                    world.events.emit("flag", thing, flag, old, new)
+                elif change[0] == "turns":
+                    world.turns = change[2]
+                elif change[0] == "rule":
+                    if change[3]:
+                        world.rules.fired[change[1]] = True
+                    else:
+                        world.rules.fired.pop(change[1], None)
+                elif change[0] == "link":
+                    world.set_link(change[1], change[2], change[4])
+        finally:
+            self.replaying = False
+
+def _holder_key(holder):
+    """Return (kind, name) naming holder, a room, container item or character"""
+    if isinstance(holder, Room):
+        return ("room", holder.name)
+    if isinstance(holder, Container):
+        return ("item", holder.name)
+    return ("character", holder.name)
+
+def _inventory(world, key):
+    """Return inventory of holder named by (kind, name) key"""
+    if key[0] == "room":
+        return world.rooms[key[1]].contents
+    if key[0] == "item":
+        return world.items[key[1]].items
+    return world.characters[key[1]].items
+
+def _inverse(change):
+    """Return change undoing change: moving items & characters back, or
+    setting the old value back (the last two fields of other changes)"""
+    if change[0] in ("item", "move"):
+        return (change[0], change[1], change[3], change[2]) + change[4:]
+    return change[:-2] + (change[-1], change[-2])
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import sys
+    import time
+    from game_config import default_config
+    from query import WorldIndex
+    from world import World
+    print("Test History with undo, redo & fork\n")
+
+    def same(world, state):
+        """Return whether world is in state, ignoring the order of items held"""
+        def normal(state):
+            return ({name: room[:2] + (sorted(room[2]),) + room[3:]
+                     for name, room in state['rooms'].items()},
+                    {name: (c[0], sorted(c[1])) + c[2:] for name, c in state['characters'].items()},
+                    state['turns'])
+        return normal(world.state()) == normal(state)
+
+    world = World()
+    History(world)
+    index = WorldIndex(world)
+    start = world.state()
+    commands = ["go east", "take knife", "go north", "take garlic", "go sw",
+                "go up", "go up", "go west", "fight garlic", "take sword"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for cmd in commands:
+            world.execute(cmd)
+    played = world.state()
+    saved = world.history.node
+    print(str(world.history) + ", player in " + str(world.player.get_location()) +
+          " with " + str(world.player.items))
+    for i in range(3):
+        world.execute("undo")
+    print("After 3 undos, player in " + str(world.player.get_location()) +
+          " with " + str(world.player.items) + ", Dave vanquished: " +
+          str(world.characters["Dave"].was_vanquished()) + ", indexed as vanquished: " +
+          str([str(enemy) for enemy in index.characters(vanquished=True)]))
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("list")
+        world.execute("help")
+    print("After list & help, commands to redo: " + str(len(world.history.undone)))
+    world.execute("redo")
+    world.execute("redo")
+    print("After 2 redos, Dave vanquished: " + str(world.characters["Dave"].was_vanquished()) +
+          ", indexed as vanquished: " +
+          str([str(enemy) for enemy in index.characters(vanquished=True)]))
+    world.execute("redo")
+    world.execute("redo")
+    print("Redone back to same state: " + str(same(world, played)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        while world.history.undo() != None:
+            pass
+    print("Undone back to start state: " + str(same(world, start)))
+
+    forked = world.fork(default_config, saved)
+    print("Fork at saved point has same state as played: " + str(same(forked, played)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        forked.execute("go east")
+    print("Fork and original share history: " +
+          str(forked.history.node.parent is saved) +
+          ", original unchanged: " + str(same(world, start)))
+
+    print("\nTiming undo/redo after 100000 commands")
+    world = World()
+    History(world)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(50000):
+            world.execute("go east")
+            world.execute("go west")
+        begin = time.perf_counter()
+        for i in range(1000):
+            world.execute("undo")
+        for i in range(1000):
+            world.execute("redo")
+        elapsed = time.perf_counter() - begin
+    print("2000 undo/redo in %.3f sec (%.1f usec each), history %s"
+          % (elapsed, elapsed * 1e6 / 2000, str(world.history)))
@@ -1,16 +1,73 @@
-""" Define Item and Inventory classes used in adventure game
+""" Define Item, Container and Inventory classes used in adventure game
+
+Containers (bags, chests, boxes) are items holding their own inventory,
+so may be nested to any depth. Each inventory also keeps a flattened index
+of everything inside the containers it holds, at any depth, so finding a
+named item anywhere within a room or character is a single dict lookup,
+and putting in or taking out an item just updates the index of each
+enclosing inventory (so costs the depth it is nested at).
+
+Generated worlds have many items alike but for their names. So the data
+items share (description, attack, stackable) is kept in an ItemKind
+flyweight, which a World makes one of for each distinct combination (see
+World.item_kind), while each Item is just a small slotted handle holding
+its name and kind. Setting a description or stat on an item gives it a
+kind of its own, leaving the other items of its old kind unchanged.
 
 Written for the Object-oriented Programming in Python (OOPP) MOOC
 Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
 """
 
+try:
+    from .string_table import text
+except ImportError:        # run as a script rather than as a package
+    from string_table import text
+
+class ItemKind():
+    """ The unchanging data shared by all items alike: their description,
+    the damage they do when used to fight (see combat.py), and whether
+    stackable (many units held as one with a count). """
+
+    __slots__ = ('description', 'attack', 'stackable')
+
+    def __init__(self, description = None, attack = 0, stackable = False):
+        """Create kind of item with description, attack & stackable"""
+        self.description = description
+        self.attack = attack
+        self.stackable = stackable
+
+    def key(self):
+        """Return tuple of the kind's data, equal for kinds alike"""
+        return (self.description, self.attack, self.stackable)
+
+
 class Item():
     """ Some thing which may be present in a room or carried by a character. """
 
-    def __init__(self, item_name, item_description = None):
-        """Create item with the supplied name, and optional description"""
+    __slots__ = ('name', 'kind')
+
+    def __init__(self, item_name, item_description = None, kind = None):
+        """Create item with the supplied name, and either optional description,
+        or an ItemKind shared with other items alike. Its kind also has the
+        damage it does when used to fight (see combat.py), and whether it is
+        stackable (many units held as one with a count)."""
         self.name = item_name
-        self.description = item_description
+        self.kind = kind if kind != None else ItemKind(item_description)
+
+    @property
+    def description(self):
+        """The item description, from its kind"""
+        return self.kind.description
+
+    @property
+    def attack(self):
+        """The damage item does in a fight, from its kind"""
+        return self.kind.attack
+
+    @property
+    def stackable(self):
+        """Whether units of item are held as one with a count, from its kind"""
+        return self.kind.stackable
 
     def __str__(self):
         """return name as string representation of self"""
@@ -23,24 +80,83 @@ class Item():
 
     def get_description(self):
         """Returns the item description"""
-        return self.description
+        return text(self.description)
 
     def set_description(self, item_description):
         """Sets the item description"""
-        self.description = item_description
+        self.kind = ItemKind(item_description, self.kind.attack, self.kind.stackable)
+
+    def get_attack(self):
+        """Returns the damage item does in a fight"""
+        return self.attack
+
+    def set_attack(self, attack):
+        """Sets the damage item does in a fight"""
+        self.kind = ItemKind(self.kind.description, attack, self.kind.stackable)
+
+    def set_stackable(self, stackable = True):
+        """Sets whether units of item are held as one with a count"""
+        self.kind = ItemKind(self.kind.description, self.kind.attack, stackable)
+
+    def get_kind(self):
+        """Returns the ItemKind holding the data shared with items alike"""
+        return self.kind
+
+    def set_kind(self, kind):
+        """Sets the ItemKind holding the data shared with items alike"""
+        self.kind = kind
 
     # Methods to interact with item
     def describe(self):
         """Prints a description of the item"""
-        print( self.name + " - " + self.description )
+        print( self.name + " - " + text(self.description) )
+
+
+class Container(Item):
+    """ An item which holds other items (including containers), such as a bag
+    or chest, which may be locked so its key is needed to put in or take out. """
+
+    __slots__ = ('items', 'inside', 'key', 'events')
+
+    def __init__(self, item_name, item_description = None, kind = None):
+        """Create empty container with the supplied name, and optional description
+        (or kind, as for Item). Also has the inventory holding it (if any), the key
+        item locking it (if any), and events told about things put in & taken out
+        (see events.py)."""
+        super().__init__(item_name, item_description, kind)
+        self.items = Inventory(self)
+        self.inside = None
+        self.key = None
+        self.events = None
+
+    def get_key(self):
+        """Returns the key item locking the container, or None"""
+        return self.key
+
+    def set_key(self, key):
+        """Sets the key item locking the container (None if unlocked)"""
+        self.key = key
+
+    def describe(self):
+        """Prints a description of the container, and what it holds"""
+        super().describe()
+        if not self.items.is_empty():
+            print("   holding " + str(self.items))
 
 
 class Inventory():
-    """ A collection of things (Items, strings) present in a room or carried by a character. """
+    """ A collection of things (Items, strings) present in a room or carried by a character.
+    Stackable items are held once, with a count of how many units there are.
+    Things inside Containers held are found too, through a flattened index. """
 
-    def __init__(self):
-        """Create empty inventory disctionary"""
+    def __init__(self, owner = None):
+        """Create empty inventory disctionary, for owner (room, character or container)
+        whose events (if any) are told about things added & removed"""
         self.contents = {}
+        self.counts = {}            # name: units held, for stackable items
+        self.index = {}             # name: inventory directly holding it, for
+                                    # everything inside containers held
+        self.owner = owner
 
     def __str__(self):
         """return string representation of contents"""
@@ -48,35 +164,152 @@ class Inventory():
             return ""
         description = "["
         for i in self.contents:     # get all keys (names) form contents
+            if i in self.counts:
+                description += str(self.counts[i]) + " "
             description += i + ", "
         return description[:-2] + "]"
 
     # Methods to interact with inventory
 
-    def add(self, some_item):
-        """add some_item to contents"""
+    def add(self, some_item, quantity = 1):
+        """add some_item (quantity units if stackable) to contents"""
         name = str(some_item)       # get name (as string version of item)
+        if getattr(some_item, "stackable", False):
+            self.counts[name] = self.counts.get(name, 0) + quantity
+        else:
+            quantity = 1
         self.contents[name] = some_item
+        if isinstance(some_item, Container):
+            some_item.inside = self
+        self.__index(some_item, True)
+        if self.owner != None and self.owner.events != None:
+            self.owner.events.emit("add", self.owner, some_item, quantity)
  
-    def remove(self, some_item):
-        """remove some_item from contents"""
+    def remove(self, some_item, quantity = None):
+        """remove some_item from contents, or from the container holding it
+        (or if stackable, just quantity units of it, if given & fewer than held)"""
         name = str(some_item)       # get name (as string version of item)
-        self.contents.pop(name)     # and pop value to remove item
+        if name not in self.contents and name in self.index:
+            self.index[name].remove(some_item, quantity)
+            return
+        held = self.counts.get(name)
+        if held != None and quantity != None and quantity < held:
+            self.counts[name] = held - quantity
+            removed = self.contents[name]
+        else:
+            removed = self.contents.pop(name)   # and pop value to remove item
+            self.counts.pop(name, None)
+            quantity = 1 if held == None else held
+            if isinstance(removed, Container):
+                removed.inside = None
+            self.__index(removed, False)
+        if self.owner != None and self.owner.events != None:
+            self.owner.events.emit("remove", self.owner, removed, quantity)
+
+    def __index(self, some_item, added):
+        """Update index of this & each enclosing inventory for some_item
+        (and everything inside it) being added to or removed from contents"""
+        entries = {}
+        if isinstance(some_item, Container):
+            inner = some_item.items
+            entries = dict.fromkeys(inner.contents, inner)
+            entries.update(inner.index)
+        inventory = self
+        while inventory != None:
+            index = inventory.index
+            for name, holder in entries.items():
+                if added:
+                    index[name] = holder
+                elif index.get(name) is holder:
+                    del index[name]
+            entries[str(some_item)] = self
+            inventory = inventory.parent()
+
+    def parent(self):
+        """return inventory holding the container owning this inventory (or None)"""
+        if isinstance(self.owner, Container):
+            return self.owner.inside
+        return None
+
+    def holder(self, item_name):
+        """return inventory directly holding named item, this one or one
+        inside a container held, or None if not present"""
+        if item_name in self.contents:
+            return self
+        return self.index.get(item_name)
+
+    def containers(self, item_name):
+        """return list of containers the named item is inside, innermost first
+        (empty if in contents, or not present)"""
+        found = []
+        inventory = self.holder(item_name)
+        while inventory != None and inventory is not self:
+            found.append(inventory.owner)
+            inventory = inventory.parent()
+        return found
+
+    def count(self, item_name):
+        """return number of units of named item present (0 if none)"""
+        inventory = self.holder(item_name)
+        if inventory == None:
+            return 0
+        return inventory.counts.get(item_name, 1)
+
+    def stacks(self):
+        """return list of (item, units) in contents"""
+        return [(self.contents[name], self.counts.get(name, 1)) for name in self.contents]
+ 
+    def walk(self):
+        """return list of (item, units, container or None) for everything
+        present, with each container listed before what it holds"""
+        found = []
+        for item, units in self.stacks():
+            found.append((item, units, self.owner if isinstance(self.owner, Container) else None))
+            if isinstance(item, Container):
+                found.extend(item.items.walk())
+        return found
  
     def find(self, item_name):
-        """find item by name in contents, returning item if present or None if not"""
+        """find item by name in contents, or inside a container held,
+        returning item if present or None if not"""
         if item_name in self.contents:
             return self.contents[item_name]
+        inventory = self.index.get(item_name)
+        if inventory != None:
+            return inventory.contents[item_name]
         return None
  
     def has(self, item_name):
-        """return true/false if named item in contents"""
-        return (item_name in self.contents)
+        """return true/false if named item in contents, or inside a container held"""
+        return (item_name in self.contents or item_name in self.index)
+
+    def clear(self):
+        """empty contents, and any containers held, without announcing events"""
+        for item in self.contents.values():
+            if isinstance(item, Container):
+                item.inside = None
+                item.items.clear()
+        self.contents.clear()
+        self.counts.clear()
+        self.index.clear()
+
+    def reindex(self):
+        """rebuild index of what is inside containers held (and theirs), after
+        contents have been set directly"""
+        self.index.clear()
+        for item in self.contents.values():
+            if isinstance(item, Container):
+                item.inside = self
+                item.items.reindex()
+                self.index.update(dict.fromkeys(item.items.contents, item.items))
+                self.index.update(item.items.index)
 
     def describe(self):
         """Prints description of item's in contents"""
         for i in self.contents:
             print (" + ", end="")
+            if i in self.counts:
+                print(str(self.counts[i]) + " x ", end="")
             try:                    # try to use describe method for item/character
                 self.contents[i].describe()
             except AttributeError:  # if fails, just go with str
@@ -134,6 +367,96 @@ if __name__ == "__main__":
     my_stuff.describe()
     print("Size of my_stuff is: " + str(my_stuff.size()))
 
+    print("Add 1000 then 5 stackable coins, remove 3 coins")
+    coins = Item("coins", "Shiny gold coins")
+    coins.set_stackable()
+    my_stuff.add(coins, 1000)
+    my_stuff.add(coins, 5)
+    my_stuff.remove(coins, 3)
+    print("my_stuff contains " + str(my_stuff) + ", with " + str(my_stuff.count("coins")) +
+          " coins in " + str(my_stuff.size()) + " entries")
+    my_stuff.describe()
+
+    # nested containers
+    print("Put key in a box, in a bag, in a chest; find & take key from the outside")
+    chest = Container("chest", "A heavy oak chest")
+    bag = Container("bag", "A leather bag")
+    box = Container("box", "A small tin box")
+    room_stuff = Inventory()
+    room_stuff.add(chest)
+    chest.items.add(bag)
+    bag.items.add(box)
+    box.items.add(key)
+    print("has key: " + str(room_stuff.has("Ornate Door Key")) + ", inside " +
+          str([str(container) for container in room_stuff.containers("Ornate Door Key")]))
+    chest.describe()
+    room_stuff.remove(key)
+    print("After removing key, has key: " + str(room_stuff.has("Ornate Door Key")) +
+          ", box holds " + str(box.items) + ", index " + str(sorted(room_stuff.index)))
+    bag.items.remove(box)
+    room_stuff.add(box)
+    box.items.add(key)
+    print("Moved box out of bag, key now found in " + str(room_stuff.holder("Ornate Door Key").owner))
+
+    print("\nTiming find at depth 50 by index vs by searching each container")
+    import time
+    def search(inventory, item_name):
+        """find named item by recursive walk of inventory & its containers"""
+        if item_name in inventory.contents:
+            return inventory.contents[item_name]
+        for item in inventory.contents.values():
+            if isinstance(item, Container):
+                found = search(item.items, item_name)
+                if found != None:
+                    return found
+        return None
+    top = Inventory()
+    inventory = top
+    for depth in range(50):
+        for i in range(20):
+            inventory.add(Item("thing" + str(depth) + "_" + str(i)))
+        container = Container("bag" + str(depth))
+        inventory.add(container)
+        inventory = container.items
+    gem = Item("gem")
+    inventory.add(gem)
+    for finder, how in ((top.find, "index"), (lambda name: search(top, name), "search")):
+        start = time.perf_counter()
+        for i in range(10000):
+            finder("gem")
+        print("find by %-6s %.2f usec" % (how, (time.perf_counter() - start) * 1e6 / 10000))
+    start = time.perf_counter()
+    for i in range(10000):
+        inventory.remove(gem)
+        inventory.add(gem)
+    print("take & put at depth 50 %.2f usec, found gem: %s" %
+          ((time.perf_counter() - start) * 1e6 / 10000, top.find("gem") is gem))
+
+    print("\nMemory per item for 1000000 items of 5 kinds, as flyweight handles vs plain objects")
+    import tracemalloc
+    class PlainItem():
+        """item keeping its own copy of every attribute, as Item did"""
+        def __init__(self, name, description):
+            self.name = name
+            self.description = description
+            self.attack = 0
+            self.stackable = False
+    descriptions = ["A small tarnished coin.", "A length of frayed rope.",
+                    "A stubby candle.", "A chipped clay pot.", "A rusty iron nail."]
+    kinds = [ItemKind(description) for description in descriptions]
+    names = ["thing" + str(i) for i in range(1000000)]
+    for how, make in (("handles", lambda i: Item(names[i], kind=kinds[i % 5])),
+                      ("plain", lambda i: PlainItem(names[i], descriptions[i % 5]))):
+        tracemalloc.start()
+        items = [make(i) for i in range(1000000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-7s %.0f bytes per item (including list slot)" % (how, size / len(items)))
+        del items
+    handle = Item("thing0", kind=kinds[0])
+    print("handle describes the same: ", end="")
+    handle.describe()
+
     # empty inventory
     print("Create empty inventory, print short & long")
     no_stuff = Inventory()
@@ -0,0 +1,217 @@
+""" Stream the config of a very large world from a file, a row at a time.
+
+A json config file (see load_config in game_config.py) is read whole, and
+decoded into lists of rows, before World(config) builds a world from it,
+so for a world of millions of rooms the file's text, the decoded config
+and the world itself are all in memory at once. A config stream file
+(.jsonl) instead holds one json value per line:
+
+  header    first line: dict of the small sections (title, messages,
+            success, dialogues, rules ...), and 'streamed': the number
+            of rows in each section streamed
+  rows      then a line per row of the rooms, links, items, containers,
+            enemies, hunters, friends & players sections, as a list of
+            the section name followed by the row, eg.
+            ["links", "Entry Hall", "east", "Kitchen", "west"]
+            with the rows of each section together (in that order)
+
+A StreamConfig reads like the config dict, but its streamed sections are
+read from the file each time they are iterated, a line at a time, so the
+world is built from the rows as they arrive (World builds rooms, links,
+items and characters in the order the sections are written), and only
+the small sections are kept. Forward references are resolved as World
+resolves them: rooms' key items on a second pass through the rooms
+(read again from the file, not kept), and the items carried by
+characters (named in the items section before the characters are added)
+held until the characters exist. So save_stream writes the items carried
+by characters last, counting them in the header, and StreamConfig raises
+ValueError if more than max_pending of them would be held, rather than
+let them grow without bound.
+Peak memory stays near the size of the world built.
+
+  save_stream(grid_config(1000, 1000), "grid.jsonl")
+  world = World(load_config("grid.jsonl"))
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+from collections.abc import Mapping, Sequence
+from itertools import islice
+import json
+
+STREAMED = ('rooms', 'links', 'items', 'containers', 'enemies', 'hunters', 'friends', 'players')
+"""Sections of config streamed a row per line, in the order written."""
+
+_decoder = json.JSONDecoder()
+
+
+def save_stream(config, filename):
+    """Write config (dict, or any config mapping) to config stream filename,
+    with the items carried by characters after all other items"""
+    characters = set(conf[0] for name in ('enemies', 'hunters', 'friends', 'players')
+                     for conf in config.get(name, []))
+    with open(filename, 'w') as f:
+        header = {name: value for name, value in config.items() if name not in STREAMED}
+        header['streamed'] = {name: len(config[name]) for name in STREAMED if name in config}
+        header['carried'] = sum(1 for conf in config.get('items', []) if conf[2] in characters)
+        f.write(json.dumps(header) + "\n")
+        for name in STREAMED:
+            if name not in config:
+                continue
+            rows = config[name]
+            if name == 'items':         # carried items last, held least time
+                rows = ([conf for conf in rows if conf[2] not in characters] +
+                        [conf for conf in rows if conf[2] in characters])
+            for conf in rows:
+                f.write(json.dumps([name, *conf]) + "\n")
+
+
+class StreamSection(Sequence):
+    """ A streamed section of a config stream file, whose rows are read
+    from the file each time it is iterated (or indexed, reading up to the
+    row, so best kept for small sections, eg. players[0]). """
+
+    def __init__(self, config, name, length):
+        self.config = config
+        self.name = name
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("config row index out of range")
+        return next(islice(self, index, None))
+
+    def __iter__(self):
+        """Yield rows of section, as tuples, read a line at a time"""
+        config = self.config
+        name = self.name
+        prefix = ('["' + name + '",').encode()
+        offset = config.offsets.get(name)
+        if offset == None:          # after the sections before it, if known
+            offset = max([config.offsets[before] for before in STREAMED[:STREAMED.index(name)]
+                          if before in config.offsets], default=config.start)
+        decode = _decoder.decode
+        with open(config.filename, 'rb') as f:
+            f.seek(offset)
+            started = False
+            for line in f:
+                if line.startswith(prefix):
+                    if not started:
+                        config.offsets[name] = offset
+                        started = True
+                    yield tuple(decode(line.decode())[1:])
+                elif started:       # note where the next section starts
+                    config.offsets.setdefault(line[2:line.index(b'"', 2)].decode(), offset)
+                    return
+                offset += len(line)
+
+
+class StreamConfig(Mapping):
+    """ Reads a config stream file like the config dict, streaming the
+    rows of its large sections from the file as they are iterated. """
+
+    def __init__(self, filename, max_pending = 100000):
+        """Read header of config stream filename, allowing up to max_pending
+        items carried by characters to be held until the characters exist.
+        Raises ValueError if there are more."""
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            line = f.readline()
+        self.start = len(line)          # offset of first row
+        self.offsets = {}               # section name: offset of its first row
+        self.header = json.loads(line)
+        self.streamed = self.header.pop('streamed')
+        carried = self.header.pop('carried', 0)
+        if carried > max_pending:
+            raise ValueError(filename + " has " + str(carried) + " items carried by characters, " +
+                             "over the " + str(max_pending) + " which may be held")
+
+    def __getitem__(self, name):
+        """Return config section name, streamed from file if large"""
+        if name in self.streamed:
+            return StreamSection(self, name, self.streamed[name])
+        return self.header[name]
+
+    def __iter__(self):
+        yield from self.header
+        yield from self.streamed
+
+    def __len__(self):
+        return len(self.header) + len(self.streamed)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    from game_config import default_config, grid_config, load_config
+    from world import World
+    print("Test StreamConfig\n")
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "default.jsonl")
+    save_stream(default_config, filename)
+    config = load_config(filename)
+    print("Streamed sections: " + str({name: len(config[name]) for name in STREAMED
+                                        if name in config}))
+    print("Rows same as default: " + str(all(
+        sorted(repr(tuple(conf)) for conf in default_config[name]) ==
+        sorted(repr(conf) for conf in config[name])
+        for name in STREAMED if name in default_config)))
+    plain = World()
+    streamed = World(config)
+    script = ["go east", "take knife", "go north", "take garlic", "go down", "use torch",
+              "take wine", "go up", "go sw", "go west", "give wine", "go east", "go up",
+              "go up", "go west", "fight garlic", "take sword", "go east", "go down",
+              "go down", "fight sword", "take key", "leave sword"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for command in script:
+            plain.execute(command)
+            streamed.execute(command)
+    print("Same state after playing: " + str(plain.state() == streamed.state()))
+    try:
+        StreamConfig(filename, max_pending=0)
+        print("Too many carried items not caught")
+    except ValueError as msg:
+        print("Caught: " + str(msg).replace(directory, "..."))
+
+    print("\nBuilding 100000 room grid world from json and stream files")
+    with contextlib.redirect_stdout(io.StringIO()):
+        grid = grid_config(316, 316)
+    json_name = os.path.join(directory, "grid.json")
+    stream_name = os.path.join(directory, "grid.jsonl")
+    with open(json_name, 'w') as f:
+        json.dump(grid, f)
+    save_stream(grid, stream_name)
+    del grid
+    print("json file %.1f MB, stream file %.1f MB" % (os.path.getsize(json_name) / 1e6,
+                                                     os.path.getsize(stream_name) / 1e6))
+    for kind, name in (("json", json_name), ("stream", stream_name)):
+        start = time.perf_counter()
+        world = World(load_config(name))
+        elapsed = time.perf_counter() - start
+        del world
+        tracemalloc.start()
+        world = World(load_config(name))
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("%-6s %s in %.1f sec: peak %.0f MB, world (with its config) %.0f MB" %
+              (kind, str(world).split(" has ")[1].split(",")[0], elapsed, peak / 1e6, size / 1e6))
+        del world
+    os.remove(json_name)
+    os.remove(stream_name)
+    os.remove(filename)
+    os.rmdir(directory)
@@ -0,0 +1,173 @@
+""" ASCII map of the rooms the player has visited, for the 'map' command.
+
+A MapLayout gives each room a place (x, y, level) on a grid, worked out
+from the directions of the links between rooms: north, south, east & west
+are a step on the grid, ne, nw, se & sw a diagonal step, and up & down
+change level. It is worked out once per world, breadth first from the
+player's room, and kept (as the rooms' links seldom change). A room which
+would land on a place already taken is placed from another of its links,
+if it can be, and rooms reached only through other directions (or not
+reached at all) are left off the map. When rules change links, the rooms
+newly linked are placed as the change is announced (see events.py).
+
+Rendering shows a window of the player's level around the player, one
+room wide cell ('[ ]', or '[@]' for the player, '[*]' where there are
+stairs up or down) for each visited room, with its exits as lines
+between them. Only the places within the window are looked at, whether
+visited or not, so the map is as quick to show in a world of 100000
+rooms as of 10.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+from collections import deque
+
+STEPS = {'north': (0, -1, 0), 'south': (0, 1, 0), 'east': (1, 0, 0), 'west': (-1, 0, 0),
+         'ne': (1, -1, 0), 'nw': (-1, -1, 0), 'se': (1, 1, 0), 'sw': (-1, 1, 0),
+         'up': (0, 0, 1), 'down': (0, 0, -1)}
+"""Direction of link: step (x, y, level) to the room it leads to."""
+
+
+class MapLayout():
+    """ The places of a world's rooms on a grid, for drawing maps. """
+
+    def __init__(self, world, start = None):
+        """Lay out rooms of world, from room start (default the player's room)
+        at (0, 0, 0), following changes to links announced by world.events."""
+        self.places = {}            # room name: (x, y, level)
+        self.rooms = {}             # (x, y, level): room there
+        if start == None:
+            start = world.player.get_location()
+        self.place(start, (0, 0, 0))
+        self.spread([start])
+        world.events.subscribe("link", self.on_link)
+
+    def __str__(self):
+        """return summary of layout as string representation"""
+        levels = set(place[2] for place in self.rooms)
+        return ("MapLayout of " + str(len(self.places)) + " rooms on " +
+                str(len(levels)) + " levels")
+
+    def place(self, room, place):
+        """Put room at place, returning False if it is taken"""
+        if place in self.rooms:
+            return False
+        self.places[room.name] = place
+        self.rooms[place] = room
+        return True
+
+    def spread(self, rooms):
+        """Place rooms linked (directly or through others) to placed rooms,
+        breadth first from them"""
+        queue = deque(rooms)
+        places = self.places
+        while queue:
+            room = queue.popleft()
+            x, y, level = places[room.name]
+            for direction, linked in room.linked_rooms.items():
+                step = STEPS.get(direction)
+                if step != None and linked.name not in places and \
+                   self.place(linked, (x + step[0], y + step[1], level + step[2])):
+                    queue.append(linked)
+
+    def on_link(self, room, direction, old_room, new_room):
+        """Place the rooms newly reachable through room's changed link"""
+        if new_room != None and room.name in self.places:
+            self.spread([room])
+
+    def render(self, player, width = 9, height = 7):
+        """Return list of lines drawing the visited rooms in a window of width x
+        height rooms of player's level, centred on player"""
+        here = player.get_location()
+        if here == None or here.name not in self.places:
+            return ["You have no idea where you are!"]
+        px, py, level = self.places[here.name]
+        left = px - width // 2
+        top = py - height // 2
+        rooms = self.rooms
+        window = {}                 # (x, y): visited room there
+        for y in range(top, top + height):
+            for x in range(left, left + width):
+                room = rooms.get((x, y, level))
+                if room != None and room.visited:
+                    window[(x, y)] = room
+        lines = []
+        for y in range(top, top + height):
+            cells = []
+            links = []
+            for x in range(left, left + width):
+                room = window.get((x, y))
+                if room == None:
+                    cells.append("   ")
+                else:
+                    mark = "@" if room is here else (
+                        "*" if "up" in room.linked_rooms or "down" in room.linked_rooms else " ")
+                    cells.append("[" + mark + "]")
+                cells.append("-" if _linked(window, x, y, 'east') or
+                                    _linked(window, x + 1, y, 'west') else " ")
+                links.append(" " + ("|" if _linked(window, x, y, 'south') or
+                                            _linked(window, x, y + 1, 'north') else " ") + " ")
+                back = _linked(window, x, y, 'se') or _linked(window, x + 1, y + 1, 'nw')
+                forward = _linked(window, x + 1, y, 'sw') or _linked(window, x, y + 1, 'ne')
+                links.append("X" if back and forward else "\\" if back else "/" if forward else " ")
+            lines.append("".join(cells).rstrip())
+            lines.append("".join(links).rstrip())
+        while lines and not lines[-1]:
+            lines.pop()
+        while lines and not lines[0]:
+            del lines[0]
+        return ["Level " + str(level) + ":"] + lines
+
+def _linked(window, x, y, direction):
+    """Return whether visited room at (x, y) of window has a link in direction"""
+    room = window.get((x, y))
+    return room != None and direction in room.linked_rooms
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    from game_config import grid_config
+    from world import World
+    print("Test MapLayout\n")
+
+    world = World()
+    layout = MapLayout(world)
+    print(str(layout))
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.player.get_location().describe()
+        for command in ["go east", "go north", "go sw", "go west", "go east", "go up",
+                        "go up", "go west", "go east"]:
+            world.execute(command)
+            world.player.get_location().describe()
+    print("\n".join(layout.render(world.player)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("go down")
+        world.player.get_location().describe()
+    print("\n".join(layout.render(world.player)))
+
+    print("\nTiming map of 100000 room grid world")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        world = World(grid_config(316, 316))
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    layout = MapLayout(world)
+    laid_out = time.perf_counter() - start
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.player.get_location().describe()
+        for i in range(5):
+            for direction in ("east", "south"):
+                world.execute("go " + direction)
+                world.player.get_location().describe()
+    start = time.perf_counter()
+    for i in range(1000):
+        lines = layout.render(world.player)
+    rendered = (time.perf_counter() - start) / 1000
+    print("\n".join(lines))
+    print("%s, world built in %.2f sec, laid out in %.2f sec once, rendered in %.1f usec"
+          % (str(layout), built, laid_out, rendered * 1e6))
@@ -0,0 +1,96 @@
+""" Output of game commands, captured separately for each thread.
+
+The game prints what happens as it goes, to sys.stdout. Where commands are
+run in many threads at once (eg. by a SharedWorld), or output is hidden
+while searching (eg. by a Hinter), each thread's output is captured in its
+own buffer: while any thread is capturing, a ThreadOutput stands in for
+sys.stdout, sending what each thread prints to its own buffer (if it has
+one) and anything else on to the stdout it replaced. Captures may be
+nested, the inner one sending output to its buffer until it ends.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+import contextlib
+import sys
+import threading
+
+class ThreadOutput():
+    """ Stands in for sys.stdout, sending output printed by each thread to
+    that thread's own output buffer if it has one, else to real stdout.
+    """
+
+    def __init__(self, stdout):
+        """Create thread output passing through to stdout by default"""
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def write(self, text):
+        """Write text to current thread's buffer (or stdout if none)"""
+        return getattr(self.local, 'buffer', self.stdout).write(text)
+
+    def flush(self):
+        """Flush current thread's buffer (or stdout if none)"""
+        getattr(self.local, 'buffer', self.stdout).flush()
+
+    def capture(self, buffer):
+        """Send current thread's output to buffer (or back to stdout if None),
+        returning the buffer it was sent to before (None if stdout)"""
+        before = getattr(self.local, 'buffer', None)
+        if buffer == None:
+            self.local.__dict__.pop('buffer', None)
+        else:
+            self.local.buffer = buffer
+        return before
+
+_output_lock = threading.Lock()    # held while standing a ThreadOutput in for sys.stdout
+_capturing = 0                     # number of captures in progress, in any thread
+
+@contextlib.contextmanager
+def captured(buffer):
+    """Send output printed by this thread to buffer within the with block,
+    with a ThreadOutput standing in for sys.stdout while any thread is
+    capturing, and the stdout it replaced put back when none are"""
+    global _capturing
+    with _output_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        output = sys.stdout
+        _capturing += 1
+    before = output.capture(buffer)
+    try:
+        yield buffer
+    finally:
+        output.capture(before)
+        with _output_lock:
+            _capturing -= 1
+            if _capturing == 0 and sys.stdout is output:
+                sys.stdout = output.stdout
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import io
+    print("Test captured output\n")
+
+    stdout = sys.stdout
+    buffers = {}
+    def chatter(name):
+        with captured(io.StringIO()) as buffer:
+            for i in range(1000):
+                print(name + " " + str(i))
+                if i == 500:
+                    with captured(io.StringIO()):
+                        print("hidden by " + name)
+            buffers[name] = buffer.getvalue()
+    threads = [threading.Thread(target=chatter, args=("thread" + str(i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("Each thread got just its own output: " +
+          str(all(value.split() == [word for i in range(1000) for word in (name, str(i))]
+                  for name, value in buffers.items())))
+    print("stdout put back: " + str(sys.stdout is stdout))
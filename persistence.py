@@ -0,0 +1,346 @@
+""" Durable storage of game progress in an SQLite database.
+
+A WorldStore keeps the state that changes as worlds are played (see
+World.state) in SQLite tables: where each item is, each character's
+location, hp & flags, which rooms were visited or used, rules fired (see
+rules.py), links changed in play, and turns taken.
+
+Changes are not written as they happen. The store listens to each attached
+world's events (see events.py), and keeps the latest value of each changed
+row in a write-behind cache; a background thread writes the cache out in
+one transaction every flush_interval seconds (or sooner once max_pending
+changes are waiting), so a change reaches the database within about
+flush_interval (the staleness window), while commands never wait on disk.
+Call note_command after each command to record the turn count & player hp
+(which change without events), and close to flush everything at the end.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .item import Container
+    from .room import Room
+except ImportError:        # run as a script rather than as a package
+    from item import Container
+    from room import Room
+import functools
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS worlds (world TEXT PRIMARY KEY, turns INTEGER);
+CREATE TABLE IF NOT EXISTS rooms (world TEXT, name TEXT, visited INTEGER,
+    item_used INTEGER, PRIMARY KEY (world, name));
+CREATE TABLE IF NOT EXISTS characters (world TEXT, name TEXT, location TEXT,
+    hp INTEGER, vanquished INTEGER, desire_met INTEGER, escaped INTEGER,
+    node INTEGER, PRIMARY KEY (world, name));
+CREATE TABLE IF NOT EXISTS items (world TEXT, name TEXT, holder_kind TEXT,
+    holder TEXT, units INTEGER, seq INTEGER, PRIMARY KEY (world, name, holder_kind, holder));
+CREATE TABLE IF NOT EXISTS rules (world TEXT, number INTEGER, seq INTEGER,
+    PRIMARY KEY (world, number));
+CREATE TABLE IF NOT EXISTS links (world TEXT, room TEXT, direction TEXT, linked TEXT,
+    PRIMARY KEY (world, room, direction));
+"""
+
+class WorldStore():
+    """ SQLite storage of world state, written behind from a cache of changes. """
+
+    def __init__(self, filename, flush_interval = 0.2, max_pending = 10000):
+        """Open (or create) database in filename, and start background thread
+        writing changes every flush_interval seconds, or when max_pending
+        changes are waiting."""
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db_lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()    # guards pending changes
+        self.pending = self.__empty()
+        self.num_pending = 0
+        self.oldest = None              # time of oldest unwritten change
+        self.hp = {}                    # (world id, character name): hp last recorded
+        self.stats = {'changes': 0, 'flushes': 0, 'rows': 0,
+                      'flush_seconds': 0.0, 'max_staleness': 0.0}
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.__flush_loop, daemon=True)
+        self.thread.start()
+
+    def __empty(self):
+        """Return empty pending changes, as dicts of table: key: row"""
+        return {'worlds': {}, 'rooms': {}, 'characters': {}, 'items': {}, 'rules': {},
+                'links': {}}
+
+    def __change(self, table, key, row):
+        """Cache row as the latest value of key in table"""
+        with self.lock:
+            self.pending[table][key] = row
+            self.num_pending += 1
+            if self.oldest == None:
+                self.oldest = time.monotonic()
+            if self.num_pending >= self.max_pending:
+                self.wake.set()
+        self.stats['changes'] += 1
+
+    # Attaching worlds & recording their changes
+    def attach(self, world_id, world):
+        """Store the whole state of world as world_id, and follow its events
+        to store changes as it is played."""
+        state = world.state()
+        for room in world.rooms.values():
+            self.__room(world_id, room)
+            for item in room.contents.contents.values():
+                self.__item(world_id, room, item)
+        for character in world.characters.values():
+            self.__character(world_id, character)
+            for item in character.items.contents.values():
+                self.__item(world_id, character, item)
+        for container in world.items.values():
+            if isinstance(container, Container):
+                for item in container.items.contents.values():
+                    self.__item(world_id, container, item)
+        for number in state['fired']:
+            self.__fired(world_id, number)
+        for room_name, direction, linked in state['links']:
+            self.__change('links', (world_id, room_name, direction),
+                          (world_id, room_name, direction, linked))
+        self.__change('worlds', world_id, (world_id, state['turns']))
+        events = world.events
+        events.subscribe("add", functools.partial(self.__item, world_id))
+        events.subscribe("remove", functools.partial(self.__removed, world_id))
+        events.subscribe("move", functools.partial(self.__moved, world_id))
+        events.subscribe("vanquished", functools.partial(self.__character, world_id))
+        events.subscribe("desire_met", functools.partial(self.__character, world_id))
+        events.subscribe("visited", functools.partial(self.__room, world_id))
+        events.subscribe("used", functools.partial(self.__used, world_id))
+        events.subscribe("dialogue", functools.partial(self.__talked, world_id))
+        events.subscribe("rule", functools.partial(self.__fired, world_id))
+        events.subscribe("flag", functools.partial(self.__flag, world_id))
+        events.subscribe("link", functools.partial(self.__linked, world_id))
+
+    def note_command(self, world_id, world, player = None):
+        """Record turns, and player's (default world.player) hp if changed,
+        after a command"""
+        if player == None:
+            player = world.player
+        self.__change('worlds', world_id, (world_id, world.turns))
+        if self.hp.get((world_id, player.name)) != player.hp:
+            self.__character(world_id, player)
+
+    def __room(self, world_id, room):
+        """Record room's flags"""
+        self.__change('rooms', (world_id, room.name),
+                      (world_id, room.name, room.visited, room.item_used))
+
+    def __used(self, world_id, room, item):
+        """Record room's key item being used"""
+        self.__room(world_id, room)
+
+    def __character(self, world_id, character):
+        """Record character's location, hp, flags (None if it has no such flag)
+        & dialogue node (None if it has no dialogue)"""
+        location = character.location
+        self.hp[(world_id, character.name)] = character.hp
+        self.__change('characters', (world_id, character.name),
+                      (world_id, character.name,
+                       None if location == None else location.name, character.hp,
+                       getattr(character, 'vanquished', None),
+                       getattr(character, 'desire_met', None),
+                       getattr(character, 'escaped', None),
+                       None if character.dialogue == None else character.node))
+
+    def __talked(self, world_id, character, old_node, new_node):
+        """Record character's dialogue moving node"""
+        self.__character(world_id, character)
+
+    def __flag(self, world_id, thing, flag, old, new):
+        """Record room's or character's flag set directly (eg. by undo)"""
+        if isinstance(thing, Room):
+            self.__room(world_id, thing)
+        else:
+            self.__character(world_id, thing)
+
+    def __fired(self, world_id, number):
+        """Record rule number firing (the links it changed follow from it)"""
+        self.__change('rules', (world_id, number), (world_id, number, self.stats['changes']))
+
+    def __linked(self, world_id, room, direction, old_room, new_room):
+        """Record room's link in direction changing"""
+        self.__change('links', (world_id, room.name, direction),
+                      (world_id, room.name, direction,
+                       None if new_room == None else new_room.name))
+
+    def __moved(self, world_id, character, from_room, to_room):
+        """Record character moving room"""
+        self.__character(world_id, character)
+
+    def __item(self, world_id, holder, item, units = 1):
+        """Record units of item now held by holder (room, container or character),
+        numbered so items are loaded back in the order they were added."""
+        if isinstance(holder, Room):
+            kind, inventory = "room", holder.contents
+        elif isinstance(holder, Container):
+            kind, inventory = "item", holder.items
+        else:
+            kind, inventory = "character", holder.items
+        self.__change('items', (world_id, str(item), kind, holder.name),
+                      (world_id, str(item), kind, holder.name,
+                       inventory.count(str(item)), self.stats['changes']))
+
+    def __removed(self, world_id, holder, item, units):
+        """Record units of item left in holder, after some removed"""
+        self.__item(world_id, holder, item)
+
+    # Writing changes
+    def __flush_loop(self):
+        """Background thread writing changes until stopping"""
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write all pending changes to the database in one transaction"""
+        with self.lock:
+            pending, self.pending = self.pending, self.__empty()
+            oldest, self.oldest = self.oldest, None
+            self.num_pending = 0
+        rows = sum(len(changes) for changes in pending.values())
+        if rows == 0:
+            return
+        start = time.perf_counter()
+        with self.db_lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO worlds VALUES (?, ?)",
+                                pending['worlds'].values())
+            self.db.executemany("INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?)",
+                                pending['rooms'].values())
+            self.db.executemany("INSERT OR REPLACE INTO characters VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                pending['characters'].values())
+            held = [row for row in pending['items'].values() if row[4] > 0]
+            gone = [row[:4] for row in pending['items'].values() if row[4] == 0]
+            self.db.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                                held)
+            self.db.executemany("DELETE FROM items WHERE world = ? AND name = ? AND "
+                                "holder_kind = ? AND holder = ?", gone)
+            self.db.executemany("INSERT OR REPLACE INTO rules VALUES (?, ?, ?)",
+                                pending['rules'].values())
+            self.db.executemany("INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)",
+                                pending['links'].values())
+        self.stats['flushes'] += 1
+        self.stats['rows'] += rows
+        self.stats['flush_seconds'] += time.perf_counter() - start
+        self.stats['max_staleness'] = max(self.stats['max_staleness'],
+                                          time.monotonic() - oldest)
+
+    def close(self):
+        """Stop background thread, write remaining changes & close database"""
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+        self.db.close()
+
+    # Reading worlds back
+    def load(self, world_id, world):
+        """Restore world (built from the same config) to the state stored
+        as world_id (as last written). Returns False if none stored."""
+        with self.db_lock:
+            found = self.db.execute("SELECT turns FROM worlds WHERE world = ?",
+                                    (world_id,)).fetchone()
+            if found == None:
+                return False
+            rooms = {name: (bool(visited), bool(item_used), [], {})
+                     for name, visited, item_used in self.db.execute(
+                         "SELECT name, visited, item_used FROM rooms WHERE world = ?",
+                         (world_id,))}
+            characters = {}
+            containers = {}
+            for row in self.db.execute("SELECT name, location, hp, vanquished, desire_met, "
+                                       "escaped, node FROM characters WHERE world = ?",
+                                       (world_id,)):
+                flags = {flag: bool(value) for flag, value in
+                         zip(('vanquished', 'desire_met', 'escaped'), row[3:6])
+                         if value != None}
+                if row[6] != None:
+                    flags['node'] = row[6]
+                characters[row[0]] = (row[1], [], row[2], flags, {})
+            for name, kind, holder, units in self.db.execute(
+                    "SELECT name, holder_kind, holder, units FROM items WHERE world = ? "
+                    "ORDER BY seq", (world_id,)):
+                if kind == "room":
+                    room = rooms.setdefault(holder, (False, False, [], {}))
+                    names, counts = room[2], room[3]
+                elif kind == "item":
+                    names, counts = containers.setdefault(holder, ([], {}))
+                else:
+                    names, counts = characters[holder][1], characters[holder][4]
+                names.append(name)
+                counts[name] = units
+            fired = [number for (number,) in self.db.execute(
+                "SELECT number FROM rules WHERE world = ? ORDER BY seq", (world_id,))]
+            links = [list(row) for row in self.db.execute(
+                "SELECT room, direction, linked FROM links WHERE world = ?", (world_id,))]
+        world.restore({'rooms': rooms, 'characters': characters, 'containers': containers,
+                       'fired': fired, 'links': links, 'turns': found[0]})
+        return True
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import tempfile
+    from world import World
+    print("Test WorldStore, and benchmark commands with persistence on & off\n")
+
+    script = ["go east", "take knife", "go north", "take garlic", "go down",
+              "use torch", "take wine", "go up", "go sw", "go west", "give wine",
+              "go east", "go up", "go up", "go west", "fight garlic", "take sword",
+              "go east", "go down", "go down", "fight sword", "take key",
+              "leave sword", "look"]
+    num_worlds = 400
+
+    def play(store):
+        """Play script in num_worlds worlds, returning (worlds, commands per second)"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            worlds = [World() for i in range(num_worlds)]
+            if store != None:
+                for i, world in enumerate(worlds):
+                    store.attach("world" + str(i), world)
+            start = time.perf_counter()
+            for cmd in script:
+                for i, world in enumerate(worlds):
+                    world.execute(cmd)
+                    if store != None:
+                        store.note_command("world" + str(i), world)
+            elapsed = time.perf_counter() - start
+        return worlds, len(script) * num_worlds / elapsed
+
+    worlds, rate_off = play(None)
+    print("Persistence off: %.0f commands/sec" % rate_off)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "progress.db")
+        store = WorldStore(filename)
+        worlds, rate_on = play(store)
+        store.close()
+        stats = store.stats
+        print("Persistence on:  %.0f commands/sec (%.0f%% of off)" % (rate_on, 100 * rate_on / rate_off))
+        print("%d changes written as %d rows in %d transactions (%.1f msec each), max staleness %.3f sec"
+              % (stats['changes'], stats['rows'], stats['flushes'],
+                 stats['flush_seconds'] * 1000 / max(stats['flushes'], 1), stats['max_staleness']))
+
+        store = WorldStore(filename)
+        same = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, world in enumerate(worlds):
+                loaded = World()
+                if store.load("world" + str(i), loaded) and loaded.state() == world.state():
+                    same += 1
+        store.close()
+        print("Loaded %d of %d worlds back from the database with the same state" % (same, len(worlds)))
@@ -0,0 +1,510 @@
+""" An unbounded world generated from a seed, as the player explores it.
+
+A ProceduralWorld has no list of rooms: each room, at (x, y) on an
+endless grid and named "x,y", is made the first time it is looked up
+(in world.rooms, or through a link from a neighbouring room), along with
+the rest of its region (a square of region_size x region_size rooms),
+and their items & characters. Everything about a room (its description,
+which of its neighbours it links to, any item or character in it) is
+worked out from the seed and its coordinates alone, so a region can be
+dropped from memory and made again later, exactly the same.
+
+Regions in which something has changed (items taken or left, characters
+moved or vanquished, rooms visited or used, links changed) are kept in
+memory, as those changes are only kept in the region's objects. When more
+than max_regions of the others are in memory, the least recently used are
+evicted until three quarters of max_regions are left, unless a player is
+in or next to them. So regions are not evicted after every command, only
+to be made again when a player steps back. Memory grows with how much of
+the world players have touched, not with its size. Items and characters
+are named with a number for the room they started in (eg. "rope-12",
+"Zombie-40"), so they too are made when first looked up by name (eg. by
+undo, see history.py).
+
+Links between rooms keep the name of the room linked to, and look it up
+when followed, so rooms in other regions are not made until needed, and
+nothing refers to a region's rooms once it is evicted.
+
+  world = ProceduralWorld(procedural_config(seed=42))
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Enemy, Friend, Player
+    from .item import Item
+    from .room import Room
+    from .world import World
+except ImportError:        # run as a script rather than as a package
+    from character import Enemy, Friend, Player
+    from item import Item
+    from room import Room
+    from world import World
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import hashlib
+import math
+import weakref
+
+_EAST, _SOUTH, _LOOKS, _ITEM, _ITEM_KIND, _CHARACTER, _CHARACTER_KIND = range(7)
+
+ROOM_DESCRIPTIONS = [
+    "A bare stone room with a low ceiling.",
+    "A draughty corridor lit by guttering candles.",
+    "A dusty storeroom piled high with broken furniture.",
+    "A damp cave with water dripping from the walls.",
+    "A cosy study lined with shelves of mouldering books."]
+ITEMS = [("coin", "A small tarnished coin."), ("rope", "A length of frayed rope."),
+         ("candle", "A stubby candle."), ("pot", "A chipped clay pot."),
+         ("nail", "A rusty iron nail.")]
+
+def procedural_config(seed = 0, region_size = 16, max_regions = 64):
+    """Return config for a ProceduralWorld generated from seed, with the
+    player "Me" starting in room "0,0" carrying a torch"""
+    return {
+        'title': "Endless World " + str(seed),
+        'rooms': [], 'links': [], 'enemies': [], 'friends': [],
+        'items': [("torch", "A compact but powerful torch", "Me")],
+        'players': [("Me", "That would be you!", "0,0")],
+        'messages': {'help': "Explore as far as you like, 'exit' to leave.",
+                     'intro': "You are in a maze of rooms without end.",
+                     'exit_success': "You escaped!", 'exit_fail': "You are lost forever."},
+        'success': ("shazam", "torch", "sword", 0, 0, 2),
+        'procedural': {'seed': seed, 'region_size': region_size, 'max_regions': max_regions}
+    }
+
+def cell(seed, x, y):
+    """Return the random bits fixed by seed for room x, y (an int of 128
+    bits), from which noise picks numbers for each thing about the room"""
+    return int.from_bytes(hashlib.blake2b((str(seed) + ":" + str(x) + "," + str(y)).encode(),
+                                          digest_size=16).digest(), "little")
+
+def noise(bits, part):
+    """Return number in [0, 1) from part (0-7) of the random bits of a cell"""
+    return ((bits >> (16 * part)) & 0xFFFF) / 0x10000
+
+def room_number(x, y):
+    """Return number (from 0) of room x, y, used in the names of things in it"""
+    a = 2 * x if x >= 0 else -2 * x - 1
+    b = 2 * y if y >= 0 else -2 * y - 1
+    return (a + b) * (a + b + 1) // 2 + b
+
+def room_coordinates(number):
+    """Return (x, y) of room with room_number number"""
+    w = (math.isqrt(8 * number + 1) - 1) // 2
+    b = number - w * (w + 1) // 2
+    a = w - b
+    return (a // 2 if a % 2 == 0 else -(a + 1) // 2,
+            b // 2 if b % 2 == 0 else -(b + 1) // 2)
+
+
+class LazyLinks(MutableMapping):
+    """ A room's links (direction: room), keeping the names of the rooms
+    linked to, looked up in the world's rooms when followed. """
+
+    __slots__ = ('rooms', 'names')
+
+    def __init__(self, rooms, names):
+        """Create links to rooms (a table) named in dict of direction: name"""
+        self.rooms = rooms
+        self.names = names
+
+    def __getitem__(self, direction):
+        return self.rooms[self.names[direction]]
+
+    def __setitem__(self, direction, room):
+        self.names[direction] = room.name
+
+    def __delitem__(self, direction):
+        del self.names[direction]
+
+    def __contains__(self, direction):
+        return direction in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class RegionTable(dict):
+    """ A table of name: room, item or character of a ProceduralWorld, which
+    makes the region of a name on first looking it up. """
+
+    def __init__(self, world, kind):
+        super().__init__()
+        self.world = world
+        self.kind = kind
+
+    def __missing__(self, name):
+        """Make the region where name should be, raising KeyError if not there"""
+        region = self.world.region_of(self.kind, name)
+        if region == None or region in self.world.regions:
+            raise KeyError(name)
+        self.world.make_region(region)
+        return dict.__getitem__(self, name)
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or self.get(name) != None
+
+    def get(self, name, default = None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+class ProceduralWorld(World):
+    """ A world of endless rooms generated from a seed, in regions made
+    on first use, and evicted when untouched. """
+
+    def __init__(self, config = None, strings = None):
+        """Create world from a procedural_config (default seed 0)"""
+        if config == None:
+            config = procedural_config()
+        settings = config['procedural']
+        self.seed = settings['seed']
+        self.region_size = settings['region_size']
+        self.max_regions = settings['max_regions']
+        self.low_regions = self.max_regions * 3 // 4   # regions left after evicting
+        self.regions = OrderedDict()    # (rx, ry) of region in memory: whether changed,
+                                        # least recently used first
+        self.playing = weakref.WeakSet()    # players who have entered commands
+        self.num_changed = 0        # number of regions in memory changed
+        self.made = 0               # number of regions made (including made again)
+        self.seen = set()           # names of visited rooms of evicted regions
+        self.making = False         # whether making a region (so not changing it)
+        super().__init__(config, strings)
+        events = self.events
+        events.subscribe("add", self.on_items)
+        events.subscribe("remove", self.on_items)
+        events.subscribe("move", self.on_move)
+        events.subscribe("used", lambda room, item: self.changed(room))
+        events.subscribe("link", lambda room, direction, old, new: self.changed(room, new))
+        events.subscribe("flag", self.on_flag)
+        for kind in ("vanquished", "desire_met", "dialogue"):
+            events.subscribe(kind, lambda character, *args: self.on_move(character, None,
+                                                                        character.get_location()))
+
+    def new_table(self, kind):
+        """Return RegionTable making kind of things on first use"""
+        return RegionTable(self, kind)
+
+    def __str__(self):
+        """return summary of world in memory as string representation"""
+        return (self.title + " has " + str(len(self.regions)) + " regions in memory (" +
+                str(self.num_changed) + " changed), of " + str(len(self.rooms)) +
+                " rooms, " + str(len(self.characters)) + " characters, and " +
+                str(len(self.items)) + " items.")
+
+    # Regions of the world
+    def region(self, x, y):
+        """Return (rx, ry) of region holding room x, y"""
+        return (x // self.region_size, y // self.region_size)
+
+    def region_of(self, kind, name):
+        """Return region where kind of thing called name starts, or None if
+        name is not one made by this world"""
+        try:
+            if kind == "rooms":
+                x, y = name.split(",")
+                return self.region(int(x), int(y))
+            base, number = name.rsplit("-", 1)
+            return self.region(*room_coordinates(int(number)))
+        except (AttributeError, ValueError):
+            return None
+
+    def make_region(self, region):
+        """Make the rooms of region, with their links, items & characters"""
+        self.making = True
+        try:
+            self.regions[region] = False
+            self.made += 1
+            size = self.region_size
+            seed = self.seed
+            xs = range(region[0] * size, (region[0] + 1) * size)
+            ys = range(region[1] * size, (region[1] + 1) * size)
+            cells = {(x, y): cell(seed, x, y) for y in range(ys[0] - 1, ys[-1] + 1)
+                     for x in range(xs[0] - 1, xs[-1] + 1)}
+            made = [self.make_room(x, y, cells) for y in ys for x in xs]
+            for room, x, y in made:
+                self.make_contents(room, x, y, cells[(x, y)])
+        finally:
+            self.making = False
+
+    def make_room(self, x, y, cells):
+        """Make room x, y with links to its neighbours, from cells of (x, y):
+        random bits, holding it and the rooms west & north of it, returning
+        (room, x, y)"""
+        name = str(x) + "," + str(y)
+        room = Room(name, self.strings.intern(ROOM_DESCRIPTIONS[
+            int(noise(cells[(x, y)], _LOOKS) * len(ROOM_DESCRIPTIONS))]))
+        room.events = self.events
+        if name in self.seen:
+            self.seen.discard(name)
+            room.visited = True
+        links = {}
+        if y == 0 or noise(cells[(x, y)], _EAST) < 0.7:
+            links['east'] = str(x + 1) + "," + str(y)
+        if y == 0 or noise(cells[(x - 1, y)], _EAST) < 0.7:
+            links['west'] = str(x - 1) + "," + str(y)
+        if x == 0 or noise(cells[(x, y)], _SOUTH) < 0.7:
+            links['south'] = str(x) + "," + str(y + 1)
+        if x == 0 or noise(cells[(x, y - 1)], _SOUTH) < 0.7:
+            links['north'] = str(x) + "," + str(y - 1)
+        room.linked_rooms = LazyLinks(self.rooms, links)
+        dict.__setitem__(self.rooms, name, room)
+        return (room, x, y)
+
+    def make_contents(self, room, x, y, bits):
+        """Make the item & character (if any) starting in room x, y, from its
+        random bits"""
+        number = str(room_number(x, y))
+        if noise(bits, _ITEM) < 0.25:
+            base, description = ITEMS[int(noise(bits, _ITEM_KIND) * len(ITEMS))]
+            item = Item(base + "-" + number, kind=self.item_kind((None, description, None)))
+            dict.__setitem__(self.items, item.name, item)
+            room.leave(item)
+        if (x, y) != (0, 0) and noise(bits, _CHARACTER) < 0.0625:
+            if noise(bits, _CHARACTER_KIND) < 0.5:
+                character = Enemy("Zombie-" + number, self.strings.intern("A shambling zombie"))
+                character.set_conversation(self.strings.intern("Brains..."))
+            else:
+                character = Friend("Ghost-" + number, self.strings.intern("A friendly ghost"))
+                character.set_conversation(self.strings.intern("Wooooo"))
+            character.events = self.events
+            dict.__setitem__(self.characters, character.name, character)
+            character.move_to(room)
+
+    # Game state, with the visited rooms of evicted regions
+    def counters(self):
+        """Return the game metrics (see World.counters), counting visited
+        rooms evicted too"""
+        counts = super().counters()
+        counts['rooms_visited'] += len(self.seen)
+        return counts
+
+    def state(self):
+        """Return state of world (see World.state), with the names of the
+        visited rooms evicted as 'seen'"""
+        state = super().state()
+        state['seen'] = sorted(self.seen)
+        return state
+
+    def restore(self, state):
+        """Bring world to state (see World.restore), making the regions of
+        the rooms & characters in it as needed"""
+        super().restore(state)
+        self.seen = set()
+        for name in state.get('seen', []):
+            if dict.__contains__(self.rooms, name):
+                self.rooms[name].visited = True
+            else:
+                self.seen.add(name)
+
+    # Keeping changed regions
+    def changed(self, *rooms):
+        """Mark the regions of rooms (None for none) as changed, so they are
+        kept in memory"""
+        if not self.making:
+            for room in rooms:
+                if room != None:
+                    self.changed_region(self.region_of("rooms", room.name))
+
+    def changed_region(self, region):
+        """Mark region as changed, so it is kept in memory"""
+        if not self.regions.get(region):
+            self.regions[region] = True
+            self.num_changed += 1
+
+    def on_items(self, owner, item, quantity):
+        """Mark region of room or character (other than players) whose items changed"""
+        if isinstance(owner, Room):
+            self.changed(owner)
+        elif not isinstance(owner, Player) and hasattr(owner, "location"):
+            self.on_move(owner, None, owner.get_location())
+
+    def on_flag(self, thing, flag, old, new):
+        """Mark region of room or character whose flag was set directly (eg.
+        by undo), as its region made again would not have it"""
+        if isinstance(thing, Room):
+            if flag != "visited":           # visited rooms are kept in seen
+                self.changed(thing)
+        else:
+            self.on_move(thing, None, thing.get_location())
+
+    def on_move(self, character, old_room, new_room):
+        """Mark regions of a character (other than players) moving or changing,
+        including the region it started in"""
+        if isinstance(character, Player) or self.making:
+            return
+        self.changed(old_room, new_room)
+        home = self.region_of("characters", character.name)
+        if home != None:
+            self.changed_region(home)
+
+    def execute(self, inp, player = None):
+        """Execute command line inp for player (see World.execute), marking
+        the regions in & next to player's as most recently used, then evict
+        regions if over max_regions not changed"""
+        if player == None:
+            player = self.player
+        keep_playing = super().execute(inp, player)
+        self.playing.add(player)
+        for region in self.near(player):
+            if region in self.regions:
+                self.regions.move_to_end(region)
+        if len(self.regions) - self.num_changed > self.max_regions:
+            self.evict(player)
+        return keep_playing
+
+    def near(self, player):
+        """Return set of regions in or next to player's region"""
+        location = player.get_location()
+        if location == None:
+            return set()
+        rx, ry = self.region_of("rooms", location.name)
+        return {(rx + dx, ry + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+
+    def evict(self, player, keep = None):
+        """Drop from memory the least recently used regions not changed, nor
+        in or next to the region of player or any other player, until just
+        keep (default low_regions) not changed are left if possible,
+        returning how many"""
+        if keep == None:
+            keep = self.low_regions
+        near = self.near(player)
+        for other in list(self.playing):
+            near |= self.near(other)
+        dropped = []
+        unchanged = len(self.regions) - self.num_changed
+        for region, changed in self.regions.items():
+            if unchanged - len(dropped) <= keep:
+                break
+            if not changed and region not in near:
+                dropped.append(region)
+        size = self.region_size
+        for region in dropped:
+            del self.regions[region]
+            for y in range(region[1] * size, (region[1] + 1) * size):
+                for x in range(region[0] * size, (region[0] + 1) * size):
+                    room = dict.pop(self.rooms, str(x) + "," + str(y))
+                    if room.visited:
+                        self.seen.add(room.name)
+                    for name in room.contents.contents:
+                        dict.pop(self.items, name, None)
+                    if room.occupant != None:
+                        dict.pop(self.characters, room.occupant.name, None)
+        return len(dropped)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+    import time
+    import tracemalloc
+    from history import History
+    print("Test ProceduralWorld\n")
+
+    print("Room numbers round trip: " +
+          str(all(room_coordinates(room_number(x, y)) == (x, y)
+                  for x in range(-50, 50) for y in range(-50, 50))))
+    world = ProceduralWorld(procedural_config(seed=42))
+    print(str(world))
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("look")
+    start = world.player.get_location()
+    print("Start room " + start.name + " links: " + str(list(start.linked_rooms)))
+    far = world.rooms["1000,-2000"]
+    print("Room far away: " + far.name + ", " + str(far.description) +
+          ", links " + str(list(far.linked_rooms)) + "; " + str(world))
+
+    def region_snapshot(world, region):
+        """Return what was generated in region"""
+        size = world.region_size
+        rooms = [world.rooms[str(x) + "," + str(y)]
+                 for y in range(region[1] * size, (region[1] + 1) * size)
+                 for x in range(region[0] * size, (region[0] + 1) * size)]
+        return [(room.name, str(room.description), dict(room.linked_rooms.names),
+                 sorted(room.contents.contents), str(room.occupant)) for room in rooms]
+
+    before = region_snapshot(world, (62, -125))
+    world.evict(world.player, 0)
+    print("After evicting: " + str(world))
+    after = region_snapshot(world, (62, -125))
+    print("Region made again the same: " + str(before == after))
+
+    print("\nExploring 3000 steps, to rooms not visited (eastwards first) if any,\n" +
+          "taking things found in the first 50 rooms")
+    world = ProceduralWorld(procedural_config(seed=7, max_regions=16))
+    History(world)
+    rand = random.Random(3)
+    visited = set()
+    tracemalloc.start()
+    begin = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(3000):
+            room = world.player.get_location()
+            room.describe()
+            visited.add(room.name)
+            names = room.linked_rooms.names
+            new = [direction for direction in ("east", "south", "north", "west")
+                   if direction in names and names[direction] not in visited]
+            if len(visited) <= 50 and not room.contents.is_empty():
+                world.execute("take " + next(iter(room.contents.contents)))
+            elif new:
+                world.execute("go " + new[0])
+            else:
+                world.execute("go " + rand.choice(list(names)))
+    elapsed = time.perf_counter() - begin
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Visited " + str(len(visited)) + " rooms in %.2f sec, player at %s carrying %d items"
+          % (elapsed, world.player.get_location().name, len(world.player.items.contents)))
+    print(str(world) + " Counted " + str(world.counters()['rooms_visited']) + " rooms visited")
+    print("Memory %.1f MB for %d rooms in memory" % (memory / 1e6, len(world.rooms)))
+    here = world.player.get_location().name
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("go " + next(iter(world.player.get_location().linked_rooms)))
+    print("Moved from " + here + " to " + world.player.get_location().name + ", then ", end="")
+    world.execute("undo")
+    print("back in " + world.player.get_location().name)
+
+    print("\nWandering 1000 steps near the start, with 20 regions changed eastwards,\n" +
+          "while a second player wanders far away")
+    class CountingWorld(ProceduralWorld):
+        """ ProceduralWorld counting the distinct regions it makes """
+        def __init__(self, config):
+            self.distinct = set()
+            super().__init__(config)
+
+        def make_region(self, region):
+            self.distinct.add(region)
+            super().make_region(region)
+
+    world = CountingWorld(procedural_config(seed=7, region_size=4, max_regions=16))
+    for rx in range(20):
+        world.rooms[str(rx * 4) + ",0"].leave(Item("pebble-" + str(rx)))
+    other = Player("You")
+    other.move_to(world.rooms["200,0"])
+    rand = random.Random(3)
+    made = world.made
+    distinct = len(world.distinct)
+    begin = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(1000):
+            for player in (world.player, other):
+                names = player.get_location().linked_rooms.names
+                near = [direction for direction, name in names.items()
+                        if player is other or all(abs(int(n)) <= 24 for n in name.split(","))]
+                world.execute("go " + rand.choice(near), player)
+    print("Made %d regions (%d again after eviction) in %.2f sec: %s"
+          % (world.made - made, world.made - made - (len(world.distinct) - distinct),
+             time.perf_counter() - begin, str(world)))
+    print("Second player's room still in the world: " +
+          str(world.rooms[other.get_location().name] is other.get_location()))
@@ -0,0 +1,131 @@
+""" Distance field used by hunting enemies to pursue the player.
+
+Rather than each hunter searching for a path to the player every turn,
+one DistanceField is kept for the world: a breadth first search out from
+the player's room, following links backwards, records for each room
+within radius steps its distance to the player and the next room to step
+to along a shortest path. Every hunter then picks its next step with a
+single lookup, so many hunters cost one field update per turn, and the
+field is only updated when the player changes room.
+
+Rooms beyond radius are not in the field, so hunters there have lost the
+scent and lie in wait (see Hunter in character.py).
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+class DistanceField():
+    """ Distances & next steps towards a target room, for rooms within radius. """
+
+    def __init__(self, rooms, radius = 12):
+        """Create empty field over rooms (dict of name: Room), for rooms
+        within radius steps of the target room once set by update."""
+        self.rooms = rooms
+        self.radius = radius
+        self.target = None
+        self.distance = {}      # room: steps to target
+        self.next_hop = {}      # room: linked room one step closer to target
+        self.updates = 0        # number of times field was recomputed
+        self.relink()
+
+    def __str__(self):
+        """return summary of field as string representation"""
+        return ("Distance field to " + str(self.target) + " over " +
+                str(len(self.distance)) + " rooms within " + str(self.radius) +
+                " steps, updated " + str(self.updates) + " times")
+
+    def relink(self):
+        """(Re)build the reverse links, ie. the rooms linking to each room,
+        needed whenever the world's links change, and clear the field."""
+        self.links_in = {}
+        for room in self.rooms.values():
+            for other in room.linked_rooms.values():
+                self.links_in.setdefault(other, []).append(room)
+        self.target = None
+        self.distance = {}
+        self.next_hop = {}
+
+    def update(self, target):
+        """Recompute field to target room, unless it is already the target"""
+        if target == self.target:
+            return
+        self.target = target
+        distance = {target: 0}
+        next_hop = {}
+        frontier = [target]
+        links_in = self.links_in
+        for steps in range(1, self.radius + 1):
+            reached = []
+            for room in frontier:
+                for other in links_in.get(room, ()):
+                    if other not in distance:
+                        distance[other] = steps
+                        next_hop[other] = room
+                        reached.append(other)
+            if not reached:
+                break
+            frontier = reached
+        self.distance = distance
+        self.next_hop = next_hop
+        self.updates += 1
+
+    def step(self, room):
+        """Return room to move to from room towards target, or None if room is
+        the target or beyond radius."""
+        return self.next_hop.get(room)
+
+    def distance_to(self, room):
+        """Return steps from room to target, or None if beyond radius"""
+        return self.distance.get(room)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    from game_config import default_config, grid_config
+    from world import World
+    print("Test DistanceField and hunters\n")
+
+    world = World()
+    field = DistanceField(world.rooms)
+    field.update(world.rooms["Library"])
+    print(str(field))
+    for name in ("Entry Hall", "Ballroom", "Cellar", "Library"):
+        room = world.rooms[name]
+        print(name + " is " + str(field.distance_to(room)) + " steps from the Library, next step " +
+              str(field.step(room)))
+
+    print("\nPlay default game with Dave hunting the player")
+    config = dict(default_config)
+    config['hunters'] = [config['enemies'][0]]
+    config['enemies'] = config['enemies'][1:]
+    world = World(config)
+    for cmd in ["go east", "take knife", "go north", "take garlic", "go sw", "go up", "look"]:
+        print("> " + cmd)
+        world.execute(cmd)
+        print("  (Dave is in the " + str(world.characters["Dave"].get_location()) + ")")
+    print("> fight garlic")
+    world.execute("fight garlic")
+
+    print("\nHunters on 300x300 grid world")
+    config = grid_config(300, 300)
+    occupied = set(conf[3] for conf in config['enemies'] + config['friends'])
+    free = [conf[0] for conf in config['rooms'] if conf[0] not in occupied]
+    config['hunters'] = [("Hunter" + str(i), "A hungry hunter", "Grrr", room, None, None)
+                         for i, room in enumerate(free[1::40])]
+    with contextlib.redirect_stdout(io.StringIO()):
+        world = World(config)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for turn in range(100):
+            world.execute("go east" if turn % 2 else "go south")
+    elapsed = time.perf_counter() - start
+    near = sum(1 for hunter in world.hunters
+               if world.pursuit.distance_to(hunter.get_location()) != None)
+    print("%d hunters, 100 turns in %.3f sec (%.2f msec per turn), %d hunters within scent"
+          % (len(world.hunters), elapsed, elapsed * 1000 / 100, near))
+    print(str(world.pursuit))
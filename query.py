@@ -0,0 +1,264 @@
+""" Indexed queries over the state of a game world, for admin tooling.
+
+A WorldIndex is built once from a World (scanning it), and then kept up to
+date from the world's events (see events.py), so that questions such as
+"which enemies are not yet vanquished" or "which rooms hold items" are
+answered in time proportional to the number of answers, rather than by
+going through every room, character and inventory in the world.
+
+The indexes kept are:
+  - characters by type (Enemy, Friend, Player, ...), filed under each type
+    they are a kind of (so a Hunter is an Enemy too)
+  - enemies vanquished and not yet, and friends with desires met and not yet
+  - the holder (room, character or container) of every item
+  - rooms with contents, rooms with an occupant, and rooms visited
+
+The select method combines these, eg.
+
+  index.select("characters", type="Enemy", vanquished=False)
+  index.select("rooms", has_items=True, occupied=True)
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Character, Enemy, Friend
+    from .room import Room
+except ImportError:        # run as a script rather than as a package
+    from character import Character, Enemy, Friend
+    from room import Room
+
+class WorldIndex():
+    """ Secondary indexes over the state of a World, kept up to date by its events. """
+
+    def __init__(self, world):
+        """Build indexes for world, and subscribe to its events to maintain them"""
+        self.world = world
+        self.by_type = {}           # type name: set of characters of that type or a subtype
+        self.unvanquished = set()   # enemies not yet vanquished
+        self.vanquished = set()     # enemies vanquished
+        self.unmet = set()          # friends with desires not yet met
+        self.met = set()            # friends with desires met
+        self.holder = {}            # item name: holder (room, character or container)
+        self.rooms_with_items = set()
+        self.rooms_occupied = set()
+        self.rooms_visited = set()
+        for room in world.rooms.values():
+            if not room.contents.is_empty():
+                self.rooms_with_items.add(room)
+            if room.get_occupant() != None:
+                self.rooms_occupied.add(room)
+            if room.visited:
+                self.rooms_visited.add(room)
+            for item, units, container in room.contents.walk():
+                self.holder[str(item)] = room if container == None else container
+        for character in world.characters.values():
+            self.add_character(character)
+            for item, units, container in character.items.walk():
+                self.holder[str(item)] = character if container == None else container
+        events = world.events
+        events.subscribe("add", self.on_add)
+        events.subscribe("remove", self.on_remove)
+        events.subscribe("move", self.on_move)
+        events.subscribe("vanquished", self.on_vanquished)
+        events.subscribe("desire_met", self.on_desire_met)
+        events.subscribe("visited", self.rooms_visited.add)
+        events.subscribe("flag", self.on_flag)
+
+    def __str__(self):
+        """return summary of index sizes as string representation"""
+        return ("Index of " + str(len(self.holder)) + " held items, " +
+                str(len(self.unvanquished)) + " enemies unvanquished, " +
+                str(len(self.unmet)) + " friends with unmet desires, " +
+                str(len(self.rooms_with_items)) + " rooms with items")
+
+    def add_character(self, character):
+        """Add character (eg. one newly added to the world) to the indexes"""
+        for kind in _kinds(character):
+            self.by_type.setdefault(kind, set()).add(character)
+        if isinstance(character, Enemy):
+            (self.vanquished if character.was_vanquished() else self.unvanquished).add(character)
+        elif isinstance(character, Friend):
+            if character.get_desire_met():
+                self.met.add(character)
+            elif character.get_desires() != None:
+                self.unmet.add(character)
+
+    def remove_character(self, character):
+        """Remove character (eg. one taken out of the world) from the indexes"""
+        for kind in _kinds(character):
+            self.by_type.get(kind, set()).discard(character)
+        self.unvanquished.discard(character)
+        self.vanquished.discard(character)
+        self.unmet.discard(character)
+        self.met.discard(character)
+
+    # Event handlers maintaining the indexes
+    def on_add(self, holder, item, units):
+        """item added to holder's inventory"""
+        self.holder[str(item)] = holder
+        if isinstance(holder, Room):
+            self.rooms_with_items.add(holder)
+
+    def on_remove(self, holder, item, units):
+        """item (or some units of it) removed from holder's inventory"""
+        inventory = holder.contents if isinstance(holder, Room) else holder.items
+        if self.holder.get(str(item)) == holder and not inventory.has(str(item)):
+            del self.holder[str(item)]
+        if isinstance(holder, Room) and holder.contents.is_empty():
+            self.rooms_with_items.discard(holder)
+
+    def on_move(self, character, from_room, to_room):
+        """character moved between rooms (the player is not a room occupant)"""
+        if from_room != None and from_room.get_occupant() == None:
+            self.rooms_occupied.discard(from_room)
+        if to_room != None and to_room.get_occupant() != None:
+            self.rooms_occupied.add(to_room)
+
+    def on_vanquished(self, enemy):
+        """enemy vanquished for the first time"""
+        self.unvanquished.discard(enemy)
+        self.vanquished.add(enemy)
+
+    def on_desire_met(self, friend):
+        """friend given their desire for the first time"""
+        self.unmet.discard(friend)
+        self.met.add(friend)
+
+    def on_flag(self, thing, flag, old, new):
+        """flag of room or character set directly (eg. by undo)"""
+        if flag == "visited":
+            (self.rooms_visited.add if new else self.rooms_visited.discard)(thing)
+        elif flag == "vanquished" and isinstance(thing, Enemy):
+            if new:
+                self.on_vanquished(thing)
+            else:
+                self.vanquished.discard(thing)
+                self.unvanquished.add(thing)
+        elif flag == "desire_met" and isinstance(thing, Friend):
+            if new:
+                self.on_desire_met(thing)
+            else:
+                self.met.discard(thing)
+                if thing.get_desires() != None:
+                    self.unmet.add(thing)
+
+    # Queries
+    def holder_of(self, item_name):
+        """Return room, character or container holding named item, or None"""
+        return self.holder.get(item_name)
+
+    def characters(self, type = None, vanquished = None, desire_met = None):
+        """Return set of characters of type name (eg. "Enemy"), where
+        vanquished or desire_met (if not None) have the given value."""
+        candidates = []
+        if type != None:
+            candidates.append(self.by_type.get(type, set()))
+        if vanquished == False:
+            candidates.append(self.unvanquished)
+        elif vanquished == True:
+            candidates.append(self.vanquished)
+        if desire_met == False:
+            candidates.append(self.unmet)
+        elif desire_met == True:
+            candidates.append(self.met)
+        if not candidates:
+            return set(self.by_type.get("Character", set()))
+        return _intersect(candidates)
+
+    def rooms(self, has_items = None, occupied = None, visited = None):
+        """Return set of rooms which have items, an occupant, or have been
+        visited, where each condition given is True (or for False, not)."""
+        wanted = []
+        unwanted = []
+        for condition, rooms in ((has_items, self.rooms_with_items),
+                                 (occupied, self.rooms_occupied),
+                                 (visited, self.rooms_visited)):
+            if condition == True:
+                wanted.append(rooms)
+            elif condition == False:
+                unwanted.append(rooms)
+        result = (_intersect(wanted) if wanted
+                  else set(self.world.rooms.values()))
+        for rooms in unwanted:
+            result = result - rooms
+        return result
+
+    def select(self, what, **conditions):
+        """Return set of "characters" or "rooms" meeting conditions,
+        as given by keyword to the characters or rooms methods."""
+        if what == "characters":
+            return self.characters(**conditions)
+        elif what == "rooms":
+            return self.rooms(**conditions)
+        raise ValueError("### Error: can only select characters or rooms, not " + str(what))
+
+def _kinds(character):
+    """Return names of the Character classes character is an instance of"""
+    return [kind.__name__ for kind in type(character).__mro__ if issubclass(kind, Character)]
+
+def _intersect(sets):
+    """Return intersection of list of sets, starting from the smallest"""
+    sets = sorted(sets, key=len)
+    result = set(sets[0])
+    for other in sets[1:]:
+        result &= other
+        if not result:
+            break
+    return result
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import time
+    from game_config import default_config, grid_config
+    from world import World
+    print("Test WorldIndex with default world\n")
+
+    world = World()
+    index = WorldIndex(world)
+    print(str(index))
+    names = lambda things: sorted(str(thing) for thing in things)
+    print("Unvanquished enemies: " + str(names(index.select("characters", type="Enemy", vanquished=False))))
+    print("Friends with unmet desires: " + str(names(index.select("characters", desire_met=False))))
+    print("Rooms with items: " + str(names(index.select("rooms", has_items=True))))
+    print("Occupied rooms with items: " + str(names(index.rooms(has_items=True, occupied=True))))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for cmd in ["go east", "take knife", "go north", "take garlic", "go sw",
+                    "go up", "go up", "go west", "fight garlic", "take sword"]:
+            world.execute(cmd)
+    print("After playing, holder of knife: " + str(index.holder_of("knife")) +
+          ", of sword: " + str(index.holder_of("sword")))
+    print("Unvanquished enemies: " + str(names(index.characters("Enemy", vanquished=False))))
+    print("Vanquished enemies: " + str(names(index.characters("Enemy", vanquished=True))))
+    print("Rooms with items: " + str(names(index.rooms(has_items=True))))
+    print("Dining Hall has items: " + str(world.rooms["Dining Hall"] in index.rooms_with_items))
+
+    chest_config = dict(default_config)
+    chest_config['items'] = default_config['items'] + [
+        ("chest", "An iron bound chest", "Kitchen"), ("gem", "A sparkling gem", "chest")]
+    chest_config['containers'] = [("chest", None)]
+    index = WorldIndex(World(chest_config))
+    print("Holder of gem put in chest by config: " + str(index.holder_of("gem")))
+
+    hunter_config = dict(default_config)
+    hunter_config['hunters'] = [("Igor", "A hunchbacked servant", "Master?", "Library",
+                                 None, None)]
+    index = WorldIndex(World(hunter_config))
+    print("Hunters are enemies too, unvanquished: " +
+          str(names(index.characters("Enemy", vanquished=False))) +
+          ", characters: " + str(len(index.characters())))
+
+    print("\nQuery timing on 500x500 grid world")
+    world = World(grid_config(500, 500))
+    start = time.perf_counter()
+    index = WorldIndex(world)
+    built = time.perf_counter()
+    enemies = index.select("characters", type="Enemy", vanquished=False)
+    queried = time.perf_counter()
+    print("Built index in %.2f sec, found %d unvanquished enemies in %.1f msec"
+          % (built - start, len(enemies), (queried - built) * 1000))
@@ -0,0 +1,312 @@
+""" Hot reload of changed game configuration into running game worlds.
+
+diff_configs compares an old and new game configuration once, giving a
+ConfigDelta listing just what was added, removed or changed. apply_delta
+then patches a live World to match, in time proportional to the size of the
+delta rather than of the world, so a content update can be rolled onto many
+running sessions:
+  - new rooms, links, items and characters are added,
+  - descriptions, conversations, messages, key items, weaknesses and
+    desires are updated,
+  - removed links are unlinked, and removed characters & items taken away,
+  - removed rooms are evacuated first: the player, occupant and contents
+    are moved to a linked room which remains (or the new starting room).
+Where things are now (item locations, who is where) is part of the state
+of each game, so a changed location only applies to newly added things.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Enemy, Friend
+except ImportError:        # run as a script rather than as a package
+    from character import Enemy, Friend
+
+def _by_name(records):
+    """Return dict of name (first field): record for config records"""
+    return {conf[0]: tuple(conf) for conf in records}
+
+def _directed_links(links):
+    """Return dict (room, direction): (to room, link config) for links config"""
+    directed = {}
+    for conf in links:
+        directed[(conf[0], conf[1])] = conf[2]
+        if conf[3] != None:
+            directed[(conf[2], conf[3])] = conf[0]
+    return directed
+
+def _diff(old, new):
+    """Return (added, removed, changed) records between old & new dicts,
+    as lists of new records, old keys, and new records."""
+    added = [new[key] for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = [new[key] for key in new if key in old and old[key] != new[key]]
+    return added, removed, changed
+
+
+class ConfigDelta():
+    """ The differences between an old and a new game configuration. """
+
+    def __init__(self, old, new):
+        """Compute the differences from old config to new config"""
+        self.title = new['title'] if new['title'] != old['title'] else None
+        self.messages = {name: new['messages'][name] for name in new['messages']
+                         if old['messages'].get(name) != new['messages'][name]}
+        self.success = (tuple(new['success'])
+                        if tuple(new['success']) != tuple(old['success']) else None)
+        self.rooms = _diff(_by_name(old['rooms']), _by_name(new['rooms']))
+        old_links = _directed_links(old['links'])
+        new_links = _directed_links(new['links'])
+        self.items = _diff(_by_name(old['items']), _by_name(new['items']))
+        self.enemies = _diff(_by_name(old['enemies']), _by_name(new['enemies']))
+        self.friends = _diff(_by_name(old['friends']), _by_name(new['friends']))
+        self.old_items = _by_name(old['items'])
+        self.start_room = new['players'][0][2] if new['players'] else None
+        # links are keys, not records, so keep lists of changed keys
+        self.links = ([key for key in new_links if key not in old_links],
+                      [key for key in old_links if key not in new_links],
+                      [key for key in new_links
+                       if key in old_links and old_links[key] != new_links[key]])
+        self.link_to = {key: new_links[key]
+                        for key in self.links[0] + self.links[2]}
+
+    def __str__(self):
+        """return summary of the number of changes as string representation"""
+        counts = []
+        for section in ("rooms", "links", "items", "enemies", "friends"):
+            added, removed, changed = getattr(self, section)
+            if added or removed or changed:
+                counts.append(section + " +" + str(len(added)) + " -" +
+                              str(len(removed)) + " ~" + str(len(changed)))
+        if self.messages:
+            counts.append("messages ~" + str(len(self.messages)))
+        return "Config delta: " + (", ".join(counts) if counts else "no changes")
+
+    def size(self):
+        """return total number of changes in delta"""
+        total = len(self.messages) + (self.title != None) + (self.success != None)
+        for section in (self.rooms, self.links, self.items, self.enemies, self.friends):
+            total += len(section[0]) + len(section[1]) + len(section[2])
+        return total
+
+
+def diff_configs(old, new):
+    """Return ConfigDelta of changes from old config to new config"""
+    return ConfigDelta(old, new)
+
+def apply_delta(world, delta, players = None):
+    """Patch live world with the changes in delta.
+    players is the list of players to evacuate from removed rooms
+    (default the world's player)."""
+    if players == None:
+        players = [world.player] if world.player != None else []
+    text = world.strings.intern
+    if delta.title != None:
+        world.title = delta.title
+    for name in delta.messages:
+        world.messages[name] = text(delta.messages[name])
+    if delta.success != None:
+        world.success = delta.success
+
+    # add new rooms & items, then update changed items
+    rooms_added, rooms_removed, rooms_changed = delta.rooms
+    for conf in rooms_added:
+        world.add_room(conf)
+    items_added, items_removed, items_changed = delta.items
+    carried = []                # new items to give to characters later
+    for conf in items_added:
+        if not world.add_item(conf):
+            carried.append(conf)
+    for conf in items_changed:
+        world.set_item_stats(conf)
+
+    # update descriptions & key items of new and changed rooms
+    for conf in rooms_added + rooms_changed:
+        room = world.rooms[conf[0]]
+        room.set_description(text(conf[1]))
+        if conf[3] != None:
+            world.set_key_item(conf)
+        else:
+            room.key_item = None
+
+    # evacuate removed rooms while the old links remain
+    for name in rooms_removed:
+        _evacuate(world, world.rooms[name], delta, players)
+
+    # relink rooms: remove old links, add new & changed ones
+    links_added, links_removed, links_changed = delta.links
+    for room_name, direction in links_removed:
+        if room_name in world.rooms:
+            world.rooms[room_name].linked_rooms.pop(direction, None)
+    for key in links_added + links_changed:
+        world.rooms[key[0]].linked_rooms[key[1]] = world.rooms[delta.link_to[key]]
+    for name in rooms_removed:
+        del world.rooms[name]
+    if world.pursuit != None and (links_added or links_removed or links_changed):
+        world.pursuit.relink()
+
+    # characters: remove, add, update
+    for added, removed, changed in (delta.enemies, delta.friends):
+        for name in removed:
+            _remove_character(world, name)
+    for conf in delta.enemies[0]:
+        _add_character(world, conf, world.add_enemy)
+    for conf in delta.friends[0]:
+        _add_character(world, conf, world.add_friend)
+    for conf in carried:
+        if conf[2] not in world.characters:
+            raise ValueError('### Error: new item ' + conf[0] +
+                             ' has unknown location ' + str(conf[2]))
+        world.characters[conf[2]].add(world.items[conf[0]], world.item_quantity(conf))
+    for conf in delta.enemies[2] + delta.friends[2]:
+        character = world.characters[conf[0]]
+        character.set_description(text(conf[1]))
+        world.set_conversation(character, conf[2])
+        wants = world.items[conf[4]] if conf[4] != None else None
+        if isinstance(character, Enemy):
+            character.set_weakness(wants, text(conf[5]))
+            world.set_enemy_stats(conf)
+        elif isinstance(character, Friend):
+            character.set_desires(wants, text(conf[5]))
+
+    # finally remove items no longer in the config
+    for name in items_removed:
+        _remove_item(world, name, delta, players)
+
+def _fallback_room(world, room, delta):
+    """Return a room remaining after delta linked to room, else the start room"""
+    rooms_removed = delta.rooms[1]
+    for linked in room.linked_rooms.values():
+        if linked.get_name() not in rooms_removed:
+            return linked
+    return world.rooms[delta.start_room]
+
+def _evacuate(world, room, delta, players):
+    """Move players, occupant & contents out of room which is being removed"""
+    fallback = _fallback_room(world, room, delta)
+    for player in players:
+        if player.get_location() == room:
+            player.move_to(fallback)
+    for item, units in room.contents.stacks():
+        room.contents.remove(item)
+        fallback.leave(item, units)
+    occupant = room.get_occupant()
+    if occupant != None:
+        if fallback.get_occupant() == None:
+            occupant.move_to(fallback)
+        else:                       # nowhere to go, so leaves the world
+            _remove_character(world, occupant.get_name())
+
+def _add_character(world, conf, add):
+    """Add a new character using add(conf), moving it to a free linked
+    room if its room is already occupied."""
+    room = world.rooms[conf[3]]
+    if room.get_occupant() != None:
+        for linked in room.linked_rooms.values():
+            if linked.get_occupant() == None:
+                conf = conf[:3] + (linked.get_name(),) + conf[4:]
+                break
+        else:
+            raise ValueError('### Error: no free room for new character ' + conf[0])
+    add(conf)
+
+def _remove_character(world, name):
+    """Remove named character, leaving what it carries in its room"""
+    character = world.characters.pop(name, None)
+    if character == None:
+        return
+    room = character.get_location()
+    if room != None:
+        for item, units in character.items.stacks():
+            character.items.remove(item)
+            room.leave(item, units)
+        if room.get_occupant() == character:
+            room.set_occupant(None)
+    character.location = None
+
+def _remove_item(world, name, delta, players):
+    """Remove named item from the world & whoever holds it.
+    Looks first on the players and where the item started, only searching
+    the whole world if it has been moved somewhere else."""
+    item = world.items.pop(name, None)
+    if item == None:
+        return
+    holders = list(players)
+    start = delta.old_items[name][2]
+    if start in world.rooms:
+        holders.append(world.rooms[start])
+    elif start in world.characters:
+        holders.append(world.characters[start])
+    for holder in holders:
+        if _take_from(holder, name):
+            return
+    for holder in list(world.rooms.values()) + list(world.characters.values()):
+        if _take_from(holder, name):
+            return
+
+def _take_from(holder, name):
+    """Remove item called name from room or character holder, returning True if held"""
+    inventory = holder.contents if hasattr(holder, 'contents') else holder.items
+    if inventory.has(name):
+        inventory.remove(name)
+        return True
+    return False
+
+def reload_worlds(worlds, old, new):
+    """Apply the changes from old config to new config to every live world"""
+    delta = diff_configs(old, new)
+    for world in worlds:
+        apply_delta(world, delta)
+    return delta
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import copy
+    import time
+    from game_config import default_config, grid_config
+    from world import World
+    print("Test hot reload of default config\n")
+
+    world = World()
+    world.execute("go east")
+    world.execute("take knife")
+    new = copy.deepcopy(default_config)
+    new['rooms'] = [conf for conf in new['rooms'] if conf[0] != "Dining Hall"]
+    new['rooms'].append(("Conservatory", "A glass room full of dead plants.", None, None))
+    new['links'] = [conf for conf in new['links']
+                    if "Dining Hall" not in (conf[0], conf[2])]
+    new['links'].append(("Conservatory", "north", "Ballroom", "south2"))
+    new['items'].append(("trowel", "A rusty garden trowel", "Conservatory"))
+    new['items'] = [conf for conf in new['items'] if conf[0] != "cards"]
+    new['enemies'][0] = ("Dave",) + ("A very smelly zombie",) + new['enemies'][0][2:]
+    new['messages']['intro'] = "Welcome back to the haunted house!"
+    delta = diff_configs(default_config, new)
+    print(str(delta) + " (" + str(delta.size()) + " changes)")
+    apply_delta(world, delta)
+    print(str(world))
+    print("Player now in " + str(world.player.get_location()) +
+          " carrying " + str(world.player.items))
+    print("Dining Hall in world: " + str("Dining Hall" in world.rooms))
+    print("Entry Hall links: " + str(list(world.rooms["Entry Hall"].linked_rooms)))
+    world.rooms["Conservatory"].describe()
+    world.characters["Dave"].describe()
+    print("cards in world: " + str("cards" in world.items) +
+          ", in Parlour: " + str(world.rooms["Parlour"].has("cards")))
+
+    print("Reload small change into 100 worlds of 40000 rooms")
+    config = grid_config(200, 200)
+    worlds = [World(config) for i in range(100)]
+    changed = dict(config)
+    changed['rooms'] = list(config['rooms'])
+    changed['rooms'][5] = ("0-5", "A freshly painted room.", None, None)
+    start = time.perf_counter()
+    delta = diff_configs(config, changed)
+    diffed = time.perf_counter()
+    for w in worlds:
+        apply_delta(w, delta)
+    applied = time.perf_counter()
+    print("diff %.3f sec once, apply %.1f usec per world" %
+          (diffed - start, (applied - diffed) * 1e6 / len(worlds)))
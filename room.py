@@ -4,7 +4,12 @@ Written for the Object-oriented Programming in Python (OOPP) MOOC
 Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
 """
 
-from item import Item, Inventory
+try:
+    from .item import Item, Inventory
+    from .string_table import text
+except ImportError:        # run as a script rather than as a package
+    from item import Item, Inventory
+    from string_table import text
 import random
 
 class Room():
@@ -17,7 +22,8 @@ class Room():
         A room also has a list of linked_rooms it connects to,
         a occupant who may be in the room, whether player has visited,
         a key item that may be used in the room, with message & flag if used,
-        and the inventory of room contents
+        and the inventory of room contents.
+        Changes are announced to events, if set (see events.py).
         """
         self.name = room_name
         self.description = room_description
@@ -27,7 +33,8 @@ class Room():
         self.key_item = None
         self.item_used_msg = "Nothing much seems to happen."
         self.item_used = False
-        self.contents = Inventory()
+        self.contents = Inventory(self)
+        self.events = None
 
     def __str__(self):
         """return name as string representation of self"""
@@ -40,7 +47,7 @@ class Room():
 
     def get_description(self):
         """Returns the room description"""
-        return self.description
+        return text(self.description)
 
     def get_name(self):
         """Returns the room name"""
@@ -95,6 +102,8 @@ class Room():
         if not self.visited:
             Room.num_rooms_visited += 1
             self.visited = True
+            if self.events != None:
+                self.events.emit("visited", self)
 
     def link_room(self, room_to_link, direction, direction_back = None):
         """Link named room to self in given direction, adding link in direction_back if given"""
@@ -140,15 +149,16 @@ class Room():
         """Return true if item_name in in room contents, else false"""
         return self.contents.has(item_name)
 
-    def leave(self, some_item):
-        """leave some_item in room contents"""
-        self.contents.add(some_item)
+    def leave(self, some_item, quantity = 1):
+        """leave some_item (quantity units if stackable) in room contents"""
+        self.contents.add(some_item, quantity)
  
-    def take(self, item_name):
-        """Remove named item from room contents, returning item if present or None if not"""
+    def take(self, item_name, quantity = None):
+        """Remove named item (or quantity units of it, if stackable) from room
+        contents, returning item if present or None if not"""
         the_item = self.contents.find(item_name)
         if the_item != None:
-            self.contents.remove(the_item)
+            self.contents.remove(the_item, quantity)
             return the_item
         return None
 
@@ -158,6 +168,8 @@ class Room():
         Returns True if successfully used, False otherwise."""
         if self.key_item == some_item:
             self.item_used = True
+            if self.events != None:
+                self.events.emit("used", self, some_item)
             if self.item_used_msg != None:
                 print(self.item_used_msg)
             return True
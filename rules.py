@@ -0,0 +1,398 @@
+""" Rules declared in the game config, triggered by what the player does.
+
+The optional 'rules' config section lists rules of the form:
+
+  (when, what, where, conditions, actions, message)
+
+When the player does something of the kind 'when', with 'what' in room
+'where' (either None to match any), and all the conditions hold, the
+actions are made and the message (if not None) is shown. Each rule fires
+at most once. The kinds of trigger are:
+
+  use       player uses item what (in room where)
+  take      player gets item what (in room where), however they get it
+  enter     player enters room where (what is None)
+  vanquish  enemy what is vanquished (in room where)
+  satisfy   friend what is given their desire (in room where)
+
+Conditions are a list of (kind, argument):
+  ("has", item), ("lacks", item)    player carries item, or not
+  ("vanquished", enemy), ("desire_met", friend), ("visited", room),
+  ("used", room)                    flags of characters & rooms
+  ("fired", number)                 rule number (from 0) has fired
+
+Actions are a list of tuples:
+  ("open_link", room1, direction1, room2, direction2)   link rooms (direction2 may be None)
+  ("close_link", room, direction)   remove link from room in direction
+  ("spawn", item, room)             place item in room (None for where triggered)
+  ("give", item)                    give player item
+  ("remove", item)                  take item away from player
+
+eg. when the torch is used in the Cellar while Dave is vanquished, open a
+passage north to the Crypt, and spawn a lantern:
+
+  ("use", "torch", "Cellar", [("vanquished", "Dave")],
+   [("open_link", "Cellar", "north", "Crypt", "south"), ("spawn", "lantern", None)],
+   "A hidden door swings open!")
+
+The RuleEngine indexes rules by (when, what, where), so each trigger looks
+up just the rules for that item or character and room (and those matching
+any), evaluating their conditions only, however many rules a world has.
+Items spawned or given by rules usually start nowhere (location None);
+any already placed are moved from wherever they are (unless stackable,
+when more units are made), which the RuleEngine follows through the
+world's events, so it knows where each is without searching for it.
+Rules are not triggered by changes made in undoing or redoing commands
+(see history.py), which journal their effects.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Player
+    from .room import Room
+except ImportError:        # run as a script rather than as a package
+    from character import Player
+    from room import Room
+
+TRIGGERS = ('use', 'take', 'enter', 'vanquish', 'satisfy')
+
+def _has(world, player, item_name):
+    return player != None and player.has(item_name)
+
+def _lacks(world, player, item_name):
+    return player == None or not player.has(item_name)
+
+def _vanquished(world, player, name):
+    return world.characters[name].vanquished
+
+def _desire_met(world, player, name):
+    return world.characters[name].desire_met
+
+def _visited(world, player, name):
+    return world.rooms[name].visited
+
+def _used(world, player, name):
+    return world.rooms[name].item_used
+
+def _fired(world, player, number):
+    return number in world.rules.fired
+
+CONDITIONS = {'has': _has, 'lacks': _lacks, 'vanquished': _vanquished,
+              'desire_met': _desire_met, 'visited': _visited, 'used': _used,
+              'fired': _fired}
+"""Condition kind: function(world, player, argument) returning whether it holds."""
+
+_NAMED = {'has': 'items', 'lacks': 'items', 'vanquished': 'characters',
+          'desire_met': 'characters', 'visited': 'rooms', 'used': 'rooms'}
+
+ACTIONS = {'open_link': 5, 'close_link': 3, 'spawn': 3, 'give': 2, 'remove': 2}
+"""Action kind: length of its tuple."""
+
+
+class RuleEngine():
+    """ The rules of a world, indexed by what triggers them. """
+
+    def __init__(self, world, rules):
+        """Compile rules (from config) for world, which keeps this as world.rules,
+        and follow its events to trigger them. Raises ValueError for a rule
+        naming an unknown trigger, condition, action, room, item or character."""
+        self.world = world
+        self.rules = []             # number: (conditions, actions, message)
+        self.index = {}             # (when, what, where): list of rule numbers
+        self.fired = {}             # numbers of rules fired, in order: True
+        self.player = world.player  # player whose command is being run
+        self.holders = {}           # name of item rules place: inventory holding it
+        for number, rule in enumerate(rules):
+            when, what, where, conditions, actions, message = rule
+            if when not in TRIGGERS:
+                raise ValueError("rule " + str(number) + " has unknown trigger " + str(when))
+            self.__check(what, world.items if when in ('use', 'take') else world.characters)
+            self.__check(where, world.rooms)
+            tests = []
+            for condition in conditions:
+                if condition[0] not in CONDITIONS:
+                    raise ValueError("rule " + str(number) + " has unknown condition " +
+                                     str(condition[0]))
+                if condition[0] != "fired":
+                    self.__check(condition[1], getattr(world, _NAMED[condition[0]]))
+                tests.append((CONDITIONS[condition[0]], condition[1]))
+            for action in actions:
+                if ACTIONS.get(action[0]) != len(action):
+                    raise ValueError("rule " + str(number) + " has bad action " + str(action))
+                self.__check_action(action)
+            self.rules.append((tuple(tests), tuple(tuple(action) for action in actions),
+                               world.strings.intern(message)))
+            self.index.setdefault((when, what, where), []).append(number)
+        world.rules = self
+        self.__find_holders()
+        events = world.events
+        events.subscribe("add", self.on_add)
+        events.subscribe("remove", self.on_remove)
+        events.subscribe("move", self.on_move)
+        events.subscribe("vanquished", self.on_vanquished)
+        events.subscribe("desire_met", self.on_desire_met)
+
+    def __str__(self):
+        """return summary of rules as string representation"""
+        return (str(len(self.rules)) + " rules under " + str(len(self.index)) +
+                " triggers, " + str(len(self.fired)) + " fired")
+
+    def __check(self, name, known):
+        """Raise ValueError if name is not None and not in known"""
+        if name != None and name not in known:
+            raise ValueError("rule names unknown room, item or character " + str(name))
+
+    def __check_action(self, action):
+        """Raise ValueError if action names unknown rooms or items, noting
+        the (not stackable) items which spawn & give actions place"""
+        rooms = self.world.rooms
+        if action[0] == "open_link":
+            self.__check(action[1], rooms)
+            self.__check(action[3], rooms)
+        elif action[0] == "close_link":
+            self.__check(action[1], rooms)
+        else:
+            self.__check(action[1], self.world.items)
+            if action[0] == "spawn":
+                self.__check(action[2], rooms)
+            if action[0] != "remove" and not self.world.items[action[1]].stackable:
+                self.holders[action[1]] = None
+
+    def __find_holders(self):
+        """Find the inventory holding each item rules place (None if nowhere),
+        searching the whole world, as when built or restored"""
+        world = self.world
+        holders = self.holders
+        for name in holders:
+            holders[name] = None
+        inventories = ([room.contents for room in world.rooms.values()] +
+                       [character.items for character in world.characters.values()])
+        for inventory in inventories:
+            for item, units, container in inventory.walk():
+                if str(item) in holders:
+                    holders[str(item)] = inventory if container == None else container.items
+
+    # Triggering rules
+    def trigger(self, when, what, where):
+        """Fire the rules triggered by when, with what (name or None) in room
+        where (name), whose conditions hold. Returns True if any fired."""
+        index = self.index
+        found = False
+        if what != None:
+            keys = ((when, what, where), (when, what, None), (when, None, where),
+                    (when, None, None))
+        else:
+            keys = ((when, None, where), (when, None, None))
+        for key in keys:
+            numbers = index.get(key)
+            if numbers:
+                for number in numbers:
+                    if number not in self.fired and self.__holds(number):
+                        self.fire(number, where)
+                        found = True
+        return found
+
+    def __holds(self, number):
+        """Return whether all the conditions of rule number hold"""
+        world = self.world
+        player = self.player
+        for test, argument in self.rules[number][0]:
+            if not test(world, player, argument):
+                return False
+        return True
+
+    def fire(self, number, where = None):
+        """Fire rule number, triggered in room named where, making its actions"""
+        conditions, actions, message = self.rules[number]
+        self.fired[number] = True
+        if self.world.events != None:
+            self.world.events.emit("rule", number)
+        if message != None:
+            print(message)
+        for action in actions:
+            self.__act(action, where)
+
+    def __act(self, action, where):
+        """Make action, for rule triggered in room named where"""
+        world = self.world
+        kind = action[0]
+        if kind == "open_link":
+            self.set_link(action[1], action[2], action[3])
+            if action[4] != None:
+                self.set_link(action[3], action[4], action[1])
+        elif kind == "close_link":
+            self.set_link(action[1], action[2], None)
+        elif kind == "spawn":
+            room = action[2] if action[2] != None else where
+            if room != None:
+                item = world.items[action[1]]
+                self.__take_away(item)
+                world.rooms[room].leave(item)
+        elif kind == "give":
+            if self.player != None:
+                item = world.items[action[1]]
+                self.__take_away(item)
+                self.player.add(item)
+        elif kind == "remove":
+            if self.player != None and self.player.has(action[1]):
+                self.player.remove(self.player.find(action[1]))
+
+    def __take_away(self, item):
+        """Remove item from the room, character or container holding it, if
+        any, so it is never in two places, unless stackable"""
+        holder = self.holders.get(str(item))
+        if holder != None:
+            holder.remove(item)
+
+    def set_link(self, room_name, direction, to_name):
+        """Link room_name in direction to room to_name (or remove link if None),
+        announcing the change (see World.set_link)"""
+        self.world.set_link(room_name, direction, to_name)
+
+    def restore(self, fired):
+        """Set rules fired to list fired (in order), without announcing events
+        or making their actions (World.restore puts back the links they made),
+        and find where the items rules place now are"""
+        self.fired = dict.fromkeys(fired, True)
+        self.__find_holders()
+
+    # Event handlers triggering rules (but not while replaying the history)
+    def __replaying(self):
+        """Return whether the world's history is making changes from its journal"""
+        return self.world.history != None and self.world.history.replaying
+
+    def on_add(self, holder, item, units):
+        if str(item) in self.holders:
+            self.holders[str(item)] = holder.contents if isinstance(holder, Room) else holder.items
+        if self.__replaying():
+            return
+        if isinstance(holder, Player) and holder.location != None:
+            self.trigger("take", str(item), holder.location.name)
+
+    def on_remove(self, holder, item, units):
+        inventory = holder.contents if isinstance(holder, Room) else holder.items
+        if self.holders.get(str(item)) is inventory and not inventory.has(str(item)):
+            self.holders[str(item)] = None
+
+    def on_move(self, character, from_room, to_room):
+        if self.__replaying():
+            return
+        if isinstance(character, Player) and to_room != None:
+            self.trigger("enter", None, to_room.name)
+
+    def on_vanquished(self, enemy):
+        self.trigger("vanquish", enemy.name, None if enemy.location == None else enemy.location.name)
+
+    def on_desire_met(self, friend):
+        self.trigger("satisfy", friend.name, None if friend.location == None else friend.location.name)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import copy
+    import io
+    import random
+    import time
+    from game_config import default_config, grid_config
+    from history import History
+    from shared_world import SharedWorld
+    from world import World
+    print("Test RuleEngine\n")
+
+    config = copy.deepcopy(default_config)
+    config['rooms'].append(("Crypt", "A cold crypt, full of cobwebs.", None, None))
+    config['items'].append(("lantern", "An old brass lantern", None))
+    config['items'].append(("scroll", "A dusty scroll", None))
+    config['rules'] = [
+        ("use", "torch", "Cellar", [("vanquished", "Dave")],
+         [("open_link", "Cellar", "north", "Crypt", "south"), ("spawn", "lantern", None)],
+         "A hidden door swings open!"),
+        ("use", "torch", "Cellar", [], [], "The torch lights up the wine rack."),
+        ("enter", None, "Crypt", [("has", "lantern")], [("give", "scroll")],
+         "By the lantern's light you find a scroll."),
+    ]
+    world = World(config)
+    print(str(world.rules))
+    for cmd in ["go east", "take knife", "go north", "go down", "use torch",
+                "use torch", "go north"]:
+        print("> " + cmd)
+        world.execute(cmd)
+    world.characters["Dave"].vanquished = True
+    for cmd in ["use torch", "take lantern", "go north", "list"]:
+        print("> " + cmd)
+        world.execute(cmd)
+    print(str(world.rules))
+    restored = World(config)
+    restored.restore(world.state())
+    print("Restored world has link north from Cellar: " +
+          str(restored.rooms["Cellar"].check_direction("north")))
+
+    config = copy.deepcopy(default_config)
+    config['rules'] = [("take", "knife", None, [], [("spawn", "garlic", "Dining Hall")],
+                        "Something falls off the table."),
+                       ("take", "garlic", None, [], [("give", "sword")], None)]
+    world = World(config)
+    History(world)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for cmd in ["go east", "take knife", "take garlic", "undo", "undo", "redo", "redo"]:
+            world.execute(cmd)
+    held = lambda name: [str(holder) for holder in
+                         list(world.rooms.values()) + list(world.characters.values())
+                         if (holder.contents if holder in world.rooms.values()
+                             else holder.items).has(name)]
+    print("\nAfter undo & redo, garlic in: " + str(held("garlic")) + ", sword in: " +
+          str(held("sword")) + ", " + str(world.rules))
+
+    config = copy.deepcopy(default_config)
+    config['rules'] = [("enter", None, "Kitchen", [], [("give", "knife")],
+                        "A ghostly hand gives you a knife.")]
+    shared = SharedWorld(config)
+    for name, cmd in [("Alice", "go east"), ("Alice", "take knife"), ("Bob", "go east"),
+                      ("Bob", "go north")]:
+        shared.join(name)
+        shared.command(name, cmd)
+    print("Knife given to a player who joined, now held by: " +
+          str(shared.item_holders()["knife"]))
+
+    size = 200
+    num_rules = 50000
+    config = grid_config(size, size)
+    rand = random.Random(1)
+    items = [conf[0] for conf in config['items']]
+    config['rules'] = [
+        (rand.choice(["use", "take", "enter"]), None, str(rand.randrange(size)) + "-" +
+         str(rand.randrange(size)), [("has", rand.choice(items))], [], None)
+        for i in range(num_rules)]
+    for rule in list(config['rules'][:num_rules // 2]):
+        if rule[0] != "enter":
+            config['rules'].append((rule[0], rand.choice(items)) + rule[2:])
+    start = time.perf_counter()
+    world = World(config)
+    built = time.perf_counter() - start
+    print("\n" + str(world.rules) + ", built with world in %.2f sec" % built)
+    rooms = list(world.rooms)
+    triggers = [(rand.choice(["use", "take", "enter"]), rand.choice(items), rand.choice(rooms))
+                for i in range(10000)]
+    rules = world.rules
+    start = time.perf_counter()
+    for when, what, where in triggers:
+        rules.trigger(when, what, where)
+    indexed = time.perf_counter() - start
+    def scan(when, what, where):
+        """trigger by checking every rule, without the index"""
+        for key, numbers in rules.index.items():
+            if (key[0] == when and key[1] in (what, None) and key[2] in (where, None)):
+                for number in numbers:
+                    if number not in rules.fired:
+                        all(test(world, None, argument)
+                            for test, argument in rules.rules[number][0])
+    start = time.perf_counter()
+    for when, what, where in triggers[:100]:
+        scan(when, what, where)
+    scanned = (time.perf_counter() - start) / 100
+    print("Each trigger: indexed %.1f usec, scanning all rules %.1f msec"
+          % (indexed * 1e6 / len(triggers), scanned * 1e3))
@@ -0,0 +1,206 @@
+""" Batch runner to play command scripts headlessly in the adventure game.
+
+Each command script is a text file with one game command per line, exactly
+as they would be typed at the '>' prompt. Every script is played in its
+own new World, built from the same game configuration, by a pool of worker
+processes. The game output for each script is written to its own transcript
+file, and a one line json summary for each script is appended to a summary
+file as soon as that script finishes, so that many thousands of scripts can
+be run without keeping their transcripts in memory. The game config is
+loaded once and shared by the workers (see shared_data.py), rather than
+each keeping its own copy.
+
+Usually used via the package command line, eg.
+
+  python -m rpg run --config game_config.json --out results *.txt
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .analytics import RecordWriter
+    from .game_config import load_config
+    from .shared_data import SharedWorldData
+    from .world import World
+except ImportError:        # run as a script rather than as a package
+    from analytics import RecordWriter
+    from game_config import load_config
+    from shared_data import SharedWorldData
+    from world import World
+from multiprocessing import Pool
+import contextlib
+import json
+import os
+import sys
+import time
+
+class ScriptInput():
+    """ Stands in for sys.stdin while playing a command script.
+    Each command line read is echoed to the transcript after the prompt,
+    so the transcript reads the same as an interactive game.
+    """
+
+    def __init__(self, script_file, transcript):
+        """Create input reading commands from script_file, echoing to transcript"""
+        self.script_file = script_file
+        self.transcript = transcript
+
+    def readline(self):
+        """Return next command line from script, echoing it to the transcript"""
+        line = self.script_file.readline()
+        if line:
+            self.transcript.write(line if line.endswith("\n") else line + "\n")
+        return line
+
+
+def play_script(config, script_name, transcript_name):
+    """Play commands in file script_name in a new World built from config,
+    writing the game output to file transcript_name.
+    Returns a summary dict of the game results for this script.
+    """
+    summary = {'script': script_name, 'transcript': transcript_name}
+    defeats = []
+    start = time.perf_counter()
+    with open(script_name, 'r') as script_file, \
+         open(transcript_name, 'w') as transcript:
+        saved_stdin = sys.stdin
+        sys.stdin = ScriptInput(script_file, transcript)
+        try:
+            with contextlib.redirect_stdout(transcript):
+                world = World(config)
+                world.allow_hints(config)
+                world.events.subscribe("defeated",
+                    lambda character, enemy: defeats.append((character.get_location(), enemy)))
+                summary['escaped'] = world.play()
+        except Exception as msg:    # report script failure in summary, not stop batch
+            summary['escaped'] = False
+            summary['error'] = type(msg).__name__ + ": " + str(msg)
+            return summary
+        finally:
+            sys.stdin = saved_stdin
+    summary.update(world.counters())
+    if world.player != None:
+        summary['item_needed'] = world.player.has(world.success[1])
+        summary['item_not_have'] = world.player.has(world.success[2])
+        summary['items'] = world.player.items.size()
+    if defeats:
+        summary['died_in'] = str(defeats[-1][0])
+        summary['died_to'] = str(defeats[-1][1])
+    summary['seconds'] = round(time.perf_counter() - start, 6)
+    return summary
+
+
+# per worker process game config, loaded or attached once by _init_worker
+_worker_config = None
+_worker_data = None
+
+def _init_worker(config_name, shared_name = None):
+    """Attach the SharedWorldData called shared_name once in each worker
+    process, or if None load game config from file config_name"""
+    global _worker_config, _worker_data
+    if shared_name != None:
+        _worker_data = SharedWorldData.attach(shared_name)
+        _worker_config = _worker_data.config()
+    else:
+        _worker_config = load_config(config_name)
+
+def _run_task(task):
+    """Play one (script, transcript) task in a worker process"""
+    return play_script(_worker_config, task[0], task[1])
+
+def transcript_name(out_dir, index, script_name):
+    """Return unique transcript file name in out_dir for index'th script"""
+    stem = os.path.splitext(os.path.basename(script_name))[0]
+    return os.path.join(out_dir, "%06d-%s.txt" % (index, stem))
+
+def run_batch(scripts, out_dir, config_name = None, workers = None,
+              summary_name = None, analytics_name = None, share = True):
+    """Play every command script in scripts using a pool of worker processes.
+
+    Transcripts are written into out_dir, and a json line summary for each
+    script is appended to summary_name (default out_dir/summary.jsonl) as
+    each script completes, in completion order. If analytics_name is given,
+    a session record (see analytics.py) for each script is appended to it,
+    numbered by the script's position in scripts. Unless share is False,
+    the config is packed once into shared memory attached by every worker.
+    Returns a dict of totals over the batch: scripts, escaped, errors.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if summary_name == None:
+        summary_name = os.path.join(out_dir, "summary.jsonl")
+    tasks = []
+    numbers = {}
+    for i, script in enumerate(scripts):
+        tasks.append((script, transcript_name(out_dir, i, script)))
+        numbers[tasks[-1][1]] = i
+    totals = {'scripts': 0, 'escaped': 0, 'errors': 0}
+    with contextlib.ExitStack() as stack:
+        summary_file = stack.enter_context(open(summary_name, 'w'))
+        records = (stack.enter_context(RecordWriter(analytics_name))
+                   if analytics_name != None else None)
+        shared_name = None
+        if share:
+            shared_name = stack.enter_context(
+                SharedWorldData.create(load_config(config_name))).name
+        pool = stack.enter_context(Pool(workers, _init_worker, (config_name, shared_name)))
+        for summary in pool.imap_unordered(_run_task, tasks, chunksize=8):
+            summary_file.write(json.dumps(summary) + "\n")
+            if records != None:
+                records.write(numbers[summary['transcript']], summary)
+            totals['scripts'] += 1
+            if summary['escaped']:
+                totals['escaped'] += 1
+            if 'error' in summary:
+                totals['errors'] += 1
+    return totals
+
+def main(args):
+    """Run batch of scripts given parsed command line args
+    (with config, out, workers, summary, analytics, no_share, scripts)."""
+    start = time.perf_counter()
+    totals = run_batch(args.scripts, args.out, args.config, args.workers,
+                       args.summary, args.analytics, not args.no_share)
+    print("Ran " + str(totals['scripts']) + " scripts in " +
+          "%.2f" % (time.perf_counter() - start) + " seconds: " +
+          str(totals['escaped']) + " escaped, " +
+          str(totals['errors']) + " errors.")
+    return totals['errors'] == 0
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import tempfile
+    print("Test batch runner with default config\n")
+
+    winning = ["go east", "take knife", "go north", "take garlic", "go down",
+               "use torch", "take wine", "go up", "go sw", "go west",
+               "give wine", "go east", "go up", "go up", "go west",
+               "fight garlic", "take sword", "go east", "go down", "go down",
+               "fight sword", "take key", "leave sword", "shazam"]
+    with tempfile.TemporaryDirectory() as tmp:
+        scripts = []
+        for i in range(20):
+            name = os.path.join(tmp, "script%d.txt" % i)
+            with open(name, 'w') as f:
+                if i % 4 == 0:          # loses fight with Rusty
+                    f.write("look\nfight torch\n")
+                elif i % 2 == 0:        # no exit, relies on end of input
+                    f.write("look\ngo north\nhelp\n")
+                else:
+                    f.write("\n".join(winning))
+            scripts.append(name)
+        records = os.path.join(tmp, "sessions.bin")
+        totals = run_batch(scripts, os.path.join(tmp, "out"), workers=4,
+                           analytics_name=records)
+        print("Batch totals: " + str(totals))
+        unshared = run_batch(scripts, os.path.join(tmp, "unshared"), workers=4, share=False)
+        print("Same totals with config loaded by each worker: " + str(unshared == totals))
+        from analytics import Aggregator
+        aggregator = Aggregator(3)
+        aggregator.add_file(records)
+        aggregator.report()
+        with open(os.path.join(tmp, "out", "summary.jsonl")) as f:
+            for line in f.readlines()[:3]:
+                print(line.strip())
@@ -0,0 +1,252 @@
+""" Session manager hosting many game sessions in one process.
+
+Each session is a World being played by one player, identified by a
+session id (any string). Only the most recently used sessions are kept in
+memory, up to a budget given as a number of sessions and/or bytes.
+When over budget, or idle for too long, the least recently used sessions
+are evicted: their state (see World.state) is saved as a small compressed
+snapshot file, and their World discarded. The next command for an evicted
+session rehydrates it, by building a World from the shared config and
+restoring its state, so evictions are invisible to the player.
+
+Snapshots hold just what changed in play, not the world itself, so they
+are small and quick to write and read; rehydration costs about the same as
+building the world, and its timing is kept (with those of evictions) in
+stats, along with how often it took longer than the latency target.
+The timed events of every session's world (see timers.py) share one
+TimerWheel, advanced before each command; an evicted session's timers
+are cancelled, and started afresh when it is rehydrated.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .game_config import default_config
+    from .string_table import StringTable
+    from .timers import TimerWheel
+    from .world import World
+except ImportError:        # run as a script rather than as a package
+    from game_config import default_config
+    from string_table import StringTable
+    from timers import TimerWheel
+    from world import World
+from collections import OrderedDict
+import contextlib
+import io
+import os
+import pickle
+import time
+import tracemalloc
+import urllib.parse
+import zlib
+
+class SessionManager():
+    """ Game sessions, kept in memory while active, and on disk when idle. """
+
+    def __init__(self, directory, config = None, max_sessions = 100,
+                 max_bytes = None, latency_target = 0.05):
+        """Create manager for sessions playing config (default_config), with
+        snapshots of evicted sessions kept in directory. At most max_sessions
+        sessions (and if given, an estimated max_bytes of memory) are kept
+        in memory. Rehydrations over latency_target seconds are counted."""
+        if config == None:
+            config = default_config
+        self.directory = directory
+        self.config = config
+        self.strings = StringTable()    # text shared by all sessions' worlds
+        self.wheel = TimerWheel()       # timed events of all sessions' worlds
+        self.latency_target = latency_target
+        self.active = OrderedDict()     # session id: (world, last used time), oldest first
+        self.described = {}             # session id: room last described
+        self.saved = set()              # session ids with snapshots on disk
+        self.stats = {'evictions': 0, 'rehydrations': 0, 'evict_seconds': 0.0,
+                      'rehydrate_seconds': 0.0, 'max_rehydrate': 0.0,
+                      'over_target': 0, 'snapshot_bytes': 0}
+        os.makedirs(directory, exist_ok=True)
+        self.world_bytes = self.__measure_world()
+        self.max_sessions = max_sessions
+        if max_bytes != None:
+            self.max_sessions = max(1, min(max_sessions, max_bytes // self.world_bytes))
+
+    def __str__(self):
+        """return summary of sessions as string representation"""
+        return (str(len(self.active)) + " sessions in memory (about " +
+                str(len(self.active) * self.world_bytes) + " bytes), " +
+                str(len(self.saved)) + " on disk")
+
+    def __measure_world(self):
+        """Return bytes of memory used by another world built from config
+        (its text being already in the shared string table)"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            World(self.config, self.strings)
+            tracemalloc.start()
+            try:
+                world = World(self.config, self.strings)
+                size = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+        return max(size, 1)
+
+    def snapshot_name(self, session_id):
+        """Return file name of snapshot for session_id"""
+        return os.path.join(self.directory,
+                            urllib.parse.quote(session_id, safe="") + ".snap")
+
+    def command(self, session_id, inp):
+        """Run command line inp in session_id's game, returning the output text.
+        A new session id starts a new game, and when a game ends its session
+        is closed. The room is described when the player enters it."""
+        buffer = io.StringIO()
+        self.wheel.advance()
+        with contextlib.redirect_stdout(buffer):
+            world = self.__world(session_id)
+            keep_playing = world.execute(inp)
+            room = world.player.get_location()
+            if keep_playing and room != self.described.get(session_id):
+                print("You are in the:")
+                room.describe()
+                self.described[session_id] = room
+        if not keep_playing:
+            self.close(session_id)
+        else:
+            self.__fit_budget()
+        return buffer.getvalue()
+
+    def __world(self, session_id):
+        """Return world for session_id, rehydrating or starting it if needed"""
+        if session_id in self.active:
+            self.active.move_to_end(session_id)
+            world = self.active[session_id][0]
+        elif session_id in self.saved:
+            world = self.rehydrate(session_id)
+        else:
+            world = World(self.config, self.strings)
+            world.allow_hints(self.config)
+            world.start_timers(self.wheel)
+            print("Welcome to " + world.title)
+            print(world.messages['intro'])
+        self.active[session_id] = (world, time.monotonic())
+        return world
+
+    def __fit_budget(self):
+        """Evict least recently used sessions until within budget"""
+        while len(self.active) > self.max_sessions:
+            self.evict(next(iter(self.active)))
+
+    def evict(self, session_id):
+        """Save session_id's world state to disk, and drop it from memory"""
+        start = time.perf_counter()
+        world, last_used = self.active.pop(session_id)
+        world.stop_timers()
+        described = self.described.pop(session_id, None)
+        state = (world.state(), None if described == None else described.get_name())
+        data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+        name = self.snapshot_name(session_id)
+        with open(name + ".tmp", "wb") as snapshot:
+            snapshot.write(data)
+        os.replace(name + ".tmp", name)
+        self.saved.add(session_id)
+        self.stats['evictions'] += 1
+        self.stats['snapshot_bytes'] += len(data)
+        self.stats['evict_seconds'] += time.perf_counter() - start
+
+    def evict_idle(self, max_idle):
+        """Evict sessions not used for max_idle seconds, returning how many"""
+        now = time.monotonic()
+        idle = [session_id for session_id, (world, last_used) in self.active.items()
+                if now - last_used >= max_idle]
+        for session_id in idle:
+            self.evict(session_id)
+        return len(idle)
+
+    def rehydrate(self, session_id):
+        """Return world for evicted session_id, rebuilt from its snapshot"""
+        start = time.perf_counter()
+        with open(self.snapshot_name(session_id), "rb") as snapshot:
+            state, described = pickle.loads(zlib.decompress(snapshot.read()))
+        world = World(self.config, self.strings)
+        world.allow_hints(self.config)
+        world.restore(state)
+        world.start_timers(self.wheel)
+        if described != None:
+            self.described[session_id] = world.rooms[described]
+        os.remove(self.snapshot_name(session_id))
+        self.saved.discard(session_id)
+        elapsed = time.perf_counter() - start
+        self.stats['rehydrations'] += 1
+        self.stats['rehydrate_seconds'] += elapsed
+        self.stats['max_rehydrate'] = max(self.stats['max_rehydrate'], elapsed)
+        if elapsed > self.latency_target:
+            self.stats['over_target'] += 1
+        return world
+
+    def close(self, session_id):
+        """End session_id, forgetting it in memory and on disk"""
+        world, last_used = self.active.pop(session_id, (None, None))
+        if world != None:
+            world.stop_timers()
+        self.described.pop(session_id, None)
+        if session_id in self.saved:
+            os.remove(self.snapshot_name(session_id))
+            self.saved.discard(session_id)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import random
+    import tempfile
+    print("Test SessionManager\n")
+
+    commands = ["go east", "take knife", "go north", "take garlic", "go down",
+                "use torch", "take wine", "go up", "go sw", "go west", "give wine",
+                "go east", "talk", "look", "go up", "go up", "go west", "list"]
+
+    def play(manager, num_sessions, steps, seed = 1):
+        """Play steps commands in random sessions, returning all output"""
+        rand = random.Random(seed)
+        random.seed(seed)
+        progress = {}
+        output = []
+        for step in range(steps):
+            session_id = "player/" + str(rand.randrange(num_sessions))
+            cmd = commands[progress.get(session_id, 0) % len(commands)]
+            progress[session_id] = progress.get(session_id, 0) + 1
+            output.append(manager.command(session_id, cmd))
+        return output
+
+    with tempfile.TemporaryDirectory() as directory:
+        reference = SessionManager(os.path.join(directory, "all"), max_sessions=1000)
+        expected = play(reference, 500, 5000)
+        manager = SessionManager(os.path.join(directory, "some"), max_sessions=50)
+        start = time.perf_counter()
+        output = play(manager, 500, 5000)
+        elapsed = time.perf_counter() - start
+        print("Each world takes about " + str(manager.world_bytes) + " bytes, so a 100000 byte " +
+              "budget keeps " + str(SessionManager(directory, max_bytes=100000).max_sessions) +
+              " in memory")
+        print(str(manager))
+        print("Output same as sessions never evicted: " + str(output == expected))
+        stats = manager.stats
+        print("%d commands in %.2f sec, %d evictions (%.3f msec each, %d bytes each),"
+              % (len(output), elapsed, stats['evictions'],
+                 stats['evict_seconds'] * 1000 / max(stats['evictions'], 1),
+                 stats['snapshot_bytes'] // max(stats['evictions'], 1)))
+        print("%d rehydrations (%.3f msec each, max %.3f msec, %d over %.0f msec target)"
+              % (stats['rehydrations'],
+                 stats['rehydrate_seconds'] * 1000 / max(stats['rehydrations'], 1),
+                 stats['max_rehydrate'] * 1000, stats['over_target'],
+                 manager.latency_target * 1000))
+        time.sleep(0.01)
+        print("Evicted " + str(manager.evict_idle(0.005)) + " idle sessions, now " + str(manager))
+
+        timed_config = dict(default_config)
+        timed_config['timers'] = [("close_link", "Entry Hall", "ne", 0.2), ("wander", "Mona", 60)]
+        timed = SessionManager(os.path.join(directory, "timed"), timed_config)
+        timed.command("door", "look")
+        time.sleep(0.3)
+        print("\nGoing ne after the door closes: " +
+              timed.command("door", "go ne").strip().splitlines()[0] + ", timers: " + str(timed.wheel))
+        timed.close("door")
+        print("After the session closes, timers: " + str(timed.wheel))
@@ -0,0 +1,471 @@
+""" Sharded execution of one large world across several worker processes.
+
+The rooms of the world are partitioned into shards, each owned by its own
+worker process, choosing the partition to keep the shards the same size
+while cutting as few links between rooms as possible (see partition_rooms).
+Every worker builds the whole world from the config, but then clears the
+rooms, characters and items it does not own, so it only holds authoritative
+state for its own shard.
+
+A ShardedWorld coordinator routes each player's commands to the worker
+owning the room they are in, with all the commands for a shard sent as one
+batch per tick so the workers run in parallel. When a player goes through a
+link into a room owned by another shard (or a character wanders into one),
+they are removed from the old shard along with their inventory, passed
+through the coordinator, and placed in the new shard, so at every moment
+they (and what they carry) exist in exactly one place.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Enemy, Friend, Player
+    from .world import World
+except ImportError:        # run as a script rather than as a package
+    from character import Enemy, Friend, Player
+    from world import World
+from collections import deque
+from multiprocessing import Pipe, Process
+import contextlib
+import io
+
+def room_graph(config):
+    """Return (names, neighbours) for the rooms in config, where names is a
+    list of room names, and neighbours[i] the list of room numbers linked
+    to room i in either direction."""
+    names = [conf[0] for conf in config['rooms']]
+    number = {name: i for i, name in enumerate(names)}
+    neighbours = [[] for name in names]
+    for conf in config['links']:
+        a, b = number[conf[0]], number[conf[2]]
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    return names, neighbours
+
+def partition_rooms(config, num_shards, passes = 2):
+    """Partition the rooms in config into num_shards shards of similar size,
+    with few links between shards. Returns dict room name: shard number.
+
+    Shards are first grown breadth first from well separated seed rooms,
+    taking turns so they stay balanced, then improved by passes that move
+    rooms on a shard boundary to the neighbouring shard most of their
+    links go to, if that cuts fewer links and keeps the shards balanced.
+    """
+    names, neighbours = room_graph(config)
+    n = len(names)
+    shard = [-1] * n
+    if n == 0 or num_shards <= 1:
+        return {name: 0 for name in names}
+    capacity = -(-n // num_shards)          # ceiling of n / num_shards
+    sizes = [0] * num_shards
+
+    # pick seeds: each is the room furthest from the seeds picked so far
+    seeds = [0]
+    distance = _bfs_distances(neighbours, [0])
+    while len(seeds) < num_shards:
+        seed = max(range(n), key=lambda i: (distance[i] if distance[i] >= 0
+                                            else n, -i))
+        if seed in seeds:
+            seed = next(i for i in range(n) if i not in seeds)
+        seeds.append(seed)
+        distance = _bfs_distances(neighbours, seeds)
+
+    # grow shards breadth first, one room each in turn
+    frontiers = [deque([seed]) for seed in seeds]
+    unassigned = n
+    next_free = 0                           # for rooms not linked to any shard
+    while unassigned > 0:
+        grew = False
+        for s in range(num_shards):
+            frontier = frontiers[s]
+            while frontier and sizes[s] < capacity:
+                room = frontier.popleft()
+                if shard[room] == -1:
+                    shard[room] = s
+                    sizes[s] += 1
+                    unassigned -= 1
+                    frontier.extend(r for r in neighbours[room] if shard[r] == -1)
+                    grew = True
+                    break
+        if not grew:                        # start smallest shard on a new room
+            while shard[next_free] != -1:
+                next_free += 1
+            s = sizes.index(min(sizes))
+            frontiers[s].append(next_free)
+
+    # refine by moving boundary rooms to reduce cut links
+    limit = capacity + max(1, capacity // 20)
+    for p in range(passes):
+        moved = 0
+        for room in range(n):
+            own = shard[room]
+            counts = {}
+            for r in neighbours[room]:
+                counts[shard[r]] = counts.get(shard[r], 0) + 1
+            best, best_count = own, counts.get(own, 0)
+            for s in counts:
+                if counts[s] > best_count and sizes[s] < limit:
+                    best, best_count = s, counts[s]
+            if best != own and sizes[own] > 1:
+                shard[room] = best
+                sizes[own] -= 1
+                sizes[best] += 1
+                moved += 1
+        if moved == 0:
+            break
+    return {names[i]: shard[i] for i in range(n)}
+
+def _bfs_distances(neighbours, sources):
+    """Return list of link distance from nearest of sources to each room
+    (-1 if not reachable)."""
+    distance = [-1] * len(neighbours)
+    queue = deque(sources)
+    for source in sources:
+        distance[source] = 0
+    while queue:
+        room = queue.popleft()
+        for r in neighbours[room]:
+            if distance[r] == -1:
+                distance[r] = distance[room] + 1
+                queue.append(r)
+    return distance
+
+def count_cut_links(config, owner):
+    """Return number of links in config joining rooms in different shards"""
+    return sum(1 for conf in config['links'] if owner[conf[0]] != owner[conf[2]])
+
+
+def _pack(character, from_room):
+    """Return handoff record for character leaving from_room with what it carries.
+    Record is (kind, name, room, from_room, list of (item name, units, container
+    name or None), flags), listing what is inside each container after it."""
+    flags = {'hp': character.hp}
+    if isinstance(character, Enemy):
+        flags['vanquished'] = character.vanquished
+    elif isinstance(character, Friend):
+        flags['desire_met'] = character.desire_met
+    kind = "player" if isinstance(character, Player) else "npc"
+    return (kind, character.get_name(), character.get_location().get_name(),
+            from_room.get_name(),
+            [(str(item), units, None if inside == None else str(inside))
+             for item, units, inside in character.items.walk()], flags)
+
+class ShardWorker():
+    """ The world state owned by one shard, run in its own worker process. """
+
+    def __init__(self, config, owner, shard):
+        """Build world from config, keeping only rooms with owner[name] == shard,
+        and the characters & items in them."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.world = World(config)
+        self.shard = shard
+        self.owned = set(name for name in owner if owner[name] == shard)
+        self.players = {}
+        self.limbo = []                 # returned characters with no room free
+        for room in self.world.rooms.values():
+            if room.get_name() not in self.owned:
+                room.contents.clear()
+                room.occupant = None
+        for character in self.world.characters.values():
+            if character.get_location().get_name() not in self.owned:
+                character.location = None
+                character.items.clear()
+            elif isinstance(character, Player):
+                self.players[character.get_name()] = character
+
+    def owns(self, room):
+        """Return whether this shard owns room"""
+        return room != None and room.get_name() in self.owned
+
+    def run_commands(self, batch):
+        """Run (player name, command) pairs in batch.
+        Returns (outputs, handoffs, ended) with a dict of player name: output,
+        handoff records for characters that left this shard, and list of
+        names of players whose game ended."""
+        outputs = {}
+        handoffs = []
+        ended = []
+        for name, inp in batch:
+            player = self.players.get(name)
+            if player == None:
+                outputs[name] = "You are not in this world!\n"
+                continue
+            room = player.get_location()
+            occupant = room.get_occupant()
+            buffer = io.StringIO()
+            with contextlib.redirect_stdout(buffer):
+                keep_playing = self.world.execute(inp, player)
+                now = player.get_location()
+                if keep_playing and now != room and self.owns(now):
+                    print("You are in the:")
+                    now.describe()
+            outputs[name] = buffer.getvalue()
+            if not keep_playing:            # leave belongings behind
+                for item, units in player.items.stacks():
+                    player.remove(item)
+                    room.leave(item, units)
+                del self.players[name]
+                ended.append(name)
+            elif not self.owns(now):
+                handoffs.append(self.__hand_off(player, room))
+            if (occupant != None and occupant.get_location() != room and
+                not self.owns(occupant.get_location())):
+                handoffs.append(self.__hand_off(occupant, room))
+        return outputs, handoffs, ended
+
+    def __hand_off(self, character, from_room):
+        """Remove character (& its items) leaving from_room for another shard,
+        returning its handoff record"""
+        record = _pack(character, from_room)
+        character.items.clear()
+        if not isinstance(character, Player):
+            character.get_location().occupant = None
+        character.location = None
+        self.players.pop(character.get_name(), None)
+        return record
+
+    def accept(self, records):
+        """Place characters from handoff records into their rooms in this shard.
+        Returns (outputs, rejected) with arrival descriptions for players, and
+        the records of characters whose room was already occupied."""
+        outputs = {}
+        rejected = []
+        for record in records:
+            kind, name, room_name, from_room, items, flags = record
+            room = self.world.rooms[room_name]
+            character = self.world.characters.get(name)
+            if kind == "player":
+                if character == None:
+                    character = Player(name)
+                    self.world.characters[name] = character
+                character.move_to(room)
+                self.players[name] = character
+                buffer = io.StringIO()
+                with contextlib.redirect_stdout(buffer):
+                    print("You are in the:")
+                    room.describe()
+                outputs[name] = buffer.getvalue()
+            elif room.get_occupant() == None:
+                character.move_to(room)
+            else:
+                rejected.append(record)
+                continue
+            self.__restore(character, items, flags)
+        return outputs, rejected
+
+    def take_back(self, records):
+        """Return characters rejected by another shard to a free room in this one"""
+        for record in records + self.limbo:
+            kind, name, room_name, from_room, items, flags = record
+            character = self.world.characters[name]
+            start = self.world.rooms[from_room]
+            for room in [start] + list(start.linked_rooms.values()):
+                if self.owns(room) and room.get_occupant() == None:
+                    character.move_to(room)
+                    self.__restore(character, items, flags)
+                    break
+            else:
+                if record not in self.limbo:
+                    self.limbo.append(record)
+                continue
+            if record in self.limbo:
+                self.limbo.remove(record)
+
+    def __restore(self, character, items, flags):
+        """Give character the named items & flags from a handoff record"""
+        for item_name, units, inside in items:
+            if inside == None:
+                character.add(self.world.items[item_name], units)
+            else:
+                self.world.items[inside].items.add(self.world.items[item_name], units)
+        for flag in flags:
+            setattr(character, flag, flags[flag])
+
+    def add_player(self, name, room_name):
+        """Add a new player to this shard in the named room"""
+        self.accept([("player", name, room_name, room_name, [], {})])
+
+    def census(self):
+        """Return (number of players, dict item name: holder) for this shard"""
+        holders = {}
+        for room in self.world.rooms.values():
+            if self.owns(room):
+                for item, units, inside in room.contents.walk():
+                    holders[str(item)] = room.get_name() if inside == None else str(inside)
+        for character in self.world.characters.values():
+            if self.owns(character.get_location()):
+                for item, units, inside in character.items.walk():
+                    holders[str(item)] = (character.get_name() if inside == None
+                                          else str(inside))
+        return len(self.players), holders
+
+def _worker_main(conn, config, owner, shard):
+    """Worker process main loop, running requests from the coordinator"""
+    worker = ShardWorker(config, owner, shard)
+    while True:
+        request, args = conn.recv()
+        if request == "stop":
+            break
+        conn.send(getattr(worker, request)(*args))
+    conn.close()
+
+
+class ShardedWorld():
+    """ Coordinator for a world whose rooms are split across worker processes. """
+
+    def __init__(self, config, num_shards):
+        """Partition config rooms into num_shards, starting a worker for each"""
+        self.config = config
+        self.num_shards = num_shards
+        self.owner = partition_rooms(config, num_shards)
+        self.connections = []
+        self.workers = []
+        for shard in range(num_shards):
+            parent, child = Pipe()
+            worker = Process(target=_worker_main,
+                             args=(child, config, self.owner, shard), daemon=True)
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+        self.player_shard = {}
+        for conf in config['players']:
+            self.player_shard[conf[0]] = self.owner[conf[2]]
+        self.handoffs = 0
+
+    def __str__(self):
+        """return sharding summary as string representation"""
+        return (self.config['title'] + " in " + str(self.num_shards) +
+                " shards, with " + str(count_cut_links(self.config, self.owner)) +
+                " of " + str(len(self.config['links'])) + " links between shards.")
+
+    def __call(self, requests):
+        """Send dict shard: (request, args) to the workers in parallel,
+        returning dict shard: reply"""
+        for shard in requests:
+            self.connections[shard].send(requests[shard])
+        return {shard: self.connections[shard].recv() for shard in requests}
+
+    def add_player(self, name, room_name):
+        """Add new player with name in the named room"""
+        shard = self.owner[room_name]
+        self.__call({shard: ("add_player", (name, room_name))})
+        self.player_shard[name] = shard
+
+    def tick(self, commands):
+        """Run one command for each player in dict of player name: command,
+        returning dict of player name: output."""
+        batches = {}
+        for name in commands:
+            shard = self.player_shard.get(name, 0)
+            batches.setdefault(shard, []).append((name, commands[name]))
+        replies = self.__call({shard: ("run_commands", (batches[shard],))
+                               for shard in batches})
+        outputs = {}
+        moving = {}
+        for shard in replies:
+            shard_outputs, handoffs, ended = replies[shard]
+            outputs.update(shard_outputs)
+            for name in ended:
+                self.player_shard.pop(name, None)
+            for record in handoffs:
+                destination = self.owner[record[2]]
+                moving.setdefault(destination, []).append((shard, record))
+        if moving:
+            self.handoffs += sum(len(records) for records in moving.values())
+            replies = self.__call({shard: ("accept", ([r for s, r in moving[shard]],))
+                                   for shard in moving})
+            returned = {}
+            for shard in replies:
+                arrivals, rejected = replies[shard]
+                for name in arrivals:
+                    outputs[name] = outputs.get(name, "") + arrivals[name]
+                    self.player_shard[name] = shard
+                for source, record in moving[shard]:
+                    if record in rejected:
+                        returned.setdefault(source, []).append(record)
+            if returned:
+                self.__call({shard: ("take_back", (returned[shard],))
+                             for shard in returned})
+        return outputs
+
+    def census(self):
+        """Return (number of players, dict item name: list of holders) over all shards"""
+        players = 0
+        holders = {}
+        replies = self.__call({shard: ("census", ()) for shard in range(self.num_shards)})
+        for shard in replies:
+            count, shard_holders = replies[shard]
+            players += count
+            for name in shard_holders:
+                holders.setdefault(name, []).append(shard_holders[name])
+        return players, holders
+
+    def close(self):
+        """Stop all the worker processes"""
+        for conn in self.connections:
+            conn.send(("stop", ()))
+        for worker in self.workers:
+            worker.join()
+
+
+def benchmark(rows = 100, cols = 100, num_players = 2000, ticks = 20,
+              shard_counts = (1, 2, 4, 8), seed = 1):
+    """Print commands per second running random moves for num_players in a
+    rows x cols grid world, for each number of shards in shard_counts."""
+    import random
+    import time
+    try:
+        from .game_config import grid_config
+    except ImportError:
+        from game_config import grid_config
+    config = grid_config(rows, cols, seed)
+    directions = ["go north", "go south", "go east", "go west", "look"]
+    for num_shards in shard_counts:
+        rand = random.Random(seed)
+        sharded = ShardedWorld(config, num_shards)
+        for i in range(num_players):
+            room = str(rand.randrange(rows)) + "-" + str(rand.randrange(cols))
+            sharded.add_player("P" + str(i), room)
+        start = time.perf_counter()
+        for t in range(ticks):
+            sharded.tick({"P" + str(i): rand.choice(directions)
+                          for i in range(num_players)})
+        elapsed = time.perf_counter() - start
+        players, holders = sharded.census()
+        sharded.close()
+        print("%2d shards: %8.0f commands/sec, %6d handoffs, cut %5d links, "
+              "%d players, items ok %s" % (num_shards,
+              num_players * ticks / elapsed, sharded.handoffs,
+              count_cut_links(config, sharded.owner), players,
+              all(len(h) == 1 for h in holders.values()) and
+              len(holders) == len(config['items'])))
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import sys
+    try:
+        from .game_config import default_config
+    except ImportError:
+        from game_config import default_config
+    print("Test sharded world with default config\n")
+
+    owner = partition_rooms(default_config, 3)
+    print("Partition into 3 shards: " + str(owner))
+    print("Cut links: " + str(count_cut_links(default_config, owner)))
+    sharded = ShardedWorld(default_config, 3)
+    print(str(sharded))
+    for cmd in ["go east", "take knife", "go north", "go down", "take wine",
+                "go up", "go sw", "go up", "go up"]:
+        print("> " + cmd + "   [shard " + str(sharded.player_shard["Me"]) + "]")
+        print(sharded.tick({"Me": cmd})["Me"])
+    print("Census (players, item holders): " + str(sharded.census()))
+    sharded.close()
+
+    print("\nThroughput benchmark on generated grid world")
+    if len(sys.argv) > 1:
+        benchmark(rows=int(sys.argv[1]), cols=int(sys.argv[1]))
+    else:
+        benchmark(rows=50, cols=50, num_players=1000, ticks=10)
@@ -0,0 +1,360 @@
+""" Share the read only data of a game config between worker processes.
+
+Every worker in a pool (see runner.py) builds its worlds from the same
+config, and loading it separately in each worker keeps a copy of every
+description, conversation and message, and of the room links & item
+placements, in each of them. Instead SharedWorldData packs the config once
+into a single block of OS shared memory, which each worker attaches by name
+without copying:
+
+  texts    the distinct strings of the config, utf-8 encoded end to end,
+           with an array of the offsets where each starts
+  cells    the rows of the rooms, links, items, characters, containers &
+           messages sections, as arrays of ints referring to the texts
+  frame    the remaining small sections (title, success, dialogues, rules)
+
+A worker's SharedConfig reads like the config dict, decoding each row when
+it is asked for, so World(config) builds a world from it as usual. Names
+become ordinary strings (as worlds look things up by them), while
+descriptions & messages become SharedText handles, which like a
+CompressedText (see string_table.py) are decoded from the shared block when
+printed or passed to text(), through a small LRU cache. So only the rooms,
+characters & items of the worlds being played, the state which changes,
+are kept per worker.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from multiprocessing import shared_memory
+import pickle
+import struct
+
+_HEADER = struct.Struct("<8sqqqqq")  # magic, texts, blob at, cells at, frame at, frame size
+_MAGIC = b"RPGDATA1"
+
+# cells are (value << 2) | tag, with tag:
+_NONE, _NAME, _TEXT, _INT = 0, 1, 2, 3
+_ABSENT = 4                 # _NONE tag with value 1, padding rows short of the width
+
+TABLES = {'rooms': (1, 3), 'links': (), 'items': (1,), 'containers': (),
+          'enemies': (1, 2, 5), 'hunters': (1, 2, 5), 'friends': (1, 2, 5),
+          'players': (1,), 'messages': (1,)}
+"""Config section packed as rows of cells: the columns holding texts (rather than names)."""
+
+
+class SharedText():
+    """ A text kept in the shared block of a SharedWorldData.
+    Converting it to a string (eg. by print) decodes it. """
+
+    __slots__ = ('data', 'index')
+
+    def __init__(self, data, index):
+        """Create handle for the index'th text of SharedWorldData data"""
+        self.data = data
+        self.index = index
+
+    def __str__(self):
+        """return the decoded text"""
+        return self.data.text(self.index)
+
+    def __len__(self):
+        """return length of the decoded text"""
+        return len(self.data.text(self.index))
+
+
+class SharedWorldData():
+    """ A game config packed into a block of shared memory, attached by name. """
+
+    def __init__(self, memory, owner, cache_size = 256):
+        """Use the packed config in SharedMemory memory, which is unlinked
+        on close if owner (created it). Keeps an LRU cache of cache_size texts."""
+        self.memory = memory
+        self.owner = owner
+        self.name = memory.name
+        magic, count, blob_at, cells_at, frame_at, frame_size = _HEADER.unpack_from(memory.buf)
+        if magic != _MAGIC:
+            raise ValueError("shared memory " + memory.name + " does not hold world data")
+        buf = memory.buf
+        self.offsets = buf[_HEADER.size:blob_at].cast('q')
+        self.blob = buf[blob_at:cells_at]
+        self.cells = buf[cells_at:frame_at].cast('q')
+        self.frame = pickle.loads(buf[frame_at:frame_at + frame_size])
+        self.names = {}             # index: decoded name, shared by every row
+        self.handles = {}           # index: its SharedText, shared by every row
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # index: decoded text
+
+    @classmethod
+    def create(cls, config):
+        """Return new SharedWorldData holding config, owning its shared memory"""
+        image = pack(config)
+        memory = shared_memory.SharedMemory(create=True, size=len(image))
+        memory.buf[:len(image)] = image
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name):
+        """Return SharedWorldData for the shared memory called name, made by create"""
+        return cls(shared_memory.SharedMemory(name), False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __str__(self):
+        """return summary of shared data as string representation"""
+        return ("SharedWorldData " + self.name + " of " + str(self.memory.size) + " bytes, " +
+                str(len(self.offsets) - 1) + " texts and " + str(len(self.cells)) + " cells")
+
+    def close(self):
+        """Detach from the shared memory, unlinking it if the owner"""
+        if self.memory == None:
+            return
+        for view in (self.offsets, self.blob, self.cells):
+            view.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+    def config(self):
+        """Return a SharedConfig reading the packed config"""
+        return SharedConfig(self)
+
+    def text(self, index):
+        """Return the decoded index'th text, using the LRU cache"""
+        cache = self.cache
+        value = cache.get(index)
+        if value is not None:
+            cache.move_to_end(index)
+            return value
+        value = str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+        cache[index] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return value
+
+    def decode(self, cell):
+        """Return the config value packed as cell"""
+        tag = cell & 3
+        if tag == _INT:
+            return cell >> 2
+        if tag == _NAME:
+            index = cell >> 2
+            name = self.names.get(index)
+            if name == None:
+                name = self.names[index] = self.text(index)
+            return name
+        if tag == _TEXT:
+            index = cell >> 2
+            handle = self.handles.get(index)
+            if handle == None:
+                handle = self.handles[index] = SharedText(self, index)
+            return handle
+        return None
+
+    def row(self, start, width):
+        """Return tuple of config values in the width cells from start,
+        leaving off any padding"""
+        cells = self.cells[start:start + width]
+        while width and cells[width - 1] == _ABSENT:
+            width -= 1
+        return tuple(self.decode(cells[i]) for i in range(width))
+
+
+class SharedSection(Sequence):
+    """ The rows of a config section packed in a SharedWorldData. """
+
+    def __init__(self, data, start, rows, width):
+        self.data = data
+        self.start = start
+        self.rows = rows
+        self.width = width
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, i):
+        """Return i'th row of section, decoded"""
+        if i < 0:
+            i += self.rows
+        if not 0 <= i < self.rows:
+            raise IndexError("section row out of range")
+        return self.data.row(self.start + i * self.width, self.width)
+
+
+class SharedConfig(Mapping):
+    """ Reads a config packed in a SharedWorldData like the config dict. """
+
+    def __init__(self, data):
+        self.data = data
+        self.sections = data.frame['sections']
+        self.others = data.frame['others']
+
+    def __getitem__(self, name):
+        """Return config section name, rows decoded as read"""
+        if name in self.sections:
+            section = SharedSection(self.data, *self.sections[name])
+            if name == 'messages':
+                return {message[0]: message[1] for message in section}
+            return section
+        return self.others[name]
+
+    def __iter__(self):
+        yield from self.sections
+        yield from self.others
+
+    def __len__(self):
+        return len(self.sections) + len(self.others)
+
+
+def pack(config):
+    """Return bytes of config packed for SharedWorldData, with its rows of
+    tables sections as cells, and other sections pickled.
+    Raises ValueError if a table holds a value which is not a string, int or None."""
+    texts = {}                  # distinct string: its index
+    def index(value):
+        return texts.setdefault(value, len(texts))
+    dialogues = config.get('dialogues', {})
+    cells = array('q')
+    sections = {}
+    for name, text_columns in TABLES.items():
+        if name not in config:
+            continue
+        rows = config[name]
+        if name == 'messages':
+            rows = list(rows.items())
+        width = max((len(row) for row in rows), default=0)
+        sections[name] = (len(cells), len(rows), width)
+        for row in rows:
+            for column, value in enumerate(row):
+                if value is None:
+                    cells.append(_NONE)
+                elif type(value) is int:
+                    cells.append((value << 2) | _INT)
+                elif type(value) is not str:
+                    raise ValueError("cannot share " + name + " config value " + repr(value))
+                elif column in text_columns and not (column == 2 and value in dialogues):
+                    cells.append((index(value) << 2) | _TEXT)
+                else:
+                    cells.append((index(value) << 2) | _NAME)
+            cells.extend([_ABSENT] * (width - len(row)))
+    others = {name: value for name, value in config.items() if name not in sections}
+    frame = pickle.dumps({'sections': sections, 'others': others})
+    encoded = [value.encode('utf-8') for value in texts]
+    offsets = array('q', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    blob_at = _HEADER.size + len(offsets) * offsets.itemsize
+    cells_at = blob_at + offsets[-1]
+    cells_at += -cells_at % cells.itemsize     # align cells for casting
+    frame_at = cells_at + len(cells) * cells.itemsize
+    image = bytearray(frame_at + len(frame))
+    _HEADER.pack_into(image, 0, _MAGIC, len(encoded), blob_at, cells_at, frame_at, len(frame))
+    image[_HEADER.size:blob_at] = offsets.tobytes()
+    image[blob_at:blob_at + offsets[-1]] = b"".join(encoded)
+    image[cells_at:frame_at] = cells.tobytes()
+    image[frame_at:] = frame
+    return image
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import json
+    import multiprocessing
+    import os
+    import tempfile
+    from game_config import default_config, grid_config, load_config
+    from string_table import text
+    from world import World
+    print("Test SharedWorldData\n")
+
+    winning = ["go east", "take knife", "go north", "take garlic", "go down",
+               "use torch", "take wine", "go up", "go sw", "go west",
+               "give wine", "go east", "go up", "go up", "go west",
+               "fight garlic", "take sword", "go east", "go down", "go down",
+               "fight sword", "take key", "leave sword", "shazam"]
+    with SharedWorldData.create(default_config) as data:
+        print(str(data))
+        shared = SharedWorldData.attach(data.name)
+        config = shared.config()
+        print("Rooms row: " + str(config['rooms'][2][:3]) + ", described: " +
+              text(config['rooms'][2][1]))
+        print("Sections same as config: " +
+              str(all([tuple(row) for row in default_config[name]] ==
+                      [tuple(text(value) for value in row) for row in config[name]]
+                      for name in ('rooms', 'links', 'items', 'enemies', 'friends', 'players'))) +
+              ", messages same: " + str({name: text(value) for name, value in
+                                         config['messages'].items()} == default_config['messages']))
+        world = World(config)
+        plain = World(default_config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for cmd in winning:
+                world.execute(cmd)
+                plain.execute(cmd)
+        print("World built from shared data: " + str(world))
+        print("Same state after winning script as world from config: " +
+              str(world.state() == plain.state()))
+        print("Cellar description: " + text(world.rooms["Cellar"].description))
+        shared.close()
+
+    def memory():
+        """Return (resident, private) MB of this process"""
+        sizes = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == "kB":
+                    sizes[fields[0].rstrip(":")] = int(fields[1])
+        return (sizes.get("Rss", 0) / 1024,
+                (sizes.get("Private_Clean", 0) + sizes.get("Private_Dirty", 0)) / 1024)
+
+    worker_world = None
+
+    def load_world(how, source):
+        """Build a world in a worker, from a json config file or shared data"""
+        global worker_world
+        if how == "shared":
+            config = SharedWorldData.attach(source).config()
+        else:
+            config = load_config(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker_world = World(config)
+            for room in list(worker_world.rooms.values())[:200]:
+                room.describe()
+        return memory()
+
+    # a large world with a distinct description for each room, as written by hand
+    big = grid_config(80, 80)
+    big['rooms'] = [(conf[0], "Room " + conf[0] + ": " + conf[1] + " " * 20 +
+                     " ".join("word%d" % ((i * 7919 + j) % 10007) for j in range(60)), None, None)
+                    for i, conf in enumerate(big['rooms'])]
+    workers = 32
+    print("\nMemory per worker of %d workers each building a %d room world" %
+          (workers, len(big['rooms'])))
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("(needs /proc/self/smaps_rollup, skipped)")
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            name = os.path.join(tmp, "big.json")
+            with open(name, 'w') as f:
+                json.dump(big, f)
+            del big
+            with SharedWorldData.create(load_config(name)) as data:
+                print(str(data))
+                for how, source in (("loaded", name), ("shared", data.name)):
+                    with multiprocessing.Pool(workers) as pool:
+                        results = pool.starmap(load_world, [(how, source)] * workers)
+                    resident = sum(result[0] for result in results) / workers
+                    private = sum(result[1] for result in results) / workers
+                    print("%s config: %.1f MB resident, %.1f MB private per worker, "
+                          "%.0f MB private in all" % (how, resident, private, private * workers))
@@ -0,0 +1,331 @@
+""" Shared multiplayer World where many players play concurrently.
+
+A SharedWorld holds one persistent World, which any number of players may
+join. Each player has their own location and inventory, and their commands
+may be run from different threads at the same time. Each room has its own
+lock, and a command only holds the locks for the rooms it can change:
+  - its current room for most commands,
+  - the current and destination room for 'go',
+  - the current and linked rooms for 'look', 'take' and 'talk'
+    (since a character may then wander off into a linked room).
+  - every room for 'hint' (which looks at the whole world's state).
+Locks are always taken in the same (room number) order, so commands never
+deadlock, and players only contend when they are in the same or
+neighbouring rooms. Commands for one player are run one at a time in order.
+
+Rules, hunters and timed events may change rooms far from the player whose
+command made them (eg. opening links, moving items or hunters, or closing
+doors), and share state across the world (the rule engine's player, the
+hunters' pursuit, the timers due). So in a world with any of these, commands
+are run one at a time, under the world lock, rather than by room. Timed
+events are driven by the shared world's own TimerWheel, advanced before
+each command.
+
+The output from each command is returned as a string, rather than printed,
+so each player can be sent just their own output, captured for each
+command's thread in its own buffer (see output.py).
+The turn count, shared by all players, is counted under the world's lock.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Player
+    from .output import captured
+    from .timers import TimerWheel
+    from .world import World
+except ImportError:        # run as a script rather than as a package
+    from character import Player
+    from output import captured
+    from timers import TimerWheel
+    from world import World
+import io
+import sys
+import threading
+
+class SharedWorld():
+    """ A persistent game World shared by many concurrent players. """
+
+    # commands which may let a room occupant wander into a linked room,
+    # or look into a linked room, so lock all linked rooms as well
+    neighbour_commands = ("look", "take", "talk")
+    # commands which look at every room, so lock them all
+    world_commands = ("hint",)
+
+    def __init__(self, config = None):
+        """Create shared world from config (default_config if none).
+        The config players become the first players who can join the world.
+        """
+        self.world = World(config)
+        self.world.allow_hints(config)
+        self.world.lock = threading.Lock()     # for what all players share, eg. turns
+        self.players = {}
+        self.players_lock = threading.Lock()
+        self.player_locks = {}
+        self.start_room = None
+        self.room_locks = {}            # room: (lock order, lock)
+        for number, room in enumerate(self.world.rooms.values()):
+            self.room_locks[room] = (number, threading.Lock())
+        # with rules, hunters or timed events, run commands one at a time
+        self.serial = (self.world.rules != None or len(self.world.hunters) > 0 or
+                       len(self.world.timed) > 0)
+        self.world_lock = (-1, threading.Lock())
+        self.wheel = None
+        if self.world.timed:
+            self.wheel = TimerWheel()
+            self.world.start_timers(self.wheel)
+        for name in self.world.characters:
+            character = self.world.characters[name]
+            if isinstance(character, Player):
+                self.players[name] = character
+                self.player_locks[name] = threading.Lock()
+                if self.start_room == None:
+                    self.start_room = character.get_location()
+        if self.start_room == None:
+            self.start_room = next(iter(self.world.rooms.values()))
+
+    def __str__(self):
+        """return world summary & number of players as string representation"""
+        return str(self.world) + " With " + str(len(self.players)) + " players."
+
+    def join(self, name, description = None):
+        """Add player with name to the world (if not already present),
+        in the starting room. Returns the player."""
+        with self.players_lock:
+            if name not in self.players:
+                player = Player(name, description)
+                player.move_to(self.start_room)
+                player.events = self.world.events   # eg. so rules see what they take
+                self.players[name] = player
+                self.player_locks[name] = threading.Lock()
+            return self.players[name]
+
+    def leave(self, name):
+        """Remove named player from world, leaving anything they carry in their room"""
+        with self.players_lock:
+            player = self.players.pop(name, None)
+            player_lock = self.player_locks.pop(name, None)
+        if player != None:
+            with player_lock, self.__locked([player.get_location()]):
+                for item, units in player.items.stacks():
+                    player.remove(item)
+                    player.get_location().leave(item, units)
+
+    def get_player(self, name):
+        """Return named player, or None if not in world"""
+        with self.players_lock:
+            return self.players.get(name)
+
+    def close(self):
+        """Cancel the world's timed events, when it is no longer played"""
+        self.world.stop_timers()
+
+    def rooms_for(self, player, cmd_words):
+        """Return list of rooms that command cmd_words by player may change"""
+        room = player.get_location()
+        if len(cmd_words) == 0:
+            return [room]
+        if cmd_words[0] == "go" and len(cmd_words) > 1:
+            destination = room.check_direction(cmd_words[1])
+            if destination != None and destination != room:
+                return [room, destination]
+        elif cmd_words[0] in SharedWorld.neighbour_commands:
+            return [room] + list(room.linked_rooms.values())
+        elif cmd_words[0] in SharedWorld.world_commands:
+            return list(self.world.rooms.values())
+        return [room]
+
+    def __locked(self, rooms):
+        """Return context manager holding locks for rooms, in lock order
+        (or just the world lock, if commands are run one at a time)"""
+        if self.serial:
+            return RoomLocks([self.world_lock])
+        return RoomLocks(sorted(set(self.room_locks[room] for room in rooms),
+                                key=lambda entry: entry[0]))
+
+    def command(self, name, inp):
+        """Run command line inp for named player, returning their output text.
+        The room is described when the player enters it, and if the
+        player's game ends they leave the world."""
+        with self.players_lock:
+            player = self.players.get(name)
+            player_lock = self.player_locks.get(name)
+        if player == None:
+            return "You are not in this world!\n"
+        with captured(io.StringIO()) as buffer, player_lock:
+            if self.get_player(name) is not player:     # left while waiting
+                return "You are not in this world!\n"
+            start = player.get_location()
+            with self.__locked(self.rooms_for(player, inp.split())):
+                if self.wheel != None:
+                    self.wheel.advance()
+                keep_playing = self.world.execute(inp, player)
+                if keep_playing and player.get_location() != start:
+                    print("You are in the:")
+                    player.get_location().describe()
+        if not keep_playing:
+            self.leave(name)
+        return buffer.getvalue()
+
+    def item_holders(self):
+        """Return dict of item name: list of holders, over all rooms, characters
+        and players, and containers they hold (every item should have exactly
+        one holder)."""
+        holders = {}
+        owners = (list(self.world.rooms.values()) +
+                  list(self.world.characters.values()) +
+                  list(self.players.values()))
+        for owner in set(owners):
+            inventory = owner.contents if hasattr(owner, 'contents') else owner.items
+            for item, units, inside in inventory.walk():
+                holders.setdefault(str(item), []).append(str(owner if inside == None else inside))
+        return holders
+
+
+class RoomLocks():
+    """ Context manager acquiring a list of (order, lock) in order,
+    and releasing them in reverse order. """
+
+    def __init__(self, locks):
+        """Create for locks, a list of (order, lock) sorted by order"""
+        self.locks = locks
+
+    def __enter__(self):
+        for order, lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        for order, lock in reversed(self.locks):
+            lock.release()
+        return False
+
+
+def stress_test(shared, num_players = 16, num_commands = 2000, seed = 1, hints = 0.001):
+    """Run num_commands random commands for each of num_players players in
+    their own threads (asking for hints with probability hints, as they are
+    slow), then check no item was duplicated or lost. Players whose game
+    ends join again. Returns True if every item has exactly one holder."""
+    import random
+    placed = set(shared.item_holders())
+    commands = ["go north", "go south", "go east", "go west", "go ne",
+                "go nw", "go sw", "go se", "go up", "go down", "look",
+                "talk", "list"]
+
+    def play(name, rand):
+        player = shared.join(name)
+        for i in range(num_commands):
+            if shared.get_player(name) is not player:
+                player = shared.join(name)      # lost a fight, so join again
+            room = player.get_location()
+            occupant = room.get_occupant()
+            choice = rand.random()
+            if choice < hints:
+                shared.command(name, "hint")
+            elif choice < 0.3 and not room.contents.is_empty():
+                what = rand.choice(list(room.contents.contents))
+                shared.command(name, "take " + what)
+            elif choice < 0.5 and not player.items.is_empty():
+                what = rand.choice(list(player.items.contents))
+                shared.command(name, rand.choice(["leave ", "give ", "use "]) + what)
+            elif choice < 0.55 and not player.items.is_empty():
+                what = rand.choice(list(player.items.contents))
+                shared.command(name, "put " + what + " in chest")
+            elif choice < 0.6 and occupant != None and not player.items.is_empty():
+                what = rand.choice(list(player.items.contents))
+                shared.command(name, "fight " + what)
+            elif (choice < 0.65 and occupant != None and
+                  not occupant.items.is_empty()):
+                what = rand.choice(list(occupant.items.contents))
+                shared.command(name, "take " + what)
+            else:
+                shared.command(name, rand.choice(commands))
+
+    threads = [threading.Thread(target=play,
+                                args=("Player" + str(i), random.Random(seed + i)))
+               for i in range(num_players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    holders = shared.item_holders()
+    ok = True
+    for name in placed:
+        if len(holders.get(name, [])) != 1:
+            print("Item " + name + " has holders " + str(holders.get(name, [])))
+            ok = False
+    for name in holders:
+        if name not in placed and (name not in shared.world.items or
+                                   len(holders[name]) != 1):
+            # items placed by rules must have just one holder too
+            print("Unexpected item " + name + " held by " + str(holders[name]))
+            ok = False
+    return ok
+
+
+def busy_config():
+    """Return the default config, with a chest to put things in, rules, a
+    hunter and timed events, which all change rooms far from the player"""
+    try:
+        from .game_config import default_config
+    except ImportError:        # run as a script rather than as a package
+        from game_config import default_config
+    config = dict(default_config)
+    config['items'] = default_config['items'] + [
+        ("chest", "A heavy oak chest", "Dining Hall"),
+        ("lantern", "A brass lantern", None),
+        ("scroll", "A dusty scroll", None)]
+    config['containers'] = [("chest", None)]
+    config['hunters'] = [("Ghoul", "A hungry ghoul", "Grrr", "Cellar",
+                          "garlic", "gnaws on you")]
+    config['rules'] = [
+        ("take", "knife", None, [], [("spawn", "lantern", "Library")],
+         "You hear something fall in the Library."),
+        ("enter", None, "Guest Room", [], [("give", "scroll")],
+         "A scroll flutters into your hands."),
+        ("use", "torch", "Cellar", [],
+         [("open_link", "Cellar", "north", "Ballroom", None)], "A passage opens!")]
+    config['timers'] = [("wander", "Mona", 0.01), ("close_link", "Entry Hall", "ne", 0.05),
+                        ("respawn", "Rusty", 0.02)]
+    return config
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import time
+    print("Test SharedWorld with default config\n")
+
+    shared = SharedWorld()
+    print(str(shared))
+    shared.join("Alice", "An intrepid explorer")
+    shared.join("Bob")
+    print("Alice> go east\n" + shared.command("Alice", "go east"))
+    print("Alice> take knife\n" + shared.command("Alice", "take knife"))
+    print("Bob> go east\n" + shared.command("Bob", "go east"))
+    print("Bob> take knife\n" + shared.command("Bob", "take knife"))
+    print("Alice> list\n" + shared.command("Alice", "list"))
+    print("Bob> exit\n" + shared.command("Bob", "exit"))
+    print("Players now: " + str(list(shared.players)))
+
+    print("\nStress test with 16 players in threads")
+    start = time.perf_counter()
+    stdout = sys.stdout
+    shared = SharedWorld()
+    ok = stress_test(shared, 16, 2000)
+    print("Items never duplicated or lost: " + str(ok) +
+          " (%.2f seconds)" % (time.perf_counter() - start))
+    print("Turns counted: " + str(shared.world.turns) + " of " + str(16 * 2000) +
+          ", stdout put back: " + str(sys.stdout is stdout))
+
+    print("\nStress test with rules, a hunter and timers, run one at a time")
+    start = time.perf_counter()
+    shared = SharedWorld(busy_config())
+    ok = stress_test(shared, 16, 1000)
+    shared.close()
+    print("Items never duplicated or lost: " + str(ok) +
+          " (%.2f seconds)" % (time.perf_counter() - start))
+    print("Commands run one at a time: " + str(shared.serial) +
+          ", rules fired: " + str(sorted(shared.world.rules.fired)) +
+          ", timers left: " + str(len(shared.world.timers)))
@@ -0,0 +1,162 @@
+""" Define StringTable used to share the text of a game world.
+
+Generated worlds repeat the same room, item and character descriptions
+many times, and configs loaded from json files hold a separate copy of
+each. A StringTable keeps just one copy of each distinct text. Short texts
+are kept as ordinary strings, while long texts are stored zlib compressed
+in a CompressedText, which is decompressed when printed (or passed to
+text()), through a small least recently used cache so the rooms being
+played in are shown without decompressing them every time. The table
+may be shared by worlds played in many threads (eg. a SharedWorld), so it
+is changed under its lock.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+from collections import OrderedDict
+import _thread          # for its lock, as threading is slow to import
+import sys
+import zlib
+
+class CompressedText():
+    """ A long text stored compressed in a StringTable.
+    Converting it to a string (eg. by print) decompresses it. """
+
+    __slots__ = ('data', 'table')
+
+    def __init__(self, data, table):
+        """Create compressed text with zlib data, from table"""
+        self.data = data
+        self.table = table
+
+    def __str__(self):
+        """return the decompressed text"""
+        return self.table.text(self)
+
+    def __len__(self):
+        """return length of the decompressed text"""
+        return len(self.table.text(self))
+
+
+def text(value):
+    """Return value as a plain string (or None), decompressing if needed"""
+    if value is None or type(value) is str:
+        return value
+    return str(value)
+
+
+class StringTable():
+    """ A table of distinct texts, with long texts stored compressed. """
+
+    def __init__(self, compress_over = 200, cache_size = 256):
+        """Create empty table compressing texts longer than compress_over
+        characters (never if None), with an LRU cache of cache_size texts."""
+        self.compress_over = compress_over
+        self.cache_size = cache_size
+        self.strings = {}           # short text: the one copy kept
+        self.compressed = {}        # digest of long text: CompressedText
+        self.cache = OrderedDict()  # CompressedText: decompressed text
+        self.raw_bytes = 0          # size of all texts interned (with repeats)
+        self.stored_bytes = 0       # size of the distinct texts as stored
+        self.hits = 0
+        self.misses = 0
+        self.lock = _thread.allocate_lock()     # held while changing the table or cache
+
+    def __str__(self):
+        """return table statistics as string representation"""
+        return (str(len(self.strings)) + " strings and " +
+                str(len(self.compressed)) + " compressed texts, storing " +
+                str(self.stored_bytes) + " of " + str(self.raw_bytes) + " bytes")
+
+    def intern(self, value):
+        """Return the table's shared copy of text value, compressed if long.
+        Values which are not strings (eg. None) are returned unchanged."""
+        if type(value) is not str:
+            return value
+        if self.compress_over == None or len(value) <= self.compress_over:
+            with self.lock:
+                self.raw_bytes += sys.getsizeof(value)
+                shared = self.strings.get(value)
+                if shared == None:
+                    shared = self.strings[value] = value
+                    self.stored_bytes += sys.getsizeof(value)
+            return shared
+        import hashlib          # only once texts are long, as slow to import
+        encoded = value.encode('utf-8')
+        digest = hashlib.blake2b(encoded, digest_size=16).digest()
+        with self.lock:
+            self.raw_bytes += sys.getsizeof(value)
+            shared = self.compressed.get(digest)
+            if shared == None:
+                shared = CompressedText(zlib.compress(encoded), self)
+                self.compressed[digest] = shared
+                self.stored_bytes += sys.getsizeof(shared.data) + sys.getsizeof(digest)
+        return shared
+
+    def text(self, compressed):
+        """Return the decompressed text of compressed, using the LRU cache"""
+        cache = self.cache
+        with self.lock:
+            value = cache.get(compressed)
+            if value is not None:
+                self.hits += 1
+                cache.move_to_end(compressed)
+                return value
+            self.misses += 1
+        value = zlib.decompress(compressed.data).decode('utf-8')
+        with self.lock:
+            cache[compressed] = value
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return value
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    print("Test StringTable class\n")
+
+    table = StringTable(compress_over=40, cache_size=2)
+    short = table.intern("A stubby candle.")
+    again = table.intern("A stubby " + "candle.")
+    print("Short texts shared: " + str(short is again))
+    long_text = "A musty smell pervades this room, packed with ancient tomes."
+    first = table.intern(long_text)
+    second = table.intern(long_text[:20] + long_text[20:])
+    print("Long texts shared: " + str(first is second) +
+          ", compressed: " + str(type(first).__name__))
+    print("Printing compressed text gives:")
+    print(first)
+    print("text() gives same: " + str(text(first) == long_text))
+    print("text(None) is " + str(text(None)))
+    for t in ["Another long text that will need to be compressed ok.",
+              "And yet another long text which will be compressed too."]:
+        print(table.intern(t))
+    print(first)
+    print("Cache hits " + str(table.hits) + ", misses " + str(table.misses))
+    print(str(table))
+
+    # measure a generated world loaded from json, with long descriptions
+    import contextlib
+    import io
+    import json
+    import time
+    try:
+        from .game_config import grid_config
+        from .world import World
+    except ImportError:
+        from game_config import grid_config
+        from world import World
+    config = grid_config(100, 100)
+    for i, conf in enumerate(config['rooms']):
+        config['rooms'][i] = (conf[0], conf[1] * 6, conf[2], conf[3])
+    config = json.loads(json.dumps(config))     # separate copy of every text
+    world = World(config)
+    print("\n10000 room world: " + str(world.strings))
+    room = world.rooms["0-0"]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(10000):
+            room.describe()
+    print("Hot room describe: %.1f usec" % ((time.perf_counter() - start) * 100))
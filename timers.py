@@ -0,0 +1,374 @@
+""" Timed events in game worlds, kept in a hierarchical timer wheel.
+
+Things can happen in a world without the player typing a command: a
+TimerWheel calls back the actions scheduled on it once their time has
+come, such as characters wandering every so many seconds (see wander),
+doors closing (see close_link) or enemies coming back to life (see
+respawn). Many worlds (eg. all the sessions of a SessionManager) share one
+wheel, advanced by an asyncio task (see TimerWheel.run), or by calling
+advance from any other main loop (as World.play and SessionManager.command
+do before each command).
+
+The optional 'timers' config section lists the timed events of a world,
+started on a wheel by World.start_timers:
+
+  ("wander", character, interval)       character wanders every interval seconds
+  ("close_link", room, direction, delay)  link from room closes after delay seconds
+  ("respawn", enemy, delay, [hp])       enemy comes back to life (with hp) after
+                                        delay seconds, if vanquished by then
+
+Timed events do not change a world when their timer is called back, but
+are deferred to the start of the player's next command (see World.defer),
+so they are journaled with it for undo, and what they print goes to that
+player's output.
+
+Time is counted in ticks (of 0.1 sec by default). The wheel has a few
+levels of 64 slots: level 0 holds the timers due in the next 64 ticks,
+one slot per tick, level 1 those due in the next 64 x 64 ticks, a slot
+per 64 ticks, and so on, with any due later still in an overflow slot.
+Each slot is a dict of its timers, so scheduling and cancelling a timer
+are just adding it to, or removing it from, a slot. Each tick calls back
+the timers in one level 0 slot, and every 64 ticks the next slot of
+level 1 is moved down into level 0 (and so on up the levels), so a timer
+is moved at most once per level, and each tick only touches the timers
+due, however many millions are waiting.
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .character import Enemy
+    from .combat import DEFAULT_HP
+except ImportError:        # run as a script rather than as a package
+    from character import Enemy
+    from combat import DEFAULT_HP
+import asyncio
+import math
+import time
+
+SLOT_BITS = 6
+"""Each level of a wheel has 2 ** SLOT_BITS slots."""
+
+
+class Timer():
+    """ A callback scheduled on a TimerWheel, repeating every interval ticks if given. """
+
+    __slots__ = ('due', 'callback', 'args', 'interval', 'slot')
+
+    def __init__(self, due, callback, args, interval = None):
+        """Create timer calling callback(*args) at tick due"""
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.slot = None            # dict of the slot it is in, None when not pending
+
+
+class TimerWheel():
+    """ Timers for the actions scheduled in game worlds, called back when due. """
+
+    def __init__(self, tick = 0.1, levels = 4, clock = time.monotonic):
+        """Create empty wheel of levels levels, counting ticks of tick seconds
+        of clock time since now."""
+        self.tick = tick
+        self.clock = clock
+        self.start = clock()
+        self.ticks = 0              # tick to be run next
+        self.size = 1 << SLOT_BITS
+        self.wheels = [[{} for i in range(self.size)] for level in range(levels)]
+        self.overflow = {}          # timers due after the top level
+        self.pending = 0
+        self.fired = 0
+        self.running = False
+
+    def __str__(self):
+        """return summary of wheel as string representation"""
+        return ("TimerWheel at tick " + str(self.ticks) + " with " + str(self.pending) +
+                " timers pending, " + str(self.fired) + " fired")
+
+    def __len__(self):
+        return self.pending
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) once, delay seconds from now (at the next tick
+        at least, counting from the tick to be run next), returning its Timer
+        (to cancel it)"""
+        timer = Timer(self.ticks + self.__ticks(delay), callback, args)
+        self.__insert(timer)
+        self.pending += 1
+        return timer
+
+    def every(self, interval, callback, *args):
+        """Call callback(*args) every interval seconds from now, until
+        cancelled, returning its Timer (to cancel it)"""
+        ticks = self.__ticks(interval)
+        timer = Timer(self.ticks + ticks, callback, args, ticks)
+        self.__insert(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer):
+        """Stop timer being called back, returning False if it was not pending"""
+        if timer.slot == None:
+            return False
+        del timer.slot[timer]
+        timer.slot = None
+        timer.interval = None
+        self.pending -= 1
+        return True
+
+    def __ticks(self, seconds):
+        """Return whole number of ticks (at least 1) to wait for seconds"""
+        return max(1, math.ceil(seconds / self.tick))
+
+    def __insert(self, timer):
+        """Put timer in the slot for its due tick: at the lowest level whose
+        block of ticks holds both now and the due tick"""
+        due = timer.due
+        ticks = self.ticks
+        for level, wheel in enumerate(self.wheels):
+            shift = SLOT_BITS * level
+            if due >> (shift + SLOT_BITS) == ticks >> (shift + SLOT_BITS):
+                slot = wheel[(due >> shift) & (self.size - 1)]
+                break
+        else:
+            slot = self.overflow
+        slot[timer] = True
+        timer.slot = slot
+
+    def __cascade(self):
+        """Move the timers of the slots of higher levels whose block of ticks
+        starts now down into the lower levels"""
+        ticks = self.ticks
+        for level in range(1, len(self.wheels)):
+            index = (ticks >> (SLOT_BITS * level)) & (self.size - 1)
+            moving = self.wheels[level][index]
+            self.wheels[level][index] = {}
+            for timer in moving:
+                self.__insert(timer)
+            if index != 0:
+                return
+        moving, self.overflow = self.overflow, {}
+        for timer in moving:
+            self.__insert(timer)
+
+    def advance(self, now = None):
+        """Run the ticks up to time now (default clock time), calling back
+        the timers due, returning how many were called"""
+        if now == None:
+            now = self.clock()
+        last = int((now - self.start) / self.tick)
+        fired = self.fired
+        mask = self.size - 1
+        while self.ticks <= last:
+            if self.pending == 0:           # nothing to do until next scheduled
+                self.ticks = last + 1
+                break
+            index = self.ticks & mask
+            if index == 0:
+                self.__cascade()
+            due = self.wheels[0][index]
+            if due:
+                self.wheels[0][index] = {}
+                for timer in list(due):
+                    if timer.slot is not due:       # cancelled by an earlier callback
+                        continue
+                    timer.slot = None
+                    self.pending -= 1
+                    self.fired += 1
+                    if timer.interval != None:      # repeat, before calling back
+                        timer.due += timer.interval
+                        self.__insert(timer)
+                        self.pending += 1
+                    timer.callback(*timer.args)
+            self.ticks += 1
+        return self.fired - fired
+
+    async def run(self):
+        """Advance the wheel every tick, until stop is called"""
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+    def stop(self):
+        """Stop the run task at its next tick"""
+        self.running = False
+
+def wander(world, wheel, name, interval):
+    """Have character name of world wander (as for random_move) every
+    interval seconds, returning its Timer"""
+    return wheel.every(interval, world.defer, world.characters[name].random_move)
+
+def close_link(world, wheel, room_name, direction, delay):
+    """Remove the link from room_name in direction (eg. a door closing)
+    after delay seconds, returning its Timer"""
+    return wheel.schedule(delay, world.defer, world.set_link, room_name, direction, None)
+
+def respawn(world, wheel, name, delay, hp = DEFAULT_HP):
+    """Bring enemy name of world back to life with hp, if it has been
+    vanquished, after delay seconds, returning its Timer"""
+    def revive():
+        enemy = world.characters[name]
+        if isinstance(enemy, Enemy) and enemy.revive(hp):
+            print(name + " stirs, and comes back to life!")
+    return wheel.schedule(delay, world.defer, revive)
+
+TIMED = {'wander': (wander, 'characters'), 'close_link': (close_link, 'rooms'),
+         'respawn': (respawn, 'characters')}
+"""Timed event kind in config: (function scheduling it, table its name is in)."""
+
+def check(world, conf):
+    """Raise ValueError if timed event conf (from config) is of unknown kind
+    or names an unknown room or character of world"""
+    if conf[0] not in TIMED:
+        raise ValueError("unknown timed event " + str(conf[0]))
+    if conf[1] not in getattr(world, TIMED[conf[0]][1]):
+        raise ValueError("timed event names unknown room or character " + str(conf[1]))
+
+def start(world, wheel, timed):
+    """Schedule the timed events listed in timed (from config) for world
+    on wheel, returning list of their Timers"""
+    return [TIMED[conf[0]][0](world, wheel, *conf[1:]) for conf in timed]
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import contextlib
+    import heapq
+    import io
+    import random
+    from game_config import default_config
+    from history import History
+    from item import Item, ItemKind
+    from query import WorldIndex
+    from world import World
+    print("Test TimerWheel\n")
+
+    now = [0.0]
+    wheel = TimerWheel(tick=1.0, clock=lambda: now[0])
+    calls = []
+    rand = random.Random(1)
+    timers = []
+    for i in range(20000):
+        delay = rand.choice([rand.randint(1, 100), rand.randint(1, 10000), rand.randint(1, 20000000)])
+        timers.append((wheel.schedule(delay, lambda i, due: calls.append((i, due, now[0])), i, delay),
+                       delay))
+    cancelled = set(rand.sample(range(len(timers)), 5000))
+    for i in cancelled:
+        wheel.cancel(timers[i][0])
+    while wheel.pending:
+        now[0] += rand.choice([1, 7, 300, 100000])
+        wheel.advance()
+    print("Fired " + str(len(calls)) + " of " + str(len(timers) - len(cancelled)) +
+          " (none cancelled: " + str(not cancelled & set(call[0] for call in calls)) +
+          "), each once: " + str(len(set(call[0] for call in calls)) == len(calls)) +
+          ", none early: " + str(all(call[2] >= call[1] for call in calls)))
+
+    now[0] = 0.0
+    wheel = TimerWheel(tick=1.0, clock=lambda: now[0])
+    later = []
+    wheel.schedule(2, lambda: wheel.cancel(later[0]))
+    later.append(wheel.schedule(2, calls.append, "later"))
+    now[0] = 5
+    print("Cancelled by an earlier callback due the same tick: " +
+          str(wheel.advance() == 1 and calls[-1] != "later"))
+
+    now[0] = 0.0
+    wheel = TimerWheel(tick=1.0, clock=lambda: now[0])
+    ticks = []
+    repeat = wheel.every(3, lambda: ticks.append(now[0]))
+    for second in range(1, 11):
+        now[0] = second
+        wheel.advance()
+    wheel.cancel(repeat)
+    now[0] = 20
+    wheel.advance()
+    print("Every 3 seconds, fired at: " + str(ticks) + ", then cancelled: " + str(wheel))
+
+    print("\nWorld events on an asyncio loop")
+    config = dict(default_config)
+    config['timers'] = [("wander", "Mona", 0.05), ("close_link", "Entry Hall", "ne", 0.1),
+                        ("respawn", "Rusty", 0.2)]
+    world = World(config)
+    History(world)
+    wheel = TimerWheel(tick=0.01)
+    moves = []
+    world.events.subscribe("move", lambda character, old, new:
+                           character.name == "Mona" and moves.append(str(new)))
+    world.characters["Mona"].set_prob_move(1.0)
+    mona_was = world.characters["Mona"].get_location()
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("go east")
+        world.execute("take knife")
+        world.execute("go west")
+    print("Entry Hall links: " + str(list(world.rooms["Entry Hall"].linked_rooms)))
+    index = WorldIndex(world)
+    rusty = world.characters["Rusty"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        rusty.fight(Item("bone", kind=ItemKind(attack=100)))
+    print("Rusty indexed as vanquished: " + str(rusty in index.characters(vanquished=True)))
+    world.start_timers(wheel)
+    async def play_for(seconds):
+        task = asyncio.ensure_future(wheel.run())
+        await asyncio.sleep(seconds)
+        wheel.stop()
+        await task
+    asyncio.run(play_for(0.5))
+    print("Timed events due: " + str(len(world.due)) + ", Mona moved before next command: " +
+          str(len(moves)))
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        world.execute("look")
+    print("Mona wandered " + str(len(moves)) + " times, eg. to " + ", ".join(moves[:3]) +
+          ", still wandering: " + str(world.timers[0].slot != None))
+    print("Entry Hall links after door closes: " + str(list(world.rooms["Entry Hall"].linked_rooms)))
+    restored = World(config)
+    restored.restore(world.state())
+    print("... and in a world restored to its state: " +
+          str(list(restored.rooms["Entry Hall"].linked_rooms)))
+    print("Rusty vanquished after respawn: " + str(rusty.was_vanquished()) +
+          ", indexed as vanquished: " + str(rusty in index.characters(vanquished=True)) +
+          ", told player: " + str("Rusty stirs, and comes back to life!" in output.getvalue()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        world.execute("undo")
+    print("After undo, Entry Hall links: " + str(list(world.rooms["Entry Hall"].linked_rooms)) +
+          ", Rusty vanquished: " + str(rusty.was_vanquished()) + ", Mona back: " +
+          str(world.characters["Mona"].get_location() == mona_was))
+    world.stop_timers()
+    print("After stopping timers: " + str(wheel))
+
+    print("\nTiming 1000000 timers: schedule, cancel half, advance through them")
+    now[0] = 0.0
+    wheel = TimerWheel(tick=1.0, clock=lambda: now[0])
+    rand = random.Random(2)
+    delays = [rand.randint(1, 100000) for i in range(1000000)]
+    def nothing():
+        pass
+    start = time.perf_counter()
+    timers = [wheel.schedule(delay, nothing) for delay in delays]
+    scheduled = time.perf_counter() - start
+    start = time.perf_counter()
+    for timer in timers[::2]:
+        wheel.cancel(timer)
+    cancelled = time.perf_counter() - start
+    start = time.perf_counter()
+    now[0] = 1000
+    fired_early = wheel.advance()
+    early = time.perf_counter() - start
+    start = time.perf_counter()
+    now[0] = 100000
+    fired = fired_early + wheel.advance()
+    ran = time.perf_counter() - start
+    print("schedule %.2f usec, cancel %.2f usec each" %
+          (scheduled * 1e6 / len(timers), cancelled * 1e6 / (len(timers) // 2)))
+    print("first 1000 ticks in %.3f sec calling %d due, all %d called in %.2f sec"
+          % (early, fired_early, fired, early + ran))
+    heap = []
+    start = time.perf_counter()
+    for i, delay in enumerate(delays):
+        heapq.heappush(heap, (delay, i))
+    print("(heapq push for comparison %.2f usec, with no cancel)"
+          % ((time.perf_counter() - start) * 1e6 / len(delays)))
@@ -0,0 +1,413 @@
+""" Validate a game configuration, and analyse its graph of rooms.
+
+World.__init__ stops at the first bad config record it finds, and cannot
+notice problems with the shape of the world, such as rooms the player can
+never reach. validate_config checks a whole config without building a World,
+reporting every problem found at once:
+  - duplicate room, item or character names,
+  - links to unknown rooms, or reusing a direction in a room,
+  - one way links (no direction back) and asymmetric links (where the
+    room linked to has no link back at all),
+  - rooms the player cannot reach from their starting room,
+  - one way traps: rooms the player can reach, but never get back from,
+  - rooms with no exits, and dead ends (only one exit),
+  - items placed in unknown rooms, characters or containers (or in a
+    container listed after them), and containers which are not items,
+  - key items, weaknesses, desires and success items that are not items,
+  - characters in unknown rooms, or sharing a room with another character,
+  - dialogues going to unknown nodes, or with unknown conditions or effects,
+  - not having exactly one player.
+It also reports the number of connected components of the room graph,
+and its diameter (the longest shortest path between two rooms).
+
+The room links are held in flat arrays (compressed sparse rows) and
+searched breadth first over room numbers, so a config with a million rooms
+is checked in seconds. The diameter is exact for small worlds, and a
+(lower bound) estimate from a double sweep search for large ones.
+
+Usually used via the package command line, eg.
+
+  python -m rpg validate game_config.json
+
+Written for the Object-oriented Programming in Python (OOPP) MOOC
+Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
+"""
+
+try:
+    from .dialogue import Dialogue
+except ImportError:        # run as a script rather than as a package
+    from dialogue import Dialogue
+from array import array
+
+class ValidationReport():
+    """ The problems found in a game config, and statistics about its rooms. """
+
+    def __init__(self, title):
+        """Create empty report for config with title"""
+        self.title = title
+        self.problems = []          # list of (severity, section, message)
+        self.stats = {}
+
+    def __str__(self):
+        """return report listing all problems and statistics"""
+        lines = ["Validation of " + str(self.title) + ": " +
+                 str(len(self.errors())) + " errors, " +
+                 str(len(self.problems) - len(self.errors())) + " warnings"]
+        for severity, section, message in self.problems:
+            lines.append("  " + severity + " in " + section + ": " + message)
+        for name in self.stats:
+            lines.append("  " + name + ": " + str(self.stats[name]))
+        return "\n".join(lines)
+
+    def error(self, section, message):
+        """Record an error (which would stop the game being played properly)"""
+        self.problems.append(("error", section, message))
+
+    def warning(self, section, message):
+        """Record a warning (which is probably a mistake)"""
+        self.problems.append(("warning", section, message))
+
+    def some(self, severity, section, messages, limit = 20):
+        """Record the first limit of a list of problem messages,
+        then a count of how many more there were."""
+        for message in messages[:limit]:
+            self.problems.append((severity, section, message))
+        if len(messages) > limit:
+            self.problems.append((severity, section, "and " +
+                                  str(len(messages) - limit) + " more like this"))
+
+    def errors(self):
+        """Return list of problems which are errors"""
+        return [problem for problem in self.problems if problem[0] == "error"]
+
+    def is_valid(self):
+        """Return True if no errors were found"""
+        return len(self.errors()) == 0
+
+
+class RoomGraph():
+    """ The links between rooms as flat arrays over room numbers.
+    The links out of room r go to rooms targets[offsets[r]:offsets[r+1]],
+    and links into room r come from sources[in_offsets[r]:in_offsets[r+1]]
+    (only built when needed, as they are the same as the links out if the
+    graph is symmetric, ie. every link has a link back).
+    """
+
+    def __init__(self, num_rooms, link_from, link_to):
+        """Create graph of num_rooms rooms with links link_from[i] to link_to[i]"""
+        self.num_rooms = num_rooms
+        self.link_from = link_from
+        self.link_to = link_to
+        self.offsets, self.targets = _compress(num_rooms, link_from, link_to)
+        self.in_offsets = None
+        self.sources = None
+        self.symmetric = False
+
+    def links_in(self):
+        """Return (in_offsets, sources) arrays of links into each room"""
+        if self.symmetric:
+            return self.offsets, self.targets
+        if self.in_offsets == None:
+            self.in_offsets, self.sources = _compress(self.num_rooms,
+                                                      self.link_to, self.link_from)
+        return self.in_offsets, self.sources
+
+    def exits(self, room):
+        """Return number of links out of room"""
+        return self.offsets[room + 1] - self.offsets[room]
+
+    def search(self, starts, forward = True, both = False, distance = None):
+        """Breadth first search from list of starts, following links forward
+        (or backward, or both ways), returning array of distances (-1 where
+        not reached). The last room reached is left in self.last,
+        and the number of rooms reached in self.reached."""
+        n = self.num_rooms
+        if distance == None:
+            distance = array('l', [-1]) * n
+        queue = array('l', starts)
+        for room in starts:
+            distance[room] = 0
+        lists = []
+        if forward or (both and self.symmetric):
+            lists.append((self.offsets, self.targets))
+        if not forward or (both and not self.symmetric):
+            lists.append(self.links_in())
+        if both and not self.symmetric:
+            lists.append((self.offsets, self.targets))
+        head = 0
+        append = queue.append
+        if len(lists) == 1:             # usual case, just one list of links
+            offsets, links = lists[0]
+            while head < len(queue):
+                room = queue[head]
+                head += 1
+                next_distance = distance[room] + 1
+                for other in links[offsets[room]:offsets[room + 1]]:
+                    if distance[other] < 0:
+                        distance[other] = next_distance
+                        append(other)
+        while head < len(queue):
+            room = queue[head]
+            head += 1
+            next_distance = distance[room] + 1
+            for offsets, links in lists:
+                for other in links[offsets[room]:offsets[room + 1]]:
+                    if distance[other] < 0:
+                        distance[other] = next_distance
+                        append(other)
+        self.last = queue[-1] if len(queue) > 0 else None
+        self.reached = len(queue)
+        return distance
+
+def _compress(n, link_from, link_to):
+    """Return (offsets, targets) arrays grouping link_to by link_from room"""
+    offsets = array('l', [0]) * (n + 1)
+    for room in link_from:
+        offsets[room + 1] += 1
+    for room in range(n):
+        offsets[room + 1] += offsets[room]
+    targets = array('l', [0]) * len(link_to)
+    fill = array('l', offsets[:n])
+    for i in range(len(link_from)):
+        room = link_from[i]
+        targets[fill[room]] = link_to[i]
+        fill[room] += 1
+    return offsets, targets
+
+
+def validate_config(config, exact_diameter_limit = 2000):
+    """Check config, returning a ValidationReport of all problems found.
+    The diameter is found exactly if there are at most exact_diameter_limit
+    rooms, otherwise estimated."""
+    report = ValidationReport(config.get('title'))
+    for section in ('title', 'rooms', 'links', 'items', 'enemies', 'friends',
+                    'players', 'messages', 'success'):
+        if section not in config:
+            report.error(section, "section missing from config")
+    if not report.is_valid():
+        return report
+
+    # number the rooms
+    number = {}
+    names = []
+    for conf in config['rooms']:
+        if conf[0] in number:
+            report.error("rooms", "duplicate room " + str(conf[0]))
+            continue
+        number[conf[0]] = len(names)
+        names.append(conf[0])
+    n = len(names)
+
+    # check links, collecting them as arrays of room numbers
+    link_from = array('l')
+    link_to = array('l')
+    directions = set()              # (room number, direction) of each link
+    reused = []                     # (room number, direction) used twice
+    one_way = []
+    add_from, add_to = link_from.append, link_to.append
+    for conf in config['links']:
+        room, other = number.get(conf[0]), number.get(conf[2])
+        if room == None or other == None:
+            unknown = conf[0] if room == None else conf[2]
+            report.error("links", "link " + str(tuple(conf)) +
+                         " to unknown room " + str(unknown))
+            continue
+        used = len(directions)
+        directions.add((room, conf[1]))
+        add_from(room)
+        add_to(other)
+        if conf[3] != None:
+            directions.add((other, conf[3]))
+            add_from(other)
+            add_to(room)
+            used += 1
+        if len(directions) != used + 1:
+            reused.append(conf)
+        if conf[3] == None:
+            one_way.append("one way link " + str(conf[0]) + " " +
+                           str(conf[1]) + " to " + str(conf[2]))
+    report.some("warning", "links", one_way)
+    report.some("error", "links", [str(tuple(conf)) + " reuses a direction already used"
+                                   for conf in reused])
+    graph = RoomGraph(n, link_from, link_to)
+
+    # check items & characters
+    items = set()
+    for conf in config['items']:
+        if conf[0] in items:
+            report.error("items", "duplicate item " + str(conf[0]))
+        items.add(conf[0])
+        if " " in str(conf[0]):
+            report.warning("items", "item " + str(conf[0]) +
+                           " has a space in its name, so can't be used in commands")
+    characters = {}
+    occupants = {}
+    for section, where, wants in (("enemies", 3, 4), ("hunters", 3, 4),
+                                  ("friends", 3, 4), ("players", 2, None)):
+        for conf in config.get(section, []):
+            if conf[0] in characters:
+                report.error(section, "duplicate character " + str(conf[0]))
+            characters[conf[0]] = section
+            if conf[where] not in number:
+                report.error(section, str(conf[0]) + " is in unknown room " + str(conf[where]))
+            elif section != "players":
+                if conf[where] in occupants:
+                    report.error(section, str(conf[0]) + " and " +
+                                 occupants[conf[where]] + " are both in " + str(conf[where]))
+                occupants[conf[where]] = conf[0]
+            if wants != None and conf[wants] != None and conf[wants] not in items:
+                report.error(section, str(conf[0]) + " wants unknown item " + str(conf[wants]))
+    if len(config['players']) != 1:
+        report.error("players", "there must be exactly 1 player, not " +
+                     str(len(config['players'])))
+    containers = set()
+    for conf in config.get('containers', []):
+        if conf[0] not in items:
+            report.error("containers", "container " + str(conf[0]) + " is not an item")
+        if conf[1] != None and conf[1] not in items:
+            report.error("containers", str(conf[0]) + " has unknown key item " + str(conf[1]))
+        containers.add(conf[0])
+    placed = set()
+    for conf in config['items']:
+        if conf[2] in containers and conf[2] not in placed:
+            report.error("items", "item " + str(conf[0]) + " placed in container " +
+                         str(conf[2]) + " before it is listed")
+        elif (conf[2] != None and conf[2] not in number and conf[2] not in characters and
+              conf[2] not in containers):
+            report.error("items", "item " + str(conf[0]) + " placed in unknown holder " +
+                         str(conf[2]))
+        placed.add(conf[0])
+    for conf in config['rooms']:
+        if conf[3] != None and conf[2] not in items:
+            report.error("rooms", str(conf[0]) + " has unknown key item " + str(conf[2]))
+    success = config['success']
+    for i, what in ((1, "item needed"), (2, "item not to have")):
+        if success[i] != None and success[i] not in items:
+            report.warning("success", what + " " + str(success[i]) + " is not an item")
+    for name, nodes in config.get('dialogues', {}).items():
+        try:
+            Dialogue(name, nodes)
+        except (ValueError, TypeError) as msg:
+            report.error("dialogues", str(msg))
+    for name in ('help', 'intro', 'exit_success', 'exit_fail'):
+        if name not in config['messages']:
+            report.error("messages", "missing message " + name)
+
+    # analyse room graph from the player's starting room
+    analyse_rooms(report, graph, names, config, number, exact_diameter_limit)
+    return report
+
+def main(args):
+    """Validate config file given in parsed command line args, printing report.
+    Returns True if config is valid."""
+    try:
+        from .game_config import load_config
+    except ImportError:
+        from game_config import load_config
+    report = validate_config(load_config(args.config))
+    print(str(report))
+    return report.is_valid()
+
+def analyse_rooms(report, graph, names, config, number, exact_diameter_limit):
+    """Add problems with the shape of the room graph, and its statistics, to report"""
+    n = graph.num_rooms
+    report.stats['rooms'] = n
+    report.stats['links'] = len(graph.targets)
+    if n == 0:
+        report.error("rooms", "there are no rooms")
+        return
+    exits = [graph.exits(room) for room in range(n)]
+    report.some("warning", "rooms",
+                [names[room] + " has no exits" for room in range(n) if exits[room] == 0])
+    report.stats['dead ends'] = sum(1 for count in exits if count == 1)
+
+    # asymmetric links: room linked to has no link back at all
+    asymmetric = []
+    offsets, targets = graph.offsets, graph.targets
+    for room in range(n):
+        for other in targets[offsets[room]:offsets[room + 1]]:
+            if room not in targets[offsets[other]:offsets[other + 1]]:
+                asymmetric.append(names[room] + " links to " + names[other] +
+                                  " which has no link back")
+    report.some("warning", "links", asymmetric)
+    graph.symmetric = len(asymmetric) == 0
+
+    # connected components, ignoring link direction, from the player's start first
+    start = None
+    if len(config['players']) > 0 and config['players'][0][2] in number:
+        start = number[config['players'][0][2]]
+    component = array('l', [-1]) * n
+    components = 0
+    largest = 0
+    far = None                      # furthest room from first room searched
+    reach = None
+    for room in ([start] if start != None else []) + list(range(n)):
+        if component[room] < 0:
+            graph.search([room], both=True, distance=component)
+            components += 1
+            largest = max(largest, graph.reached)
+            if far == None:
+                far = graph.last
+                if graph.symmetric and start != None:
+                    reach = array('l', component)
+    report.stats['connected components'] = components
+    report.stats['largest component'] = largest
+
+    # reachability from the player's start, and traps from which start can't be reached
+    # (no traps if every link has a link back)
+    if start != None:
+        if reach == None:
+            reach = graph.search([start])
+        unreachable = [names[room] + " can't be reached from the start"
+                       for room in range(n) if reach[room] < 0]
+        report.some("error", "rooms", unreachable)
+        if not graph.symmetric:
+            back = graph.search([start], forward=False)
+            report.some("error", "rooms",
+                        [names[room] + " is a one way trap, the start can't be reached from it"
+                         for room in range(n) if reach[room] >= 0 and back[room] < 0])
+        report.stats['reachable rooms'] = n - len(unreachable)
+        report.stats['furthest room from start'] = max(reach)
+
+    # diameter of graph, ignoring link direction
+    if n <= exact_diameter_limit:
+        diameter = 0
+        for room in range(n):
+            diameter = max(diameter, max(graph.search([room], both=True)))
+        report.stats['diameter'] = diameter
+    else:
+        distance = graph.search([far], both=True)
+        report.stats['diameter (estimate)'] = max(distance)
+
+
+# Diagnostic main to test class
+# "run this diagnostic test script if run file rather than importing it."
+if __name__ == "__main__":
+    import copy
+    import sys
+    import time
+    from game_config import default_config, grid_config
+    print("Test validation of default config\n")
+
+    print(str(validate_config(default_config)))
+
+    broken = copy.deepcopy(default_config)
+    broken['rooms'].append(("Attic", "A dusty attic.", None, None))
+    broken['rooms'].append(("Pit", "A deep pit you can't climb out of.", None, None))
+    broken['links'].append(("Library", "down", "Pit", None))
+    broken['links'].append(("Library", "east", "Attic", "west"))
+    broken['links'].append(("Kitchen", "down", "Attic", "up"))
+    broken['items'].append(("spoon", "A silver spoon", "Nobody"))
+    broken['items'].append(("ring", "A gold ring", "casket"))
+    broken['items'].append(("casket", "A small casket", "Library"))
+    broken['containers'] = [("casket", "key"), ("box", None)]
+    broken['dialogues'] = {'ghoul': [("start", "Grr", [("Run", "away", None, None)])]}
+    broken['enemies'].append(("Ghoul", "A ghoul", "Grr", "Parlour", "stake", None))
+    print("\n" + str(validate_config(broken)))
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    config = grid_config(size, size)
+    start = time.perf_counter()
+    report = validate_config(config)
+    print("\n" + str(report))
+    print("Validated %d rooms in %.2f sec" % (size * size, time.perf_counter() - start))
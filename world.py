@@ -11,123 +11,422 @@ Written for the Object-oriented Programming in Python (OOPP) MOOC
 Code additions Copyright 2018 by Lawrie Brown, licence CC-BY-NC-SA 3.0.
 """
 
-from character import Character, Enemy, Friend, Player
-from game_config import default_config
-from item import Item, Inventory
-from room import Room
+try:
+    from .character import Character, Enemy, Friend, Hunter, Player
+    from .combat import DEFAULT_HP, DEFAULT_ENEMY_ATTACK
+    from .events import Events
+    from .item import Item, ItemKind, Container, Inventory
+    from .room import Room
+    from .string_table import StringTable
+except ImportError:        # run as a script rather than as a package
+    from character import Character, Enemy, Friend, Hunter, Player
+    from combat import DEFAULT_HP, DEFAULT_ENEMY_ATTACK
+    from events import Events
+    from item import Item, ItemKind, Container, Inventory
+    from room import Room
+    from string_table import StringTable
+import importlib
 import sys
 
+IMPORT_BUDGET_MS = {'': 2, 'world': 10}
+"""Budget for python -X importtime of the package & world.py, in msec, so
+starting a worker (see runner.py) or the command line stays quick, as the
+package loads most modules, and World the optional engines, on first use."""
+
 class World():
     """ Contains all the details used in the adventure game.
     This includes all rooms and their links, characters, and items.
     It also has the main game loop in the play method used to run the game.
     """
 
-    def __init__(self, config = None):
+    def __init__(self, config = None, strings = None):
         """Create a game world using the supplied configuration details.
         If no config specified, then use default_config world configuration.
         The game world has: title, rooms, characters, items, messages,
         and the success criteria.
+        All descriptions, conversations & messages are kept in the strings
+        StringTable (which may be shared by many worlds), or a new one if None.
+        Changes to rooms & characters are announced through self.events.
         """
         # use default_config is none supplied
         if config == None:
-            config = default_config
+            config = _engine("game_config").default_config
+        if strings == None:
+            strings = StringTable()
 
-        # instance variables for a world
+        # instance variables for a world (not the config, whose text is in strings)
         self.title = config['title']
-        self.rooms = {}
-        self.items = {}
-        self.characters = {}
+        self.rooms = self.new_table("rooms")
+        self.items = self.new_table("items")
+        self.characters = self.new_table("characters")
         self.player = None
-        self.messages = config['messages']
+        self.hunters = []       # enemies pursuing the player
+        self.pursuit = None     # DistanceField to the player, if any hunters
+        self.strings = strings
+        self.events = Events()
+        self.messages = {name: strings.intern(config['messages'][name])
+                         for name in config['messages']}
         self.success = config['success']
+        self.turns = 0          # number of commands the player has entered
+        self.lock = None        # lock held to count turns & make layout, if players share the world
+        self.history = None     # History of changes for undo, if kept
+        self.timed = []         # timed events in config (see timers.py)
+        self.timers = []        # their Timers, once started on self.wheel
+        self.wheel = None
+        self.due = []           # (action, args) of timed events due, made at next command
+        self.kinds = {}         # data of ItemKind: the one shared ItemKind
+        self.rules = None       # RuleEngine for rules in config, if any
+        self.layout = None      # MapLayout of rooms, made by the first map command
+        self.hinter = None      # Hinter for the hint command, if allowed
+        self.links = {}         # (room name, direction) of links changed in play: name at start
+        self.container_keys = {conf[0]: conf[1] for conf in config.get('containers', [])}
 
         # populate the world using the configuration details
         try:
             # configure rooms
             doing = "rooms"
             # room config has: (name, description, key_item, used_msg)*
-            keyitems = []               # list of key items to config later
             for conf in config['rooms']:
-                self.rooms[conf[0]] = Room(conf[0], conf[1])
-                if conf[3] != None:     # key items to be set when have items
-                    keyitems.append((conf[0], conf[2], conf[3]))        # (room, item, msg)
+                self.add_room(conf)
 
             # configure links between rooms
             doing = "links"
             # links config has: (room1, direction1, room2, direction2)*
             for conf in config['links']:
-                self.rooms[conf[0]].link_room(self.rooms[conf[2]], conf[1], conf[3] )
+                self.add_link(conf)
             # configure items
             doing = "items"
             # items config has: (name, description, location)
             player_items = []           # list of player items to config later
             for conf in config['items']:
-                self.items[conf[0]] = Item(conf[0], conf[1])
-                if conf[2] in self.rooms:     # place item in room
-                    self.rooms[conf[2]].leave(self.items[conf[0]])
-                else:                   # item on character to add later
-                    player_items.append((conf[0], conf[2]))
+                if not self.add_item(conf):     # item on character to add later
+                    player_items.append(conf)
+
+            doing = "containers"
+            # optional containers config has: (item name, key_item)*
+            for conf in config.get('containers', []):
+                self.set_container_key(conf)
 
-            # now configure key_items in rooms - has (room, item, msg)
+            # now configure key_items in rooms
             doing = "key_items"
-            for conf in keyitems:
-                self.rooms[conf[0]].set_key_item(self.items[conf[1]], conf[2])
+            for conf in config['rooms']:
+                self.set_key_item(conf)
+
+            doing = "dialogues"
+            # optional dialogues config has: { name: [ (node_id, text, choices)* ] }
+            self.dialogues = {}
+            if config.get('dialogues'):
+                self.dialogues = _engine("dialogue").compile_dialogues(config, strings)
 
             # configure characters (enemies, friends, player)
             doing = "enemies"
             # links config has: (name, description, conversation, location, weakness, defeat_msg)*
             for conf in config['enemies']:
-                self.characters[conf[0]] = Enemy(conf[0], conf[1])
-                self.characters[conf[0]].set_conversation(conf[2])
-                self.characters[conf[0]].move_to(self.rooms[conf[3]])
-                if conf[4] != None:
-                    self.characters[conf[0]].set_weakness(self.items[conf[4]], conf[5])
+                self.add_enemy(conf)
+
+            doing = "hunters"
+            # optional hunters config is as for enemies, who pursue the player
+            for conf in config.get('hunters', []):
+                self.add_hunter(conf)
 
             doing = "friends"
             # friends config has: (name, description, conversation, location, desire, thank_msg)*
             for conf in config['friends']:
-                self.characters[conf[0]] = Friend(conf[0], conf[1])
-                self.characters[conf[0]].set_conversation(conf[2])
-                self.characters[conf[0]].move_to(self.rooms[conf[3]])
-                if conf[4] != None:
-                    self.characters[conf[0]].set_desires(self.items[conf[4]], conf[5])
+                self.add_friend(conf)
 
             doing = "players"
             # players config has: (name, description, location)*
             num_players = 0
             for conf in config['players']:
-                self.characters[conf[0]] = Player(conf[0], conf[1])
-                self.characters[conf[0]].move_to(self.rooms[conf[2]])
-                self.player = self.characters[conf[0]]
+                self.add_player(conf)
                 num_players += 1
             if num_players != 1:
                 print ("You can only have 1 player character in the game!")
 
-            # now configure player_items on characters - has (item, character)
+            # now configure player_items on characters
             doing = "player_items"
             for conf in player_items:
-                self.characters[conf[1]].add(self.items[conf[0]])
+                self.characters[conf[2]].add(self.items[conf[0]], self.item_quantity(conf))
+
+            doing = "rules"
+            # optional rules config has: (when, what, where, conditions, actions, message)*
+            if config.get('rules'):
+                _engine("rules").RuleEngine(self, config['rules'])
+
+            doing = "timers"
+            # optional timers config has: (kind, name, ...)*
+            for conf in config.get('timers', []):
+                _engine("timers").check(self, conf)
+                self.timed.append(tuple(conf))
 
         except (IndexError, KeyError, ValueError) as msg:
             print ("### Error: Incorrect format or values in " + doing + " config: " + str(conf))
             print(str(msg))
             raise
 
+    # Methods to build the world from config details
+    def new_table(self, kind):
+        """Return new empty table of name: thing for kind of things ("rooms",
+        "items" or "characters"), a dict here, which subclasses may replace
+        (eg. to make things on first use, see procedural.py)"""
+        return {}
+
+    def add_room(self, conf):
+        """Add room from config (name, description, key_item, used_msg).
+        The key item is set later by set_key_item, once the items exist."""
+        room = self.rooms[conf[0]] = Room(conf[0], self.strings.intern(conf[1]))
+        room.events = self.events
+
+    def set_key_item(self, conf):
+        """Set room's key item & used message from room config, if it has one"""
+        if conf[3] != None:
+            self.rooms[conf[0]].set_key_item(self.items[conf[2]],
+                                             self.strings.intern(conf[3]))
+
+    def add_link(self, conf):
+        """Add link from config (room1, direction1, room2, direction2)"""
+        self.rooms[conf[0]].link_room(self.rooms[conf[2]], conf[1], conf[3])
+
+    def add_item(self, conf):
+        """Add item from config (name, description, location, [attack, quantity]),
+        as a Container if it is listed in the containers config.
+        Places item in location if it is a room (or a container listed before it),
+        or nowhere if None (eg. until placed by a rule), returning True,
+        otherwise returns False, leaving item to be placed on a character."""
+        if conf[0] in self.container_keys:
+            item = self.items[conf[0]] = Container(conf[0], kind=self.item_kind(conf))
+            item.events = self.events
+        else:
+            item = self.items[conf[0]] = Item(conf[0], kind=self.item_kind(conf))
+        if conf[2] == None:           # not placed anywhere yet
+            return True
+        if conf[2] in self.rooms:     # place item in room
+            self.rooms[conf[2]].leave(item, self.item_quantity(conf))
+            return True
+        if isinstance(self.items.get(conf[2]), Container):     # or in container
+            self.items[conf[2]].items.add(item, self.item_quantity(conf))
+            return True
+        return False
+
+    def set_link(self, room_name, direction, to_name):
+        """Link room_name in direction to room to_name (or remove link if None),
+        as rules & timed events do in play, announcing the change"""
+        room = self.rooms[room_name]
+        old = room.check_direction(direction)
+        self.links.setdefault((room_name, direction), None if old == None else old.name)
+        self.__relink(room, direction, to_name)
+        if self.pursuit != None:
+            self.pursuit.relink()
+        self.events.emit("link", room, direction, old, room.check_direction(direction))
+
+    def __relink(self, room, direction, to_name):
+        """Link room in direction to room to_name (or remove link if None),
+        without announcing it"""
+        if to_name == None:
+            room.linked_rooms.pop(direction, None)
+        else:
+            room.linked_rooms[direction] = self.rooms[to_name]
+
+    def item_kind(self, conf):
+        """Return the ItemKind shared by items with the description, attack,
+        and whether stackable (if given a quantity), of item config"""
+        kind = ItemKind(self.strings.intern(conf[1]),
+                        conf[3] if len(conf) > 3 and conf[3] != None else 0,
+                        len(conf) > 4 and conf[4] != None)
+        return self.kinds.setdefault(kind.key(), kind)
+
+    def set_item_stats(self, conf):
+        """Set item's description, attack, and whether stackable, from its config"""
+        self.items[conf[0]].set_kind(self.item_kind(conf))
+
+    def set_container_key(self, conf):
+        """Set container's key item from containers config (name, key_item)"""
+        if conf[1] != None:
+            self.items[conf[0]].set_key(self.items[conf[1]])
+
+    def item_quantity(self, conf):
+        """Return units of item placed at the start, from its config"""
+        return conf[4] if len(conf) > 4 and conf[4] != None else 1
+
+    def add_enemy(self, conf, kind = Enemy):
+        """Add enemy (of class kind) from config
+        (name, description, conversation, location, weakness, defeat_msg, [hp, attack])"""
+        text = self.strings.intern
+        enemy = self.characters[conf[0]] = kind(conf[0], text(conf[1]))
+        enemy.events = self.events
+        self.set_conversation(enemy, conf[2])
+        enemy.move_to(self.rooms[conf[3]])
+        if conf[4] != None:
+            enemy.set_weakness(self.items[conf[4]], text(conf[5]))
+        self.set_enemy_stats(conf)
+
+    def add_hunter(self, conf):
+        """Add hunter from config, as for an enemy, who pursues the player"""
+        self.add_enemy(conf, Hunter)
+        self.hunters.append(self.characters[conf[0]])
+        if self.pursuit == None:
+            self.pursuit = _engine("pursuit").DistanceField(self.rooms)
+
+    def set_enemy_stats(self, conf):
+        """Set enemy's hp & attack from the optional last fields of its config"""
+        enemy = self.characters[conf[0]]
+        enemy.set_hp(conf[6] if len(conf) > 6 and conf[6] != None else DEFAULT_HP)
+        enemy.set_attack(conf[7] if len(conf) > 7 and conf[7] != None
+                         else DEFAULT_ENEMY_ATTACK)
+
+    def add_friend(self, conf):
+        """Add friend from config
+        (name, description, conversation, location, desire, thank_msg)"""
+        text = self.strings.intern
+        friend = self.characters[conf[0]] = Friend(conf[0], text(conf[1]))
+        friend.events = self.events
+        self.set_conversation(friend, conf[2])
+        friend.move_to(self.rooms[conf[3]])
+        if conf[4] != None:
+            friend.set_desires(self.items[conf[4]], text(conf[5]))
+
+    def set_conversation(self, character, conversation):
+        """Set character's conversation from its config, or dialogue if it names one"""
+        if conversation in self.dialogues:
+            character.set_dialogue(self.dialogues[conversation])
+        else:
+            character.set_dialogue(None)
+            character.set_conversation(self.strings.intern(conversation))
+
+    def add_player(self, conf):
+        """Add player from config (name, description, location, [hp])"""
+        player = self.characters[conf[0]] = Player(conf[0], self.strings.intern(conf[1]))
+        player.events = self.events
+        if len(conf) > 3 and conf[3] != None:
+            player.set_hp(conf[3])
+        player.move_to(self.rooms[conf[2]])
+        self.player = player
+
     def __str__(self):
         """return name as string representation of this world."""
         return (self.title + " has " + str(len(self.rooms)) + " rooms, " +
             str(len(self.characters)) + " characters, and " +
             str(len(self.items)) + " items.")
 
-    def __check_success(self):
+    def counters(self):
+        """Return the game metrics used by the success criteria for this world.
+
+        Counted from the state of this world's own rooms and characters,
+        rather than the class-wide counters (which are shared by every world
+        created in the same process), as a dict with keys:
+        vanquished, desires_met, rooms_visited, turns.
+        """
+        vanquished = 0
+        desires_met = 0
+        for character in self.characters.values():
+            if isinstance(character, Enemy) and character.was_vanquished():
+                vanquished += 1
+            elif isinstance(character, Friend) and character.get_desire_met():
+                desires_met += 1
+        rooms_visited = 0
+        for room in self.rooms.values():
+            if room.visited:
+                rooms_visited += 1
+        return {'vanquished': vanquished, 'desires_met': desires_met,
+                'rooms_visited': rooms_visited, 'turns': self.turns}
+
+    def state(self):
+        """Return what has changed in this world as it is played, as a dict
+        of plain values, from which restore can bring a world built from the
+        same config back to this state. Only rooms which have been visited,
+        used or hold things are included, and containers holding things.
+        Units of stackable items held are kept in a dict of name: units after
+        each list of item names, and links changed in play (eg. by rules or
+        timed events) as [room, direction, room linked (or None)]."""
+        rooms = {}
+        for name, room in self.rooms.items():
+            if room.visited or room.item_used or not room.contents.is_empty():
+                rooms[name] = (room.visited, room.item_used, list(room.contents.contents),
+                               dict(room.contents.counts))
+        characters = {name: self.character_state(character)
+                      for name, character in self.characters.items()}
+        containers = {name: (list(item.items.contents), dict(item.items.counts))
+                      for name, item in self.items.items()
+                      if isinstance(item, Container) and not item.items.is_empty()}
+        links = []
+        for room_name, direction in self.links:
+            linked = self.rooms[room_name].check_direction(direction)
+            links.append([room_name, direction, None if linked == None else linked.name])
+        return {'rooms': rooms, 'characters': characters, 'containers': containers,
+                'fired': [] if self.rules == None else list(self.rules.fired),
+                'links': links, 'turns': self.turns}
+
+    def character_state(self, character):
+        """Return state of character, as kept for each in state:
+        (location name, item names, hp, flags, units of stackable items)"""
+        location = character.get_location()
+        flags = {flag: getattr(character, flag)
+                 for flag in ('vanquished', 'desire_met', 'escaped')
+                 if hasattr(character, flag)}
+        if character.dialogue != None:
+            flags['node'] = character.node
+        return (None if location == None else location.get_name(),
+                list(character.items.contents), character.hp, flags,
+                dict(character.items.counts))
+
+    def restore(self, state):
+        """Bring this world to the state (from state) of a world built from the
+        same config. Changes are made directly, without announcing events."""
+        for room in self.rooms.values():
+            room.visited = False
+            room.item_used = False
+            room.occupant = None
+            room.contents.clear()
+        for character in self.characters.values():
+            character.items.clear()
+        for name, (item_names, counts) in state.get('containers', {}).items():
+            self.__restore_items(self.items[name].items, item_names, counts)
+        for name, (visited, item_used, item_names, counts) in state['rooms'].items():
+            room = self.rooms[name]
+            room.visited = visited
+            room.item_used = item_used
+            self.__restore_items(room.contents, item_names, counts)
+        for name, (location, item_names, hp, flags, counts) in state['characters'].items():
+            character = self.characters[name]
+            character.location = None if location == None else self.rooms[location]
+            if character.location != None and not isinstance(character, Player):
+                character.location.occupant = character
+            self.__restore_items(character.items, item_names, counts)
+            character.hp = hp
+            for flag in flags:
+                setattr(character, flag, flags[flag])
+        if self.rules != None:
+            self.rules.restore(state.get('fired', []))
+        if 'links' in state:
+            for (room_name, direction), start in self.links.items():
+                self.__relink(self.rooms[room_name], direction, start)
+            for room_name, direction, to_name in state['links']:
+                room = self.rooms[room_name]
+                old = room.check_direction(direction)
+                self.links.setdefault((room_name, direction), None if old == None else old.name)
+                self.__relink(room, direction, to_name)
+            if self.links and self.pursuit != None:
+                self.pursuit.relink()
+        self.turns = state['turns']
+
+    def __restore_items(self, inventory, item_names, counts):
+        """Put named items, with counts of units of stackable ones, in inventory"""
+        for item_name in item_names:
+            item = self.items[item_name]
+            inventory.contents[item_name] = item
+            if item.stackable:
+                inventory.counts[item_name] = counts.get(item_name, 1)
+        inventory.reindex()
+
+    def __check_success(self, player):
         """Check whether player has met success criteria for game on exit."""
-        item_needed = self.player.find(self.success[1])
-        item_not_have = self.player.find(self.success[2])
+        item_needed = player.find(self.success[1])
+        item_not_have = player.find(self.success[2])
+        counts = self.counters()
         if ((item_needed != None) and (item_not_have == None) and
-            (Enemy.num_vanquished >= self.success[3]) and
-            (Friend.num_desires_met >= self.success[4]) and
-            (Room.num_rooms_visited >= self.success[5])):
+            (counts['vanquished'] >= self.success[3]) and
+            (counts['desires_met'] >= self.success[4]) and
+            (counts['rooms_visited'] >= self.success[5])):
             return True
         else:
             return False
@@ -145,11 +444,12 @@ class World():
             return False
 
         #setup details for main loop
-        current_room = self.player.get_location()       # starting room
-        escaped = False         # whether have met conditions to escape
+        if self.history == None:
+            _engine("history").History(self)     # so player can undo
+        if self.timed and self.wheel == None:
+            self.start_timers(_engine("timers").TimerWheel())
         keep_playing = True     # whether game continues
         last_described = None   # room last described so describe on entry
-        magic_word = self.success[0]    # magic word to escape
         print("Welcome to " + self.title)
         print(self.messages['intro'])
         self.player.carries()
@@ -158,180 +458,433 @@ class World():
         while keep_playing:
 
             # give details about current location if new room
+            current_room = self.player.get_location()
             if current_room != last_described:
                 print("You are in the:")
                 current_room.describe()
                 last_described = current_room
 
-            # get input from user & split into words
-            inp = input("> ")
+            # get input from user
+            try:
+                inp = input("> ")
+            except EOFError:    # end of piped input, treat as exit
+                print("")
+                break
+            if self.wheel != None:
+                self.wheel.advance()
+            keep_playing = self.execute(inp)
+
+        # leaving game, see if escaped or not
+        self.stop_timers()
+        counts = self.counters()
+        print("You have vanquished " + str(counts['vanquished']) + " enemies.")
+        print("You have met " + str(counts['desires_met']) + " friend's desires.")
+        print("You have visited " + str(counts['rooms_visited']) + " rooms.")
+        self.player.carries()
+        if self.player.escaped:
+            print(self.messages['exit_success'])
+            return True
+        else:
+            print(self.messages['exit_fail'])
+            return False
+
+    def execute(self, inp, player = None):
+        """Execute one command line inp for player (default self.player).
+
+        Prints the response to the command, and updates the player's location.
+        Returns True if the player keeps playing, False if their game is over
+        (having exited, escaped, or lost a fight). Sets player.escaped if the
+        player escaped with the magic word.
+        Any hunters then move towards the player.
+        If a history is kept, the changes are journaled, and the commands
+        undo & redo move back & forward through them.
+        """
+        if player == None:
+            player = self.player
+        if self.rules != None:
+            self.rules.player = player
+        if self.history != None:
             cmd_words = inp.split()
-            if len(cmd_words) == 0:
-                continue
-            command = cmd_words[0]
+            if cmd_words and cmd_words[0] in ("undo", "redo"):
+                self.__undo_redo(cmd_words[0])
+                return True
+            self.history.begin(inp, player)
+        if self.due:
+            self.__run_due()
+        keep_playing = self.__command(inp, player)
+        if keep_playing and self.hunters:
+            self.move_hunters(player)
+        if self.history != None:
+            self.history.commit()
+        return keep_playing
+
+    def __undo_redo(self, command):
+        """Undo or redo the latest command, saying which"""
+        if command == "undo":
+            done = self.history.undo()
+        else:
+            done = self.history.redo()
+        if done == None:
+            print("There is nothing to " + command + ".")
+        else:
+            print("You " + command + ": " + done)
+
+    def fork(self, config, node = None):
+        """Return a new world, built from config (the one this world was built
+        from), in the state this world was in after history node (default the
+        latest), sharing the history up to it. Without a history, the new
+        world is in this world's current state."""
+        world = type(self)(config, self.strings)
+        _engine("history").History(world)
+        if self.history != None:
+            world.history.replay(self.history.node if node == None else node)
+        else:
+            world.restore(self.state())
+        return world
+
+    def start_timers(self, wheel):
+        """Schedule the timed events of this world on TimerWheel wheel, to be
+        made at the start of the next command after each is due"""
+        self.stop_timers()
+        if self.timed:
+            self.wheel = wheel
+            self.timers = _engine("timers").start(self, wheel, self.timed)
+
+    def stop_timers(self):
+        """Cancel the timed events of this world (eg. when it is closed)"""
+        for timer in self.timers:
+            self.wheel.cancel(timer)
+        self.timers = []
+        self.wheel = None
+
+    def defer(self, action, *args):
+        """Make action(*args) (eg. a timed event) at the start of the next
+        command, so its changes are journaled with it, and what it prints
+        goes to that command's output"""
+        self.due.append((action, args))
+
+    def __run_due(self):
+        """Make the actions deferred until now, in the order they fell due"""
+        due, self.due = self.due, []
+        for action, args in due:
+            action(*args)
+
+    def allow_hints(self, config):
+        """Let the player ask for hints with the hint command, from the Hinter
+        shared by worlds built from config (the one this world was built from)"""
+        self.hinter = _hinter(config)
+
+    def move_hunters(self, player):
+        """Move hunters a step towards player, telling player of any arriving"""
+        room = player.get_location()
+        self.pursuit.update(room)
+        for hunter in self.hunters:
+            if hunter.pursue(self.pursuit) and hunter.get_location() == room:
+                print(hunter.get_name() + " arrives, hunting you down!")
+
+    def __command(self, inp, player):
+        """Execute command line inp for player, returning whether keep playing"""
+        current_room = player.get_location()
+        magic_word = self.success[0]    # magic word to escape
 
-            # process requested command
-            if command == "exit":
-                keep_playing = False
+        # split input into words
+        cmd_words = inp.split()
+        if len(cmd_words) == 0:
+            return True
+        command = cmd_words[0]
+        if self.lock == None:
+            self.turns += 1
+        else:
+            with self.lock:
+                self.turns += 1
+
+        # quantity of an item to move (see __quantity) must be at least 1
+        if (command in ("give", "leave", "drop", "put", "take") and len(cmd_words) >= 3
+                and cmd_words[1].isdigit() and int(cmd_words[1]) < 1):
+            print("You can't " + command + " " + cmd_words[1] + " " + cmd_words[2] +
+                  ", you need to say at least 1!")
+            return True
 
-            # fight current room occupant
-            elif command == "fight":
-                occupant = current_room.get_occupant()
-                if occupant == None:
-                    print( "Fight who? There's no-one here!" )
-                    continue
-                if len(cmd_words) < 2:
-                    print("You need to say what you want to fight with!")
-                    continue
-                what = cmd_words[1]
-                weapon = self.player.find(what)
-                if weapon != None:
-                    if not occupant.fight(weapon):
-                        keep_playing = False
-                else:
-                    print("You don't have " + what + " to fight with!")
+        # process requested command
+        if command == "exit":
+            return False
 
-            # give item to current room occupant
-            elif command == "give":
-                if len(cmd_words) < 2:
-                    print("You need to say what item you want to give!")
-                    continue
+        # fight current room occupant
+        elif command == "fight":
+            occupant = current_room.get_occupant()
+            if occupant == None:
+                print( "Fight who? There's no-one here!" )
+                return True
+            if len(cmd_words) < 2:
+                print("You need to say what you want to fight with!")
+                return True
+            what = cmd_words[1]
+            weapon = player.find(what)
+            if weapon != None:
+                if not occupant.fight(weapon, player):
+                    return False
+            else:
+                print("You don't have " + what + " to fight with!")
+
+        # give item to current room occupant
+        elif command == "give":
+            if len(cmd_words) < 2:
+                print("You need to say what item you want to give!")
+                return True
+            quantity, what = self.__quantity(cmd_words)
+            if not player.has(what):
+                print("You don't have " + what + " to give!")
+                return True
+            occupant = current_room.get_occupant()
+            if occupant == None:
+                print("There is no-one here to give " + what + " to!")
+                return True
+            item = player.find(what)
+            units = _units(player.items, what, quantity)
+            if occupant.give(item, units):
+                player.remove(item, units)
+
+        # go to room in specified direction
+        elif command == "go":
+            if len(cmd_words) < 2:
+                print("You need to say what direction you want to go in!")
+                return True
+            direction = cmd_words[1]
+            player.move_to(current_room.move(direction))
+
+        # display help text
+        elif command == "help":
+            print (self.messages['help'])
+
+        # suggest next command toward escaping
+        elif command == "hint":
+            if self.hinter == None:
+                print("There are no hints in this game.")
+            else:
+                suggestion = self.hinter.hint(self, player)
+                if suggestion == None:
+                    print("You are on your own now, there is no way out from here!")
+                else:
+                    print("Perhaps try: " + suggestion)
+
+        # leave item in current room
+        elif command == "leave" or command == "drop":
+            if len(cmd_words) < 2:
+                print("You need to say what item you want to leave!")
+                return True
+            quantity, what = self.__quantity(cmd_words)
+            if not player.has(what):
+                print("You don't have " + what + " to leave!")
+                return True
+            item = player.find(what)
+            units = _units(player.items, what, quantity)
+            player.remove(item, units)
+            current_room.leave(item, units)
+
+        # put item into a container carried or in current room
+        elif command == "put":
+            words = [word for word in cmd_words if word not in ("in", "into")]
+            if len(words) < 3:
+                print("You need to say what item you want to put in what!")
+                return True
+            quantity, what = self.__quantity(words[:-1])
+            where = words[-1]
+            if not player.has(what):
+                print("You don't have " + what + " to put away!")
+                return True
+            container = player.find(where)
+            holder = player.items
+            if container == None:
+                container = current_room.find(where)
+                holder = current_room.contents
+            if not isinstance(container, Container):
+                print("You can't put things in " + where + "!")
+                return True
+            item = player.find(what)
+            if item == container or (isinstance(item, Container) and item.items.has(where)):
+                print("You can't put " + what + " inside itself!")
+                return True
+            if self.__unlocked([container] + holder.containers(where), player):
+                units = _units(player.items, what, quantity)
+                player.remove(item, units)
+                container.items.add(item, units)
+                print("You put the " + what + " in the " + where)
+
+        # list items player currently has
+        elif command == "list" or command == "have":
+            player.describe()
+
+        # draw map of rooms visited around current room
+        elif command == "map":
+            if self.layout == None:
+                if self.lock == None:
+                    self.layout = _map_layout(self, current_room)
+                else:
+                    with self.lock:     # so players share the first layout made
+                        if self.layout == None:
+                            self.layout = _map_layout(self, current_room)
+            print("\n".join(self.layout.render(player)))
+
+        # describe current room
+        elif command == "look":
+            if len(cmd_words) >= 2:     # get description of some item or room
                 what = cmd_words[1]
-                if not self.player.has(what):
-                    print("You don't have " + what + " to give!")
-                    continue
                 occupant = current_room.get_occupant()
-                if occupant == None:
-                    print("There is no-one here to give " + what + " to!")
-                    continue
-                item = self.player.find(what)
-                if occupant.give(item):
-                    self.player.remove(item)
-
-            # go to room in specified direction
-            elif command == "go":
-                if len(cmd_words) < 2:
-                    print("You need to say what direction you want to go in!")
-                    continue
-                direction = cmd_words[1]
-                current_room = current_room.move(direction)
-                self.player.move_to(current_room)
-
-            # display help text
-            elif command == "help":
-                print (self.messages['help'])
-
-            # leave item in current room
-            elif command == "leave" or command == "drop":
-                if len(cmd_words) < 2:
-                    print("You need to say what item you want to leave!")
-                    continue
-                what = cmd_words[1]
-                if not self.player.has(what):
-                    print("You don't have " + what + " to leave!")
-                    continue
-                item = self.player.find(what)
-                self.player.remove(item)
-                current_room.leave(item)
-
-            # list items player currently has
-            elif command == "list" or command == "have":
-                self.player.describe()
-
-            # describe current room
-            elif command == "look":
-                if len(cmd_words) >= 2:     # get description of some item or room
-                    what = cmd_words[1]
-                    occupant = current_room.get_occupant()
-                    item = self.player.find(what)    # see if player has item
+                item = player.find(what)    # see if player has item
+                if item != None:
+                    item.describe()
+                elif occupant != None and what == occupant.get_name():    # occupant
+                    occupant.describe()
+                elif current_room.has(what):    # or item in room
+                    item = current_room.find(what)
                     if item != None:
                         item.describe()
-                    elif occupant != None and what == occupant.get_name():    # occupant
-                        occupant.describe()
-                    elif current_room.has(what):    # or item in room
-                        item = current_room.find(what)
-                        if item != None:
-                            item.describe()
-                    elif occupant != None and occupant.has(what):   # or on occupant
-                        item = occupant.find(what)
-                        if item != None:
-                            item.describe()
-                    elif what in current_room.linked_rooms:
-                        current_room.linked_rooms[what].describe()
-                    else:                   # invalid item or room direction
-                        print("There is no " + what + " here to look at!")                
-                    continue
-                # otherwise just describe what you carry & current room
-                self.player.carries()
-                print("You are in the:")
-                current_room.describe()
-
-            # take item from current room occupant
-            elif command == "take":
-                if len(cmd_words) < 2:
-                    print("You need to say what item you want to take!")
-                    continue
-                what = cmd_words[1]
-                occupant = current_room.get_occupant()
-                if occupant != None and occupant.has(what):
-                    took = occupant.take(what)
-                    if took != None:
-                        self.player.add(took)
-                elif current_room.has(what):           
-                    took = current_room.take(what)
-                    if took != None:
+                elif occupant != None and occupant.has(what):   # or on occupant
+                    item = occupant.find(what)
+                    if item != None:
+                        item.describe()
+                elif what in current_room.linked_rooms:
+                    current_room.linked_rooms[what].describe()
+                else:                   # invalid item or room direction
+                    print("There is no " + what + " here to look at!")                
+                return True
+            # otherwise just describe what you carry & current room
+            player.carries()
+            print("You are in the:")
+            current_room.describe()
+
+        # take item from current room occupant
+        elif command == "take":
+            if len(cmd_words) < 2:
+                print("You need to say what item you want to take!")
+                return True
+            quantity, what = self.__quantity(cmd_words)
+            occupant = current_room.get_occupant()
+            if occupant != None and occupant.has(what):
+                units = _units(occupant.items, what, quantity)
+                took = occupant.take(what, units)
+                if took != None:
+                    player.add(took, units)
+            elif current_room.has(what):           
+                if not self.__unlocked(current_room.contents.containers(what), player):
+                    return True
+                units = _units(current_room.contents, what, quantity)
+                took = current_room.take(what, units)
+                if took != None:
+                    if took.stackable:
+                        print("You take " + str(units) + " " + what)
+                    else:
                         print("You take the " + what)
-                        self.player.add(took)
-                else:
-                    print(what + " is not here to take!")
-
-            # talk to current room occupant
-            elif command == "talk":
-                occupant = current_room.get_occupant()
-                if occupant == None:
-                    print( "Talk to who? There's no-one here!" )
-                else:
-                    occupant.talk()
-
-            # use item in current room
-            elif command == "use":
-                if len(cmd_words) < 2:
-                    print("You need to say what item you want to use!")
-                    continue
-                what = cmd_words[1]
-                item = self.player.find(what)           # see it player has item
-                if item == None:
-                    item = current_room.find(what)      # or if item in room
-                if item != None:
-                    if not current_room.use(item):
-                        print("Nothing much seems to happen.")
-                else:
-                    print("You don't have " + what + " to use!")
-
-            # command is magic word to escape, check if successful or not!
-            elif command == magic_word:
-                escaped = self.__check_success()
-                if escaped:
-                    keep_playing = False
-                    print("There is a blinding flash of light ... and you are elsewheresville!")
-                else:
-                    print("The word echoes around the room ... but nothing else happens")
+                    player.add(took, units)
+            elif player.items.containers(what):     # take out of container carried
+                if self.__unlocked(player.items.containers(what), player):
+                    item = player.find(what)
+                    units = _units(player.items, what, quantity)
+                    print("You take " + (str(units) + " " if item.stackable else "the ") +
+                          what + " out of the " + str(player.items.containers(what)[0]))
+                    player.remove(item, units)
+                    player.add(item, units)
+            else:
+                print(what + " is not here to take!")
 
-            # unrecognized command
+        # talk to current room occupant
+        elif command == "talk":
+            occupant = current_room.get_occupant()
+            if occupant == None:
+                print( "Talk to who? There's no-one here!" )
+            else:
+                occupant.talk(player)
+
+        # answer current room occupant's dialogue
+        elif command == "say":
+            occupant = current_room.get_occupant()
+            if occupant == None:
+                print( "Say that to who? There's no-one here!" )
+            elif len(cmd_words) < 2 or not cmd_words[1].isdigit():
+                print("You need to say the number of your choice!")
+            else:
+                occupant.say(int(cmd_words[1]), player)
+
+        # use item in current room
+        elif command == "use":
+            if len(cmd_words) < 2:
+                print("You need to say what item you want to use!")
+                return True
+            what = cmd_words[1]
+            item = player.find(what)           # see it player has item
+            if item == None:
+                item = current_room.find(what)      # or if item in room
+            if item != None:
+                used = current_room.use(item)
+                if self.rules != None and self.rules.trigger("use", what, current_room.name):
+                    used = True
+                if not used:
+                    print("Nothing much seems to happen.")
             else:
-                print("Unknown command. 'help' lists (most) available commands.")
+                print("You don't have " + what + " to use!")
+
+        # command is magic word to escape, check if successful or not!
+        elif command == magic_word:
+            if self.__check_success(player):
+                player.escaped = True
+                print("There is a blinding flash of light ... and you are elsewheresville!")
+                return False
+            else:
+                print("The word echoes around the room ... but nothing else happens")
 
-        # leaving game, see if escaped or not
-        print("You have vanquished " + str(Enemy.num_vanquished) + " enemies.")
-        print("You have met " + str(Friend.num_desires_met) + " friend's desires.")
-        print("You have visited " + str(Room.num_rooms_visited) + " rooms.")
-        self.player.carries()
-        if escaped:
-            print(self.messages['exit_success'])
-            return True
+        # unrecognized command
         else:
-            print(self.messages['exit_fail'])
-            return False
+            print("Unknown command. 'help' lists (most) available commands.")
+        return True
+
+    def __quantity(self, cmd_words):
+        """Return (quantity or None, item name) from command words,
+        which are either: command item, or: command quantity item"""
+        if len(cmd_words) >= 3 and cmd_words[1].isdigit():
+            return int(cmd_words[1]), cmd_words[2]
+        return None, cmd_words[1]
+
+    def __unlocked(self, containers, player):
+        """Return True if player has the key to each locked container in list,
+        otherwise say which one is locked & return False"""
+        for container in containers:
+            key = container.get_key()
+            if key != None and not player.has(key.get_name()):
+                print("The " + container.get_name() + " is locked!")
+                return False
+        return True
+
+def _units(inventory, item_name, quantity):
+    """Return units of named item to move from inventory: all of them if
+    quantity is None, else quantity, but no more than it holds"""
+    held = inventory.count(item_name)
+    return held if quantity == None else min(quantity, held)
+
+def _map_layout(world, start):
+    """Return new MapLayout of world's rooms from room start, importing
+    mapview.py on first use, as few games need it"""
+    try:
+        from .mapview import MapLayout
+    except ImportError:        # run as a script rather than as a package
+        from mapview import MapLayout
+    return MapLayout(world, start)
+
+def _engine(name):
+    """Return the named module of the game (eg. rules or timers), importing
+    it on first use, as few games need each, so that importing world.py
+    stays quick (see IMPORT_BUDGET_MS)"""
+    if __package__:
+        return importlib.import_module("." + name, __package__)
+    return importlib.import_module(name)    # run as a script rather than as a package
+
+def _hinter(config):
+    """Return the Hinter shared by worlds built from config, importing
+    hints.py on first use, as few games need it"""
+    try:
+        from .hints import hinter
+    except ImportError:        # run as a script rather than as a package
+        from hints import hinter
+    return hinter(config)
 
 
 # Diagnostic main to test class
@@ -359,3 +912,45 @@ if __name__ == "__main__":
         print ("\nmessages: " + str(test_world.messages))
         print ("\nsuccess: " + str(test_world.success))
 
+
+    print("\nTaking stacked coins from the Entry Hall")
+    default_config = _engine("game_config").default_config
+    coins_config = dict(default_config)
+    coins_config['items'] = default_config['items'] + [
+        ("coins", "Shiny gold coins", "Entry Hall", None, 10)]
+    coins_world = World(coins_config)
+    for command in ["take 0 coins", "take 3 coins", "leave 0 coins", "leave 1 coins"]:
+        print("> " + command)
+        coins_world.execute(command)
+    print("Player has " + str(coins_world.player.items.count("coins")) + " coins, Entry Hall has " +
+          str(coins_world.rooms["Entry Hall"].contents.count("coins")))
+
+    print("\nAsking for hints, before and after allowing them")
+    for command in ["hint", "allow", "hint"]:
+        if command == "allow":
+            coins_world.allow_hints(coins_config)
+        else:
+            print("> " + command)
+            coins_world.execute(command)
+
+    print("\nImport times (best of 5, bytecode cached) against budget")
+    import os
+    import subprocess
+    import tempfile
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    package = os.path.basename(package_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=tmp)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        for name, budget in IMPORT_BUDGET_MS.items():
+            module = package + ("." + name if name else "")
+            times = []
+            for i in range(6):          # first run caches the bytecode
+                result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                         "import " + module], cwd=os.path.dirname(package_dir),
+                                        env=env, capture_output=True, text=True)
+                times += [int(line.split("|")[1]) / 1000 for line in result.stderr.splitlines()
+                          if line.endswith("| " + module)]
+            took = min(times[1:])
+            print("import %-20s %6.2f msec, budget %d msec: %s"
+                  % (module, took, budget, "ok" if took <= budget else "OVER BUDGET"))